@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def user_cache_key(user_id):
+    return f'auth:user-columns:{user_id}'
+
+
+def forget_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+def cached_columns(model):
+    # Everything auth and the views read off request.user; the password hash stays out of the cache
+    return [field.attname for field in model._meta.concrete_fields if field.attname != 'password']
+
+
+def get_cached_user(user_id):
+    """
+    The user with ``user_id`` and the token-revocation hash of their password,
+    from the shared cache or one select; None if there is no such user. The
+    instance comes back with ``password`` deferred and no profile attached
+    (it loads on first use), and save() only writes the cached columns.
+    """
+    model = get_user_model()
+    columns = cached_columns(model)
+    key = user_cache_key(user_id)
+    entry = cache.get(key)
+    if entry is None or set(entry[0]) != set(columns):
+        try:
+            user = model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        except (model.DoesNotExist, ValueError):
+            return None
+        entry = ({name: getattr(user, name) for name in columns}, get_md5_hash_password(user.password))
+        cache.set(key, entry, timeout=getattr(settings, 'AUTH_USER_CACHE_TTL', 60))
+    values, password_hash = entry
+    return model.from_db(model.objects.db, columns, [values[name] for name in columns]), password_hash
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that keeps the token's user in the Django cache for
+    AUTH_USER_CACHE_TTL seconds (see get_cached_user), so authenticated
+    requests do not select the user row every time. api.signals drops the
+    entry when the user is saved or deleted; the active and revoked token
+    checks still run on every request.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        found = get_cached_user(user_id)
+        if found is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        user, password_hash = found
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_hash:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
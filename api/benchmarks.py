@@ -0,0 +1,93 @@
+"""
+Micro-benchmarks for the api app.
+
+Not collected by the normal test run; invoke explicitly:
+
+    python manage.py test api.benchmarks
+
+Set BENCH_OUTPUT=<path> to also write the results as JSON.
+"""
+import json
+import os
+import timeit
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.response import Response
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+
+from .renderers import UserRenderer, FastJSONRenderer
+
+
+class LegacyUserRenderer(FastJSONRenderer):
+    """The renderer as it was: stringify the payload to look for errors, then json.dumps."""
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if 'ErrorDetail' in str(data):
+            return json.dumps({'errors': data})
+        return json.dumps(data)
+
+
+def login_payload():
+    token = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9." + "x" * 180 + ".signature"
+    return {'user_id': 42, 'token': {'refresh': token, 'access': token}, 'msg': 'Login success'}
+
+
+def login_error_payload():
+    return {'non_field_errors': [ErrorDetail('Email or Password is not Valid', code='invalid')]}
+
+
+def product_list_payload(count=50):
+    now = timezone.now().isoformat()
+    rows = ReturnList(serializer=None)
+    for i in range(count):
+        rows.append(ReturnDict({
+            'id': i,
+            'title': f"Engineering Mathematics Vol {i}",
+            'description': "Lightly used, a few pencil notes in the margins. " * 4,
+            'price': str(Decimal('350.00') + i),
+            'seller_id': 7,
+            'category': {'id': 1, 'name': 'Books & Study Material', 'slug': 'books', 'image': None},
+            'status': 'available',
+            'upload_date': now,
+            'images': [{'image': f"http://localhost:8000/media/product_images/{i}_{n}.jpg"} for n in range(3)],
+            'has_requested': False,
+            'request_status': None,
+            'request_id': None,
+        }, serializer=None))
+    return {'next': 'http://localhost:8000/api/user/products/?cursor=abc', 'results': rows}
+
+
+class RendererBenchmark(SimpleTestCase):
+    iterations = 2000
+
+    def time_render(self, renderer, data, status_code=200):
+        context = {'response': Response(status=status_code)}
+        renderer.render(data, 'application/json', context)  # warm up
+        seconds = timeit.timeit(lambda: renderer.render(data, 'application/json', context), number=self.iterations)
+        return seconds / self.iterations * 1e6
+
+    def test_user_renderer(self):
+        cases = {
+            'login': (login_payload(), 200),
+            'login_error': (login_error_payload(), 400),
+            'product_list_50': (product_list_payload(), 200),
+        }
+        results = []
+        for name, (data, status_code) in cases.items():
+            legacy = self.time_render(LegacyUserRenderer(), data, status_code)
+            current = self.time_render(UserRenderer(), data, status_code)
+            results.append({'payload': name, 'legacy_us': round(legacy, 2), 'current_us': round(current, 2),
+                            'speedup': round(legacy / current, 2)})
+            self.assertEqual(json.loads(LegacyUserRenderer().render(data)),
+                             json.loads(UserRenderer().render(data, None, {'response': Response(status=status_code)})))
+
+        print()
+        for row in results:
+            print(f"{row['payload']:<18} legacy {row['legacy_us']:>9.2f} us   current {row['current_us']:>9.2f} us   x{row['speedup']}")
+        if os.environ.get('BENCH_OUTPUT'):
+            with open(os.environ['BENCH_OUTPUT'], 'w') as fh:
+                json.dump({'renderer': results}, fh, indent=2)
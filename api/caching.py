@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class BoundedLRUCache:
+    """
+    Thread-safe in-process LRU cache with an entry limit and optional TTL.
+
+    Counts hits, misses and evictions so callers can expose how well it works.
+    """
+
+    def __init__(self, max_entries=512, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class ProductFeedCache:
+    """
+    Shared cache for the viewer-independent part of product feed pages.
+
+    Pages are stored per worker in a BoundedLRUCache, keyed by scope (the home
+    feed or one category), fieldset, cursor and page size, plus the scope's
+    current generation. Generations live in the shared Django cache and are
+    bumped by api.signals whenever a product, its images or its requests
+    change, so every worker stops serving the stale page at once and the old
+    entries simply age out of the LRU.
+    """
+    generation_prefix = 'product_feed:gen:'
+
+    def __init__(self):
+        self._pages = None
+
+    @property
+    def pages(self):
+        if self._pages is None:
+            self._pages = BoundedLRUCache(
+                max_entries=getattr(settings, 'PRODUCT_FEED_CACHE_ENTRIES', 512),
+                ttl=getattr(settings, 'PRODUCT_FEED_CACHE_TTL', 300),
+            )
+        return self._pages
+
+    def generations(self, scopes):
+        keys = [self.generation_prefix + scope for scope in scopes]
+        found = cache.get_many(keys)
+        for key in keys:
+            if key not in found:
+                # Seed from the clock so a generation lost from the shared cache never repeats
+                cache.add(key, time.time_ns(), timeout=None)
+                found[key] = cache.get(key)
+        return tuple(found[key] for key in keys)
+
+    def invalidate(self, *scopes):
+        for scope in set(scopes):
+            key = self.generation_prefix + scope
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), timeout=None)
+
+    def get(self, key):
+        return self.pages.get(key)
+
+    def set(self, key, value):
+        self.pages.set(key, value)
+
+    def stats(self):
+        return self.pages.stats()
+
+    def clear(self):
+        self.pages.clear()
+
+
+def feed_scope(category_slug=None):
+    """Cache scope of a feed page: one category, or the home feed across all of them."""
+    return f'category:{category_slug}' if category_slug else 'all'
+
+
+product_feed_cache = ProductFeedCache()
@@ -0,0 +1,29 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+
+def compute_etag(*parts):
+    """Strong ETag over the values a representation was built from."""
+    digest = hashlib.md5(repr(parts).encode('utf-8'), usedforsecurity=False).hexdigest()
+    return quote_etag(digest)
+
+
+def conditional_get(request, parts, respond):
+    """
+    Answer a GET with 304 Not Modified when the client's If-None-Match matches
+    the ETag of ``parts``; otherwise build the body with ``respond()``.
+
+    ``parts`` should come from a cheap aggregate query so an unchanged resource
+    costs no serialization. Responses are per-user, so they are marked private
+    and must be revalidated on every use.
+    """
+    etag = compute_etag(*parts)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = respond()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
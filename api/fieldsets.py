@@ -0,0 +1,97 @@
+from django.db.models import Prefetch
+from rest_framework.exceptions import ValidationError
+
+from .models import ProductImage
+
+# Product fields and the model columns each one reads
+PRODUCT_COLUMNS = {
+    'id': (),
+    'title': ('title',),
+    'description': ('description',),
+    'price': ('price',),
+    'seller_id': (),
+    'status': ('status',),
+    'upload_date': (),
+    'has_requested': (),
+    'request_status': (),
+    'request_id': (),
+    'category': ('category',),
+    'images': (),
+    'cover_image': (),
+}
+# Columns every product query keeps: the viewer checks need seller, the cursor needs upload_date
+PRODUCT_BASE_COLUMNS = ('id', 'seller', 'upload_date')
+PRODUCT_RELATIONS = ('category', 'images', 'cover_image')
+PRODUCT_DEFAULT_RELATIONS = ('category', 'images')
+
+FIELD_PRESETS = {
+    # What a feed card shows: title, price, status and the first image
+    'card': ('id', 'title', 'price', 'status', 'cover_image'),
+}
+
+
+def _split(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class ProductFieldset:
+    """
+    A ?fields= / ?expand= projection for the product endpoints.
+
+    ``fields`` picks the scalar fields to return (or a preset such as
+    ``card``); relations (category, images, cover_image) are only rendered when
+    named in ``fields`` or ``expand``. Without either parameter the full
+    representation is returned, as before. apply() narrows the ORM query to
+    the same projection so unused columns and relations are never loaded.
+    """
+
+    def __init__(self, fields=None, expand=()):
+        self.fields = None if fields is None else set(fields) | {'id'}
+        self.expand = set(expand)
+
+    @classmethod
+    def from_request(cls, request):
+        fields, expand = None, _split(request.query_params.get('expand'))
+        requested = _split(request.query_params.get('fields'))
+        if requested:
+            fields = []
+            for name in requested:
+                fields.extend(FIELD_PRESETS.get(name, (name,)))
+
+        unknown = sorted({*(fields or ()), *expand} - set(PRODUCT_COLUMNS))
+        if unknown:
+            raise ValidationError({'fields': f"Unknown product fields: {', '.join(unknown)}"})
+        bad_expand = sorted(set(expand) - set(PRODUCT_RELATIONS))
+        if bad_expand:
+            raise ValidationError({'expand': f"Only {', '.join(PRODUCT_RELATIONS)} can be expanded."})
+        return cls(fields, expand)
+
+    def cache_key(self):
+        return (tuple(sorted(self.fields)) if self.fields is not None else None, tuple(sorted(self.expand)))
+
+    def includes(self, name):
+        if name in PRODUCT_RELATIONS:
+            if name in self.expand:
+                return True
+            if self.fields is None:
+                return name in PRODUCT_DEFAULT_RELATIONS
+        return self.fields is None or name in self.fields
+
+    def output_fields(self, candidates):
+        return [name for name in candidates if self.includes(name)]
+
+    def apply(self, queryset):
+        if self.fields is not None:
+            columns = set(PRODUCT_BASE_COLUMNS)
+            for name in self.output_fields(PRODUCT_COLUMNS):
+                columns.update(PRODUCT_COLUMNS[name])
+            queryset = queryset.only(*columns)
+
+        if self.includes('category'):
+            queryset = queryset.select_related('category')
+        if self.includes('images'):
+            queryset = queryset.prefetch_related('images')
+        if self.includes('cover_image'):
+            first_image = ProductImage.objects.only('id', 'product', 'image', 'variants').order_by('id')[:1]
+            queryset = queryset.prefetch_related(Prefetch('images', queryset=first_image, to_attr='cover_images'))
+        return queryset
@@ -0,0 +1,138 @@
+import io
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Longest edge of each variant, smallest first; originals are never upscaled
+VARIANT_SIZES = (
+    ('thumb', 160),
+    ('card', 480),
+    ('full', 1280),
+)
+VARIANT_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_VARIANT_WORKERS', 2), thread_name_prefix='image-variants'
+            )
+        return _executor
+
+
+def variant_name(original, variant, extension):
+    folder, filename = posixpath.split(original)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(folder, 'variants', f'{stem}_{variant}.{extension}')
+
+
+def render_variants(field_file):
+    """
+    Resize and re-encode one uploaded image into every variant and save them to
+    its storage. Returns {variant: {'width', 'height', format: storage name}}.
+    """
+    largest = VARIANT_SIZES[-1][1]
+    with field_file.open('rb') as source, Image.open(source) as image:
+        # JPEG can decode straight at a reduced scale, which is most of the win for phone photos
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Flatten transparency onto white instead of letting it turn black
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+        variants = {}
+        # Work down from the largest size so each resize starts from a smaller image
+        for name, size in reversed(VARIANT_SIZES):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            entry = {'width': image.width, 'height': image.height}
+            for extension, pil_format, options in VARIANT_FORMATS:
+                buffer = io.BytesIO()
+                image.save(buffer, pil_format, **options)
+                target = variant_name(field_file.name, name, extension)
+                if field_file.storage.exists(target):
+                    field_file.storage.delete(target)
+                entry[extension] = field_file.storage.save(target, ContentFile(buffer.getvalue()))
+            variants[name] = entry
+    return variants
+
+
+def build_variants(model_label, pk, field='image'):
+    """Worker entry point: render the variants of one row and record them on it."""
+    try:
+        model = apps.get_model(model_label)
+        instance = model.objects.filter(pk=pk).first()
+        field_file = getattr(instance, field, None) if instance is not None else None
+        if not field_file:
+            return
+        instance.variants = render_variants(field_file)
+        # Saving through the model still fires post_save (so cached feeds pick the variants up)
+        # and bumps updated_at where there is one, which profile ETags are built from
+        fields = ['variants'] + [f.name for f in model._meta.concrete_fields if f.name == 'updated_at']
+        instance.save(update_fields=fields)
+    except Exception:
+        logger.exception("Could not build image variants for %s %s", model_label, pk)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(instance, field='image'):
+    """Build the variants once the upload is committed: in the worker pool, or inline when disabled."""
+    label = instance._meta.label
+
+    def run():
+        if getattr(settings, 'IMAGE_VARIANTS_ASYNC', True):
+            get_executor().submit(build_variants, label, instance.pk, field)
+        else:
+            build_variants(label, instance.pk, field)
+
+    transaction.on_commit(run)
+
+
+def build_srcset(variants, request=None):
+    """srcset strings per format for a stored variants map, e.g. {'webp': 'a.webp 160w, b.webp 480w'}."""
+    srcset = {}
+    for extension, _, _ in VARIANT_FORMATS:
+        entries, widths = [], set()
+        for name, _ in VARIANT_SIZES:
+            entry = (variants or {}).get(name)
+            if not entry or extension not in entry or entry['width'] in widths:
+                continue  # small originals produce identical variants; list each width once
+            widths.add(entry['width'])
+            url = default_storage.url(entry[extension])
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            entries.append(f"{url} {entry['width']}w")
+        if entries:
+            srcset[extension] = ', '.join(entries)
+    return srcset
+
+
+def variant_url(variants, name, extension='jpeg', request=None):
+    entry = (variants or {}).get(name)
+    if not entry or extension not in entry:
+        return None
+    url = default_storage.url(entry[extension])
+    return request.build_absolute_uri(url) if request is not None else url
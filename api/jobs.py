@@ -0,0 +1,177 @@
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+from .otp import services as otp_services
+
+logger = logging.getLogger(__name__)
+
+# kind -> (handler, batched). A batched handler takes a list of payloads and
+# returns one error (or None) per payload; a plain one takes a single payload.
+HANDLERS = {}
+
+
+def job_handler(kind, batched=False):
+    def register(func):
+        HANDLERS[kind] = (func, batched)
+        return func
+    return register
+
+
+def enqueue(kind, payload, run_at=None, max_attempts=None):
+    """Record a job for the run_jobs worker. Inside a transaction it only becomes visible on commit."""
+    if kind not in HANDLERS:
+        raise ValueError(f"No handler registered for job kind '{kind}'.")
+    job = Job(kind=kind, payload=payload, run_at=run_at or timezone.now())
+    if max_attempts is not None:
+        job.max_attempts = max_attempts
+    job.save()
+    return job
+
+
+def backoff(attempts):
+    """Delay before retry number ``attempts``: exponential from JOB_RETRY_BASE seconds, capped, with jitter."""
+    base = getattr(settings, 'JOB_RETRY_BASE', 30)
+    cap = getattr(settings, 'JOB_RETRY_MAX', 3600)
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim_jobs(limit):
+    """
+    Lock up to ``limit`` ready jobs for this worker. SKIP LOCKED lets several
+    workers poll at once without handing out the same job; jobs left running by
+    a worker that died are picked up again after JOB_LOCK_TIMEOUT seconds.
+    Each claim counts as an attempt, so a job that keeps killing its worker
+    still runs out of attempts and goes dead.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'JOB_LOCK_TIMEOUT', 600))
+    abandoned = Q(status='running', locked_at__lt=stale)
+    with transaction.atomic():
+        buried = Job.objects.filter(abandoned, attempts__gte=F('max_attempts')).update(
+            status='dead', locked_at=None, last_error="Worker stopped before the job finished.",
+        )
+        if buried:
+            logger.error("%s abandoned jobs are dead after using up their attempts", buried)
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='queued', run_at__lte=now) | abandoned)
+            .order_by('run_at', 'id')[:limit]
+        )
+        if jobs:
+            Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status='running', locked_at=now, attempts=F('attempts') + 1,
+            )
+            for job in jobs:
+                job.attempts += 1
+    return jobs
+
+
+def finish(job, error):
+    if error is None:
+        job.delete()
+        return
+    job.last_error = error
+    job.locked_at = None
+    if job.attempts >= job.max_attempts:
+        job.status = 'dead'
+        logger.error("Job %s (%s) is dead after %s attempts: %s", job.pk, job.kind, job.attempts, error)
+    else:
+        job.status = 'queued'
+        job.run_at = timezone.now() + backoff(job.attempts)
+    job.save(update_fields=['last_error', 'locked_at', 'status', 'run_at'])
+
+
+def run_pending(limit=100):
+    """Claim and run one batch of ready jobs. Returns how many were processed."""
+    jobs = claim_jobs(limit)
+    by_kind = {}
+    for job in jobs:
+        by_kind.setdefault(job.kind, []).append(job)
+
+    for kind, group in by_kind.items():
+        handler, batched = HANDLERS.get(kind, (None, False))
+        if handler is None:
+            errors = [f"No handler registered for job kind '{kind}'."] * len(group)
+        elif batched:
+            try:
+                errors = handler([job.payload for job in group])
+            except Exception as exc:
+                logger.exception("Batch of %s %s jobs failed", len(group), kind)
+                errors = [repr(exc)] * len(group)
+        else:
+            errors = []
+            for job in group:
+                try:
+                    handler(job.payload)
+                    errors.append(None)
+                except Exception as exc:
+                    logger.exception("Job %s (%s) failed", job.pk, kind)
+                    errors.append(repr(exc))
+        for job, error in zip(group, errors):
+            finish(job, error)
+    return len(jobs)
+
+
+@job_handler('send_email', batched=True)
+def send_emails(payloads):
+    """Send a batch of emails over one SMTP connection."""
+    errors = []
+    with get_connection() as connection:
+        for payload in payloads:
+            try:
+                EmailMessage(
+                    subject=payload['subject'],
+                    body=payload['body'],
+                    from_email=payload.get('from_email'),
+                    to=payload['to'],
+                    connection=connection,
+                ).send()
+                errors.append(None)
+            except Exception as exc:
+                errors.append(repr(exc))
+    return errors
+
+
+@job_handler('send_otp', batched=True)
+def send_otps(payloads):
+    """
+    Derive each code from its payload's nonce only now, so the job table never
+    holds one in plaintext; a retry after a failed send mails the same code.
+    """
+    emails, positions, errors = [], [], [None] * len(payloads)
+    for i, payload in enumerate(payloads):
+        service = otp_services[payload['purpose']]
+        code = service.issue(payload['email'], payload.get('nonce'))
+        if code is None:
+            continue  # superseded by a newer code for the same address
+        emails.append({
+            'subject': service.subject,
+            'body': service.body(code),
+            'to': [payload['email']],
+            'from_email': payload.get('from_email'),
+        })
+        positions.append(i)
+    if emails:
+        for i, error in zip(positions, send_emails(emails)):
+            errors[i] = error
+    return errors
+
+
+def queue_email(subject, body, to, from_email=None):
+    return enqueue('send_email', {'subject': subject, 'body': body, 'to': list(to), 'from_email': from_email})
+
+
+def queue_otp(service, email, from_email=None):
+    """Queue a one-time code for ``email``; raises OTPError when too many were requested."""
+    service.throttle(email)
+    payload = {'purpose': service.purpose, 'email': email, 'nonce': service.nonce(), 'from_email': from_email}
+    return enqueue('send_otp', payload)
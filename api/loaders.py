@@ -0,0 +1,87 @@
+from .models import ProductRequest, UserProfile
+
+ACTIVE_REQUEST_STATUSES = ('pending', 'accepted')
+
+
+class ViewerRequestState:
+    """
+    The current user's requests for a set of products, loaded in one query.
+
+    ProductSerializer reads has_requested / request_status / request_id from
+    here instead of querying ProductRequest three times per product.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._loaded = set()
+        self._latest = {}        # product_id -> (request_id, status) of the newest request
+        self._first_active = {}  # product_id -> lowest pending/accepted request id
+
+    def load(self, product_ids):
+        missing = {pk for pk in product_ids if pk not in self._loaded}
+        if not missing:
+            return
+        self._loaded |= missing
+        if not self.user or not self.user.is_authenticated:
+            return
+
+        rows = ProductRequest.objects.filter(
+            buyer=self.user, product_id__in=missing
+        ).order_by('id').values_list('id', 'product_id', 'status')
+
+        for request_id, product_id, status in rows:
+            self._latest[product_id] = (request_id, status)
+            if status in ACTIVE_REQUEST_STATUSES:
+                self._first_active.setdefault(product_id, request_id)
+
+    def has_requested(self, product_id):
+        return product_id in self._first_active
+
+    def request_status(self, product_id):
+        latest = self._latest.get(product_id)
+        if latest and latest[1] in ACTIVE_REQUEST_STATUSES:
+            return latest[1]
+        return None
+
+    def request_id(self, product_id):
+        return self._first_active.get(product_id)
+
+
+def load_profiles(user_ids):
+    profiles = UserProfile.objects.filter(user_id__in=user_ids).select_related('user')
+    return {profile.user_id: profile for profile in profiles}
+
+
+class BatchLoader:
+    """
+    Request-scoped batch loading for nested serializers.
+
+    Serializers prime() the keys they are about to read; the first load() of a
+    kind then fetches every primed key of that kind in a single query and later
+    lookups are served from memory. Keys that were not primed are still
+    fetched, just one batch at a time.
+    """
+    fetchers = {
+        'profile': load_profiles,
+    }
+
+    def __init__(self):
+        self._pending = {kind: set() for kind in self.fetchers}
+        self._values = {kind: {} for kind in self.fetchers}
+
+    def prime(self, kind, keys):
+        loaded = self._values[kind]
+        self._pending[kind].update(key for key in keys if key not in loaded)
+
+    def load(self, kind, key):
+        loaded = self._values[kind]
+        if key not in loaded:
+            self._pending[kind].add(key)
+            self._fetch(kind)
+        return loaded[key]
+
+    def _fetch(self, kind):
+        keys, self._pending[kind] = self._pending[kind], set()
+        found = self.fetchers[kind](keys)
+        for key in keys:
+            self._values[kind][key] = found.get(key)
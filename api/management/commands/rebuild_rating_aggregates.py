@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from api.models import Rating, UserProfile
+
+
+class Command(BaseCommand):
+    help = "Recompute every seller's rating count and sum from the Rating table."
+
+    def handle(self, *args, **options):
+        ratings = Rating.objects.filter(seller_id=OuterRef('user_id')).order_by().values('seller_id')
+        count = ratings.annotate(value=Count('id')).values('value')
+        total = ratings.annotate(value=Sum('rating')).values('value')
+
+        # One UPDATE, so concurrent rating writes are never half-applied
+        updated = UserProfile.objects.update(
+            rating_count=Coalesce(Subquery(count), Value(0)),
+            rating_sum=Coalesce(Subquery(total), Value(0)),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating totals for {updated} profiles."))
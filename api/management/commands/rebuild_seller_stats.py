@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Product, ProductRequest, SellerStats
+from api.stats import recount_seller_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the seller dashboard counters from products and product requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        seller_ids = sorted(
+            set(Product.objects.values_list('seller_id', flat=True).distinct())
+            | set(ProductRequest.objects.values_list('seller_id', flat=True).distinct())
+            | set(SellerStats.objects.values_list('seller_id', flat=True))
+        )
+        size = options['batch_size']
+        for start in range(0, len(seller_ids), size):
+            recount_seller_stats(seller_ids[start:start + size])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt dashboard counters for {len(seller_ids)} sellers."))
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (emails and other deferred work)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the jobs that are ready now, then exit.")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=getattr(settings, 'JOB_POLL_INTERVAL', 1.0),
+                            help="Seconds to sleep when the queue is empty.")
+
+    def handle(self, *args, **options):
+        processed = 0
+        try:
+            while True:
+                count = run_pending(options['batch_size'])
+                processed += count
+                if count:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Processed {processed} jobs.")
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_userprofile_rating_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerStats',
+            fields=[
+                ('seller', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='seller_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('listings_available', models.IntegerField(default=0)),
+                ('listings_reserved', models.IntegerField(default=0)),
+                ('listings_unavailable', models.IntegerField(default=0)),
+                ('listings_sold', models.IntegerField(default=0)),
+                ('requests_pending', models.IntegerField(default=0)),
+                ('requests_accepted', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Seller stats',
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:28
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_job'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='OTP',
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
 from django.apps import apps
 from django.conf import settings
@@ -15,6 +15,24 @@ def validate_kiet_email(email):
     if not username:
         raise ValidationError("The username part of the email cannot be empty.")
 
+class LoadedValuesMixin:
+    """Remembers the column values an instance was loaded with, so signal handlers can tell what a save changed."""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # post_save handlers have seen the old values; what was just written is the new baseline
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields if field.attname not in deferred
+        }
+
 class UserManager(BaseUserManager):
     def create_user(self, email, username, password,**extra_fields):
         if not email:
@@ -68,15 +86,7 @@ class User(AbstractBaseUser):
     def has_module_perms(self, app_label):
         return self.is_admin
 
-class OTP(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE)
-    otp_code = models.CharField(max_length=6)
-    created_at = models.DateTimeField(auto_now_add=True)
-
-    def is_valid(self):
-        return (now() - self.created_at).seconds < 300  # 5-minute validity
-
-class UserProfile(models.Model):
+class UserProfile(LoadedValuesMixin, models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name= models.CharField(max_length=255)
     address=models.TextField(blank=True, null=True)
@@ -84,12 +94,26 @@ class UserProfile(models.Model):
     college_year=models.IntegerField(default=1)
     gender=models.CharField(max_length=20,choices=[('Male', 'Male'), ('Female', 'Female'), ('Other', 'Other')])
     image=models.ImageField(upload_to='profile_images/',blank=True,null=True)
+    variants = models.JSONField(default=dict, blank=True)  # resized copies of image, see api.images
+    updated_at = models.DateTimeField(auto_now=True)
+    # Seller rating totals, kept in step with Rating by api.signals (rebuild_rating_aggregates recomputes them)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.DecimalField(max_digits=10, decimal_places=1, default=0)
+
+    RATING_FIELDS = ('rating_count', 'rating_sum')
     
-    # @property
-    # def average_rating(self):
-    #     ratings = self.user.received_ratings.all()
-    #     return ratings.aggregate(models.Avg('rating'))['rating__avg'] or 0
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else 0
 
+    def save(self, *args, **kwargs):
+        # Profile edits must not write back stale rating totals over concurrent updates
+        if self.pk and not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.RATING_FIELDS
+            ]
+        super().save(*args, **kwargs)
     
     def clean(self):
         if not (1 <= self.college_year <= 4):
@@ -112,7 +136,7 @@ class Category(models.Model):
 
  
 
-class Product(models.Model):
+class Product(LoadedValuesMixin, models.Model):
     STATUS_CHOICES = [
         ('available', 'Available'),
         ('sold', 'Sold'),
@@ -128,21 +152,29 @@ class Product(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='available') 
     upload_date = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True) 
-      
+
+    class Meta:
+        # Back the (upload_date, id) keyset seeks used by the product feeds
+        indexes = [
+            models.Index(fields=['-upload_date', '-id'], name='product_feed_idx'),
+            models.Index(fields=['category', '-upload_date', '-id'], name='product_category_feed_idx'),
+            models.Index(fields=['seller', '-upload_date', '-id'], name='product_seller_feed_idx'),
+        ]
      
     def __str__(self):
         return self.title
     
      
-class ProductImage(models.Model):
+class ProductImage(LoadedValuesMixin, models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='product_images/')
+    variants = models.JSONField(default=dict, blank=True)  # resized copies of image, see api.images
 
     def __str__(self):
         return f"Image for {self.product.title}"
     
     
-class ProductRequest(models.Model):
+class ProductRequest(LoadedValuesMixin, models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('accepted', 'Accepted'),
@@ -182,6 +214,24 @@ class ProductRequest(models.Model):
         return f"Request from {self.buyer.username} for {self.product.title}"
     
     
+class SellerStats(models.Model):
+    """Dashboard counters for one seller, kept current by api.signals (see api.stats)."""
+    seller = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key=True, related_name='seller_stats', on_delete=models.CASCADE)
+    listings_available = models.IntegerField(default=0)
+    listings_reserved = models.IntegerField(default=0)
+    listings_unavailable = models.IntegerField(default=0)
+    listings_sold = models.IntegerField(default=0)
+    requests_pending = models.IntegerField(default=0)
+    requests_accepted = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Seller stats"
+
+    def __str__(self):
+        return f"Stats for {self.seller_id}"
+
+
 class Rating(models.Model):
     buyer = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="given_ratings", on_delete=models.CASCADE)
     seller = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="received_ratings", on_delete=models.CASCADE)
@@ -193,7 +243,40 @@ class Rating(models.Model):
     class Meta:
         unique_together = ('buyer', 'product') 
 
+    # The seller's rating totals are updated by signals inside the same transaction
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
     def __str__(self):
         return f"{self.buyer.username} rated {self.seller.username} for {self.product.title} ({self.rating}/5)"
 
 
+class Job(models.Model):
+    """A unit of background work (see api.jobs); rows are deleted once they succeed."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('dead', 'Dead'),  # out of attempts, kept for inspection
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # The worker's poll is a range scan over ready jobs
+        indexes = [models.Index(fields=['status', 'run_at'], name='job_ready_idx')]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
@@ -0,0 +1,127 @@
+import hashlib
+import hmac
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+
+
+class OTPError(Exception):
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+# purpose -> OTPService, for the send_otp job (api.jobs)
+services = {}
+
+
+class OTPService:
+    """
+    One-time codes kept in the Django cache, so they expire by TTL and never touch the database.
+
+    Each purpose ('verify', 'reset') keeps per email: the code's HMAC, the
+    guesses made against it, and how many codes were sent in the current
+    window. Every guess counts against OTP_MAX_ATTEMPTS; after that the
+    code is burnt and a new one has to be requested. Codes are emailed by the
+    send_otp job, which issues them at send time (see api.jobs.queue_otp).
+    The job only holds a nonce. The code is derived from it with SECRET_KEY,
+    so a retried send mails the same code again instead of a new one.
+    """
+    prefix = 'otp'
+
+    def __init__(self, purpose, subject):
+        self.purpose = purpose
+        self.subject = subject
+        services[purpose] = self
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'OTP_TTL', 300)
+
+    def _keys(self, email):
+        # Emails can hold characters some cache backends reject in keys
+        digest = hashlib.sha256(email.strip().lower().encode()).hexdigest()
+        base = f'{self.prefix}:{self.purpose}:{digest}'
+        return base, f'{base}:attempts', f'{base}:sends'
+
+    def _digest(self, code):
+        return hmac.new(settings.SECRET_KEY.encode(), str(code).encode(), hashlib.sha256).hexdigest()
+
+    def _derive(self, email, nonce):
+        message = f'{self.purpose}:{nonce}:{email.strip().lower()}'.encode()
+        digest = hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).digest()
+        return f'{int.from_bytes(digest[:8], "big") % 1_000_000:06d}'
+
+    @staticmethod
+    def nonce():
+        """A fresh nonce for issue(); later nonces sort after earlier ones."""
+        return f'{time.time_ns():020d}{secrets.token_hex(4)}'
+
+    def body(self, code):
+        return f'Your OTP is {code}. It is valid for {self.ttl // 60} minutes.'
+
+    def throttle(self, email):
+        """Count one more code sent to ``email``; raises OTPError when sent too often."""
+        _, _, sends_key = self._keys(email)
+        window = getattr(settings, 'OTP_RESEND_WINDOW', 3600)
+        cache.add(sends_key, 0, timeout=window)
+        try:
+            sends = cache.incr(sends_key)
+        except ValueError:  # expired between add and incr
+            cache.set(sends_key, 1, timeout=window)
+            sends = 1
+        if sends > getattr(settings, 'OTP_MAX_SENDS', 5):
+            raise OTPError("Too many OTP requests. Try again later.", status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def issue(self, email, nonce=None):
+        """
+        Store a code for ``email`` and return it, replacing any earlier one.
+
+        With a ``nonce`` (see nonce()) the code is derived from it. While the
+        code from that nonce is still live it is only returned again, so a
+        retried send keeps the code and the guesses made against it. A nonce
+        older than the live code's returns None: a newer code was sent since.
+        """
+        code_key, attempts_key, _ = self._keys(email)
+        if nonce is None:
+            code, nonce = f'{secrets.randbelow(1_000_000):06d}', ''
+        else:
+            code = self._derive(email, nonce)
+            live = cache.get(code_key)
+            if live is not None and live[0] == nonce:
+                return code
+            if live is not None and live[0] > nonce:
+                return None
+        # The guess counter starts with the code, so verify() needs no add() before its incr()
+        cache.set_many({code_key: (nonce, self._digest(code)), attempts_key: 0}, timeout=self.ttl)
+        return code
+
+    def verify(self, email, code):
+        """
+        Check ``code`` and consume it on success; raises OTPError otherwise.
+        Costs two cache round trips (incr, get), plus one delete_many when
+        the code is used up.
+        """
+        code_key, attempts_key, _ = self._keys(email)
+        # Count the guess before checking it, so parallel guesses cannot all pass the limit
+        try:
+            attempts = cache.incr(attempts_key)
+        except ValueError:  # no live code: never sent, expired, used up or burnt
+            raise OTPError("Invalid or expired OTP")
+        if attempts > getattr(settings, 'OTP_MAX_ATTEMPTS', 5):
+            cache.delete_many([code_key, attempts_key])
+            raise OTPError("Too many incorrect attempts. Request a new OTP.", status.HTTP_429_TOO_MANY_REQUESTS)
+
+        live = cache.get(code_key)
+        if live is None or not hmac.compare_digest(live[1], self._digest(code)):
+            raise OTPError("Invalid or expired OTP")
+
+        cache.delete_many([code_key, attempts_key])
+
+
+verification_otp = OTPService('verify', 'Email Verification OTP')
+reset_otp = OTPService('reset', 'Reset Password OTP')
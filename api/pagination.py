@@ -0,0 +1,131 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class ProductCursorPagination(BasePagination):
+    """
+    Keyset pagination for product feeds, newest first by (upload_date, id).
+
+    The cursor is the (upload_date, id) of the last row already sent, so every
+    page is an index seek on Product's feed indexes instead of an OFFSET scan.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_window(self, queryset, request, position=None):
+        """The rows the requested page (or the page after ``position``) is cut from, plus one to detect a next page."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if position is None:
+            position = self.decode_cursor(request)
+
+        queryset = queryset.order_by('-upload_date', '-id')
+        if position is not None:
+            upload_date, pk = position
+            # The leading upload_date__lte keeps the predicate a range on the index
+            queryset = queryset.filter(upload_date__lte=upload_date).filter(
+                Q(upload_date__lt=upload_date) | Q(id__lt=pk)
+            )
+        return queryset[:self.page_size + 1]
+
+    def paginate_queryset(self, queryset, request, view=None, position=None):
+        rows = list(self.get_window(queryset, request, position))
+        page = rows[:self.page_size]
+        self.next_position = None
+        if len(rows) > self.page_size:
+            self.next_position = (page[-1].upload_date, page[-1].pk)
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        page_size = getattr(settings, 'PRODUCT_FEED_PAGE_SIZE', 20)
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return min(requested, self.max_page_size) if requested > 0 else page_size
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def encode_cursor(self, position):
+        upload_date, pk = position
+        raw = f"{upload_date.isoformat()}|{pk}"
+        return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            upload_date, pk = raw.rsplit('|', 1)
+            upload_date = parse_datetime(upload_date)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if upload_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return upload_date, pk
+
+
+class SearchCursorPagination(ProductCursorPagination):
+    """
+    Pagination for relevance-ranked search results.
+
+    Ranking is done in memory by api.search, so the opaque cursor only needs
+    to carry the offset into the ranked list.
+    """
+
+    def paginate_ranked(self, search, query, request):
+        """Run ``search(query, offset, limit)`` for the requested page and return its ids."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        offset = self.decode_cursor(request)
+        total, ids = search(query, offset=offset, limit=self.page_size)
+        self.next_position = offset + self.page_size if offset + self.page_size < total else None
+        return ids
+
+    def encode_cursor(self, position):
+        return base64.urlsafe_b64encode(f"o|{position}".encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return 0
+        try:
+            marker, offset = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            offset = int(offset)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if marker != 'o' or offset < 0:
+            raise NotFound(self.invalid_cursor_message)
+        return offset
@@ -1,13 +1,85 @@
+import math
+
 from rest_framework import renderers
-import json
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.utils import encoders
+
+try:
+  import orjson
+except ImportError:  # orjson is optional; fall back to DRF's stdlib json encoder
+  orjson = None
+
+
+def contains_error_detail(data):
+  """True if any value nested in ``data`` is a DRF ErrorDetail."""
+  stack = [data]
+  while stack:
+    item = stack.pop()
+    if isinstance(item, ErrorDetail):
+      return True
+    if isinstance(item, dict):
+      stack.extend(item.values())
+    elif isinstance(item, (list, tuple)):
+      stack.extend(item)
+  return False
+
+
+def contains_non_finite(data):
+  """True if any float nested in ``data`` is NaN or infinite."""
+  stack = [data]
+  while stack:
+    item = stack.pop()
+    if isinstance(item, float):
+      if not math.isfinite(item):
+        return True
+    elif isinstance(item, dict):
+      stack.extend(item.values())
+    elif isinstance(item, (list, tuple)):
+      stack.extend(item)
+  return False
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+  """
+  JSONRenderer that encodes with orjson when it is installed.
+
+  Output matches DRF's compact JSON. Anything orjson can't encode natively
+  goes through DRF's JSONEncoder, and indented output (e.g. for the browsable
+  API) or values orjson rejects fall back to the stock renderer. So do NaN
+  and infinities, which orjson writes as null: the stock renderer raises for
+  them under STRICT_JSON, or writes NaN/Infinity without it.
+  """
+  _encoder = encoders.JSONEncoder()
+
+  def render(self, data, accepted_media_type=None, renderer_context=None):
+    if data is None:
+      return b''
+    renderer_context = renderer_context or {}
+    if (orjson is None or not self.compact or self.ensure_ascii
+        or self.get_indent(accepted_media_type, renderer_context) is not None):
+      return super().render(data, accepted_media_type, renderer_context)
+
+    try:
+      # Datetimes go through DRF's encoder so they keep its 'Z' formatting
+      ret = orjson.dumps(data, default=self._encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    except TypeError:
+      return super().render(data, accepted_media_type, renderer_context)
+
+    # orjson writes non-finite floats as null, so only bodies with a null need the walk
+    if b'null' in ret and contains_non_finite(data):
+      return super().render(data, accepted_media_type, renderer_context)
+
+    # Same strict-javascript-subset escaping as JSONRenderer
+    if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+      ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return ret
+
 
-class UserRenderer(renderers.JSONRenderer):
+class UserRenderer(FastJSONRenderer):
   charset='utf-8'
   def render(self, data, accepted_media_type=None, renderer_context=None):
-    response = ''
-    if 'ErrorDetail' in str(data):
-      response = json.dumps({'errors':data})
-    else:
-      response = json.dumps(data)
-    
-    return response
\ No newline at end of file
+    # Only error responses can carry ErrorDetail, so successful bodies are never walked
+    response = (renderer_context or {}).get('response')
+    if (response is None or response.status_code >= 400) and contains_error_detail(data):
+      data = {'errors': data}
+    return super().render(data, accepted_media_type, renderer_context)
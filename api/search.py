@@ -0,0 +1,364 @@
+import bisect
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it',
+    'of', 'on', 'or', 'the', 'this', 'to', 'with',
+})
+
+# Per-field weights (BM25F style): a hit in the title counts three times a description hit
+TITLE_BOOST = 3.0
+CATEGORY_BOOST = 1.5
+MAX_PREFIX_EXPANSIONS = 10
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall((text or '').lower()) if token not in STOP_WORDS]
+
+
+class ProductSearchIndex:
+    """
+    In-process inverted index over product title, category name and description,
+    ranked with BM25.
+
+    Each posting list stores the precomputed BM25 impact of the term in every
+    document, sorted highest first, so a query walks the lists in parallel and
+    stops as soon as no unseen document can beat the current top k (threshold
+    algorithm). Postings live in flat arrays to keep 100k+ listings compact.
+
+    The index is built off the request path by warm(), which the first search
+    in each worker starts. Committed
+    changes (see api.signals) update this process's index and are appended to
+    a change log in the shared Django cache: a generation counter plus one
+    entry per change, like the feed generations in api.caching. sync() reads
+    the entries past the generation it last applied and re-reads just those
+    products; when the log has a hole it cannot fill it rebuilds instead.
+    """
+    k1 = 1.2
+    b = 0.75
+    generation_key = 'search_index:gen'
+    change_prefix = 'search_index:change:'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._warming = None
+        self._last_sync = 0.0
+        self._generation = None
+        self._gap = None
+        self._reset()
+
+    def _reset(self):
+        self._term_ids = {}
+        self._vocabulary = []    # sorted, for prefix expansion of the last query word
+        self._postings = []      # term id -> (doc ids, negated impacts), ascending by negated impact
+        self._doc_terms = {}     # doc id -> (term ids, impacts), for scoring and removal
+        self._doc_len = {}
+        self._total_len = 0.0
+
+    @property
+    def built(self):
+        return self._built
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    # ---- building -------------------------------------------------------
+
+    def warm(self):
+        """
+        Rebuild the index in a background thread: on the first search, and when
+        sync() cannot catch up from the change log. The current index keeps
+        serving meanwhile; before the first build, searches fall back to the
+        database.
+        """
+        with self._lock:
+            if self._warming is None or not self._warming.is_alive():
+                self._warming = threading.Thread(target=self._warm, name='search-index', daemon=True)
+                self._warming.start()
+            return self._warming
+
+    def _warm(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("Building the product search index failed")
+
+    def rebuild(self):
+        # Taken first: changes logged while the rows are read get applied again by the next sync
+        generation = self.current_generation()
+        fresh = type(self)()
+        fresh._load(Product.objects.values_list('id', 'title', 'description', 'category__name'))
+        with self._lock:
+            # Swapped in whole, so searches only wait for the swap and not for the build
+            self._term_ids, self._vocabulary, self._postings = fresh._term_ids, fresh._vocabulary, fresh._postings
+            self._doc_terms, self._doc_len, self._total_len = fresh._doc_terms, fresh._doc_len, fresh._total_len
+            self._generation, self._gap = generation, None
+            self._built = True
+            self._last_sync = time.monotonic()
+
+    def _load(self, rows):
+        # Raw term weights first; impacts need the final average document length
+        for pk, title, description, category in rows.iterator(chunk_size=2000):
+            weights, length = self._weigh(title, description, category)
+            term_ids = array('I', map(self._term_id, weights))
+            tfs = array('f', weights.values())
+            for term_id, tf in zip(term_ids, tfs):
+                docs, impacts = self._postings[term_id]
+                docs.append(pk)
+                impacts.append(tf)
+            self._doc_terms[pk] = (term_ids, tfs)
+            self._doc_len[pk] = length
+            self._total_len += length
+
+        if self._doc_len:
+            k1, b, avg_len = self.k1, self.b, self._total_len / len(self._doc_len)
+            norms = {pk: k1 * (1 - b + b * length / avg_len) for pk, length in self._doc_len.items()}
+            for pk, (term_ids, tfs) in self._doc_terms.items():
+                norm = norms[pk]
+                self._doc_terms[pk] = (term_ids, array('f', [tf * (k1 + 1) / (tf + norm) for tf in tfs]))
+            for term_id, (docs, tfs) in enumerate(self._postings):
+                negated = [-tf * (k1 + 1) / (tf + norms[pk]) for pk, tf in zip(docs, tfs)]
+                order = sorted(range(len(docs)), key=negated.__getitem__)
+                self._postings[term_id] = (array('q', [docs[i] for i in order]), array('f', [negated[i] for i in order]))
+
+    # ---- keeping workers in step ---------------------------------------
+
+    def current_generation(self):
+        generation = cache.get(self.generation_key)
+        if generation is None:
+            # Seed from the clock so a log lost from the shared cache never repeats old numbers
+            cache.add(self.generation_key, time.time_ns(), timeout=None)
+            generation = cache.get(self.generation_key)
+        return generation
+
+    def log_change(self, kind, pk=None):
+        """Append a committed change for the other workers: ('product', id), ('category', id) or ('all', None)."""
+        try:
+            generation = cache.incr(self.generation_key)
+        except ValueError:
+            cache.add(self.generation_key, time.time_ns(), timeout=None)
+            generation = cache.incr(self.generation_key)
+        cache.set(f'{self.change_prefix}{generation}', (kind, pk), timeout=getattr(settings, 'SEARCH_INDEX_LOG_TTL', 3600))
+
+    def sync(self, force=False):
+        """Catch up with changes committed by other workers; a no-op until warm() has built the index."""
+        if not self._built or self._warming is not None and self._warming.is_alive():
+            return
+        interval = getattr(settings, 'SEARCH_INDEX_SYNC_INTERVAL', 5)
+        if not force and time.monotonic() - self._last_sync < interval:
+            return
+
+        with self._lock:
+            self._last_sync = time.monotonic()
+            current = self.current_generation()
+            behind = current - self._generation
+            if behind == 0:
+                return
+            if not 0 < behind <= getattr(settings, 'SEARCH_INDEX_LOG_MAX', 1000):
+                self.warm()  # the log was reseeded, or this worker is too far behind to replay it
+                return
+
+            numbers = range(self._generation + 1, current + 1)
+            found = cache.get_many([f'{self.change_prefix}{n}' for n in numbers])
+            products, categories = set(), set()
+            for n in numbers:
+                change = found.get(f'{self.change_prefix}{n}')
+                if change is None:
+                    if self._gap == n:
+                        self.warm()  # still missing one sync later, so it expired rather than being in flight
+                        return
+                    self._gap = n
+                    break
+                kind, pk = change
+                if kind == 'all':
+                    self.warm()
+                    return
+                (products if kind == 'product' else categories).add(pk)
+                self._generation = n
+
+            rows = Product.objects.filter(pk__in=products) | Product.objects.filter(category_id__in=categories)
+            missing = set(products)
+            for pk, title, description, category in rows.values_list(
+                    'id', 'title', 'description', 'category__name').iterator(chunk_size=2000):
+                missing.discard(pk)
+                self._remove(pk)
+                self._add(pk, title, description, category)
+            for pk in missing:
+                self._remove(pk)  # deleted by another worker
+
+    # ---- incremental updates -------------------------------------------
+
+    def product_saved(self, product):
+        transaction.on_commit(lambda: (self.index_product(product), self.log_change('product', product.pk)))
+
+    def product_deleted(self, pk):
+        transaction.on_commit(lambda: (self.remove_product(pk), self.log_change('product', pk)))
+
+    def category_changed(self, category_id, deleted=False):
+        # Deleting a category nulls its products' category without signals, so only a rebuild sees that
+        transaction.on_commit(lambda: (
+            self.log_change('all') if deleted else self.log_change('category', category_id),
+            self.sync(force=True),
+        ))
+
+    def index_product(self, product):
+        if not self._built:
+            return  # warm() builds everything from the database
+        category = product.category.name if product.category_id else None
+        with self._lock:
+            self._remove(product.pk)
+            self._add(product.pk, product.title, product.description, category)
+
+    def remove_product(self, pk):
+        if not self._built:
+            return
+        with self._lock:
+            self._remove(pk)
+
+    def _term_id(self, term):
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term_id = len(self._postings)
+            self._term_ids[term] = term_id
+            self._postings.append((array('q'), array('f')))
+            bisect.insort(self._vocabulary, term)
+        return term_id
+
+    def _weigh(self, title, description, category):
+        weights = {}
+        length = 0.0
+        for text, boost in ((title, TITLE_BOOST), (category, CATEGORY_BOOST), (description, 1.0)):
+            for token in tokenize(text):
+                weights[token] = weights.get(token, 0.0) + boost
+                length += boost
+        return weights, length
+
+    def _impact(self, tf, length):
+        avg_len = self._total_len / len(self._doc_len) if self._doc_len else length
+        norm = self.k1 * (1 - self.b + self.b * length / (avg_len or 1.0))
+        return tf * (self.k1 + 1) / (tf + norm)
+
+    def _add(self, pk, title, description, category):
+        # Impacts use the corpus average at insert time; the next rebuild renormalizes
+        weights, length = self._weigh(title, description, category)
+        self._doc_len[pk] = length
+        self._total_len += length
+
+        term_ids, impacts = array('I'), array('f')
+        for term, tf in weights.items():
+            term_id = self._term_id(term)
+            impact = self._impact(tf, length)
+            docs, negated = self._postings[term_id]
+            position = bisect.bisect_right(negated, -impact)
+            docs.insert(position, pk)
+            negated.insert(position, -impact)
+            term_ids.append(term_id)
+            impacts.append(impact)
+        self._doc_terms[pk] = (term_ids, impacts)
+
+    def _remove(self, pk):
+        entry = self._doc_terms.pop(pk, None)
+        if entry is None:
+            return
+        self._total_len -= self._doc_len.pop(pk)
+        for term_id in entry[0]:
+            docs, negated = self._postings[term_id]
+            position = docs.index(pk)
+            del docs[position]
+            del negated[position]
+
+    # ---- querying -------------------------------------------------------
+
+    def _expand_prefix(self, prefix):
+        """The MAX_PREFIX_EXPANSIONS terms starting with ``prefix`` that are in the most documents."""
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = start
+        while end < len(self._vocabulary) and self._vocabulary[end].startswith(prefix):
+            end += 1
+        postings, term_ids = self._postings, self._term_ids
+        return heapq.nlargest(
+            MAX_PREFIX_EXPANSIONS, self._vocabulary[start:end], key=lambda term: len(postings[term_ids[term]][0])
+        )
+
+    def _score(self, pk, query_idf):
+        term_ids, impacts = self._doc_terms[pk]
+        score = 0.0
+        for term_id, idf in query_idf.items():
+            try:
+                score += idf * impacts[term_ids.index(term_id)]
+            except ValueError:
+                pass
+        return score
+
+    def search(self, query, offset=0, limit=20):
+        """Return (total_matches, [product ids]) for one page of ranked results."""
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+
+        with self._lock:
+            # The last word may still be being typed, so it also matches as a prefix
+            terms = set(tokens[:-1]) | set(self._expand_prefix(tokens[-1]) or [tokens[-1]])
+            doc_count = len(self._doc_len)
+            query_idf, lists = {}, []
+            for term in terms:
+                term_id = self._term_ids.get(term)
+                if term_id is None or not self._postings[term_id][0]:
+                    continue
+                docs, negated = self._postings[term_id]
+                idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+                query_idf[term_id] = idf
+                lists.append((idf, docs, negated))
+            if not lists:
+                return 0, []
+
+            wanted = offset + limit
+            top, seen = [], set()  # min-heap of (score, pk) holding the best `wanted` docs
+            depth = 0
+            while True:
+                threshold, advanced = 0.0, False
+                for idf, docs, negated in lists:
+                    if depth >= len(docs):
+                        continue
+                    advanced = True
+                    threshold -= idf * negated[depth]
+                    pk = docs[depth]
+                    if pk in seen:
+                        continue
+                    seen.add(pk)
+                    entry = (self._score(pk, query_idf), pk)
+                    if len(top) < wanted:
+                        heapq.heappush(top, entry)
+                    elif entry > top[0]:
+                        heapq.heapreplace(top, entry)
+                if not advanced or (len(top) >= wanted and top[0][0] >= threshold):
+                    break
+                depth += 1
+
+            if len(lists) == 1:
+                total = len(lists[0][1])
+            else:
+                total = len(set().union(*(docs for _, docs, _ in lists)))
+
+        # Newer listings (higher id) win ties
+        ranked = sorted(top, reverse=True)
+        return total, [pk for _, pk in ranked[offset:]]
+
+
+product_index = ProductSearchIndex()
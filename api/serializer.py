@@ -1,7 +1,6 @@
 from datetime import timedelta
 from django.utils.timezone import now
 from rest_framework import serializers
-from django.db.models import Avg
 from chats.models import ChatRoom
 from .models import (
     User,
@@ -11,8 +10,10 @@ from .models import (
     ProductImage,
     ProductRequest,
     Rating,
-    OTP
+    SellerStats,
 )
+from .loaders import ViewerRequestState, BatchLoader
+from .images import build_srcset, variant_url
 
 class UserSerializer(serializers.ModelSerializer):
     password2 = serializers.CharField(style={'input_type': 'password'}, write_only=True)
@@ -39,11 +40,6 @@ class UserSerializer(serializers.ModelSerializer):
         return User.objects.create_user(**validated_data)
 
 
-class OTPSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = OTP
-        fields = ['user', 'otp_code']
-        
 class UserLoginSerializer(serializers.ModelSerializer):
     email=serializers.EmailField(max_length=255)
     
@@ -56,15 +52,19 @@ class UserProfileSerializer(serializers.ModelSerializer):
     average_rating = serializers.SerializerMethodField()
     username = serializers.SerializerMethodField()
     user = serializers.PrimaryKeyRelatedField(read_only=True)  # Prevent user field from being modified
+    image_srcset = serializers.SerializerMethodField()
 
 
     class Meta:
         model = UserProfile
-        fields = ['user','username','name', 'address', 'course', 'college_year', 'gender', 'image', 'average_rating']
+        fields = ['user','username','name', 'address', 'course', 'college_year', 'gender', 'image', 'image_srcset', 'average_rating']
         read_only_fields = ['user', 'average_rating']  
 
+    def get_image_srcset(self, obj):
+        return build_srcset(obj.variants, self.context.get('request'))
+
     def get_average_rating(self, obj):
-        return obj.user.received_ratings.aggregate(avg=Avg('rating'))['avg'] or 0
+        return obj.average_rating
 
 
     def get_username(self, obj):
@@ -77,9 +77,48 @@ class CategorySerializer(serializers.ModelSerializer):
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ['image']
+        fields = ['image', 'srcset']
+
+    def get_srcset(self, obj):
+        # {format: "url 160w, url 480w, ..."}; empty until the variants have been built
+        return build_srcset(obj.variants, self.context.get('request'))
+
+class ProductListSerializer(serializers.ListSerializer):
+    """Preloads the viewer's request state for the whole page before rendering rows."""
+
+    def to_representation(self, data):
+        iterable = data.all() if hasattr(data, 'all') else data
+        products = list(iterable)
+        if self.context.get('request') is not None and self.child.VIEWER_FIELDS & set(self.child.fields):
+            self.child.get_viewer_state().load(product.pk for product in products)
+        return super().to_representation(products)
+
+    def merge_viewer_state(self, rows):
+        """
+        Add the viewer's request fields to rows rendered with ``viewer_independent``
+        (as stored in api.caching), in the field order a direct render would use.
+        """
+        user = self.context['request'].user
+        names = [name for name, field in self.child.fields.items() if not field.write_only]
+        wanted = self.child.VIEWER_FIELDS & set(names)
+        state = self.child.get_viewer_state()
+        if wanted:
+            state.load(row['id'] for row in rows if row['seller_id'] != user.id)
+
+        merged = []
+        for row in rows:
+            values = dict(row)
+            if wanted and row['seller_id'] != user.id:
+                values['has_requested'] = state.has_requested(row['id'])
+                values['request_status'] = state.request_status(row['id'])
+                values['request_id'] = state.request_id(row['id'])
+            merged.append({name: values[name] for name in names if name in values})
+        return merged
+
 
 class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, required=False)  
@@ -91,17 +130,59 @@ class ProductSerializer(serializers.ModelSerializer):
     has_requested = serializers.SerializerMethodField()
     request_status = serializers.SerializerMethodField()
     request_id = serializers.SerializerMethodField()  # <--- define this
+    cover_image = serializers.SerializerMethodField()
 
+    VIEWER_FIELDS = {'has_requested', 'request_status', 'request_id'}
+    OPTIONAL_FIELDS = {'cover_image'}  # only rendered when asked for through ?fields= / ?expand=
 
 
     class Meta:
         model = Product
         fields = ['id', 'title', 'description', 'price', 'seller_id', 'category', 'category_id',
-          'status', 'upload_date', 'images', 'has_requested', 'request_status','request_id']
+          'status', 'upload_date', 'images', 'has_requested', 'request_status','request_id', 'cover_image']
+        list_serializer_class = ProductListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Narrow the representation to the requested ProductFieldset, if any
+        fieldset = self.context.get('fieldset')
+        # Rows shared between viewers leave out the viewer fields but always carry seller_id
+        viewer_independent = self.context.get('viewer_independent', False)
+        for name, field in list(self.fields.items()):
+            if field.write_only or (viewer_independent and name == 'seller_id'):
+                continue
+            if viewer_independent and name in self.VIEWER_FIELDS:
+                self.fields.pop(name)
+            elif fieldset is not None and not fieldset.includes(name):
+                self.fields.pop(name)
+            elif fieldset is None and name in self.OPTIONAL_FIELDS:
+                self.fields.pop(name)
     
     
     def get_seller_id(self, obj):
-        return obj.seller.id if obj.seller else None 
+        return obj.seller_id
+
+    def get_cover_image(self, obj):
+        images = getattr(obj, 'cover_images', None)
+        if images is None:
+            images = obj.images.all()[:1]
+        if not images:
+            return None
+        request = self.context.get('request')
+        # Feed cards get the resized card copy once it exists
+        card = variant_url(images[0].variants, 'card', request=request)
+        if card:
+            return card
+        url = images[0].image.url
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_viewer_state(self):
+        # Kept in the context so every ProductSerializer in one response shares it
+        state = self.context.get('viewer_state')
+        if state is None:
+            state = ViewerRequestState(self.context['request'].user)
+            self.context['viewer_state'] = state
+        return state
     
     def validate(self, attrs):
         seller = self.context['request'].user
@@ -135,49 +216,33 @@ class ProductSerializer(serializers.ModelSerializer):
         
         return attrs
 
-    def update(self, instance, validated_data):
-        images = self.context['request'].FILES.getlist('images')
-        instance = super().update(instance, validated_data)
-        if images:
-            instance.images.all().delete()  # Remove old images
-            for image in images:
-                ProductImage.objects.create(product=instance, image=image)
-        return instance
-
 
     def get_has_requested(self, obj):
         user = self.context['request'].user
-        if obj.seller == user:
+        if obj.seller_id == user.id:
             return None  # or skip showing it
-        return ProductRequest.objects.filter(
-            product=obj, buyer=user,
-            status__in=["pending", "accepted"]
-        ).exists()
+        state = self.get_viewer_state()
+        state.load([obj.pk])
+        return state.has_requested(obj.pk)
 
     def get_request_status(self, obj):
-        user = self.context['request'].user
-        request = ProductRequest.objects.filter(
-            product=obj,
-            buyer=user
-        ).order_by('-id').first()  # in case of multiple, get the latest
-
-        # Return status only if it’s still relevant
-        return request.status if request and request.status in ["pending", "accepted"] else None
+        state = self.get_viewer_state()
+        state.load([obj.pk])
+        # Status of the latest request, only if it's still relevant
+        return state.request_status(obj.pk)
 
     def get_request_id(self, obj):
         user = self.context['request'].user
-        if obj.seller == user:
+        if obj.seller_id == user.id:
             return None
-        product_request = ProductRequest.objects.filter(
-            product=obj, buyer=user,
-            status__in=["pending", "accepted"]
-        ).first()
-        return product_request.id if product_request else None
+        state = self.get_viewer_state()
+        state.load([obj.pk])
+        return state.request_id(obj.pk)
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
         user = self.context['request'].user
-        if instance.seller == user:
+        if instance.seller_id == user.id:
             data.pop('has_requested', None)
             data.pop('request_status', None)
             data.pop('request_id', None)
@@ -358,6 +423,20 @@ class RatingSerializer(serializers.ModelSerializer):
             **validated_data
         )
  
+class ProductRequestHistoryListSerializer(serializers.ListSerializer):
+    """Registers every profile and product the page needs so each is fetched in one query."""
+
+    def to_representation(self, data):
+        iterable = data.all() if hasattr(data, 'all') else data
+        history = list(iterable)
+        loader = self.child.get_loader()
+        loader.prime('profile', {obj.buyer_id for obj in history} | {obj.seller_id for obj in history})
+        product = self.child.fields['product']
+        if self.context.get('request') is not None and product.VIEWER_FIELDS & set(product.fields):
+            product.get_viewer_state().load(obj.product_id for obj in history)
+        return super().to_representation(history)
+
+
 class ProductRequestHistorySerializer(serializers.ModelSerializer):
     product = ProductSerializer()
     buyer = serializers.SerializerMethodField()
@@ -366,24 +445,58 @@ class ProductRequestHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductRequest
         fields = ['id', 'product', 'buyer', 'seller', 'status', 'created_at']
+        list_serializer_class = ProductRequestHistoryListSerializer
+
+    def get_loader(self):
+        # Shared through the context by every serializer rendering this response
+        loader = self.context.get('loader')
+        if loader is None:
+            loader = BatchLoader()
+            self.context['loader'] = loader
+        return loader
 
     def get_buyer(self, obj):
-        profile = getattr(obj.buyer, 'userprofile', None)
-        return {
-            "email": obj.buyer.email,
-            "username": obj.buyer.username,
-            "profile": UserProfileSerializer(profile).data if profile else None
-        }
+        return self.user_summary(obj.buyer)
 
     def get_seller(self, obj):
-        profile = getattr(obj.seller, 'userprofile', None)
+        return self.user_summary(obj.seller)
+
+    def user_summary(self, user):
+        profile = self.get_loader().load('profile', user.id)
         return {
-            "email": obj.seller.email,
-            "username": obj.seller.username,
+            "email": user.email,
+            "username": user.username,
             "profile": UserProfileSerializer(profile).data if profile else None
         }
     
 
+class SellerDashboardSerializer(serializers.ModelSerializer):
+    listings = serializers.SerializerMethodField()
+    requests = serializers.SerializerMethodField()
+    total_sold = serializers.IntegerField(source='listings_sold')
+    rating = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SellerStats
+        fields = ['listings', 'requests', 'total_sold', 'rating']
+
+    def get_listings(self, obj):
+        return {
+            "available": obj.listings_available,
+            "reserved": obj.listings_reserved,
+            "unavailable": obj.listings_unavailable,
+            "sold": obj.listings_sold,
+        }
+
+    def get_requests(self, obj):
+        return {"pending": obj.requests_pending, "accepted": obj.requests_accepted}
+
+    def get_rating(self, obj):
+        profile = getattr(obj.seller, 'userprofile', None)
+        if profile is None:
+            return {"average": 0, "count": 0}
+        return {"average": profile.average_rating, "count": profile.rating_count}
+
 #------------- change password------------------------
  
 class UserChangePasswordSerializer(serializers.Serializer):
@@ -2,7 +2,15 @@ from django.db.models.signals import post_save,pre_save,post_delete
 from django.dispatch import receiver
 from django.apps import apps
 from django.contrib.auth import get_user_model
-from api.models import UserProfile,ProductRequest,Product
+from django.db.models import F, Count, Sum
+from django.utils import timezone
+from api.models import UserProfile,ProductRequest,Product,ProductImage,Category,Rating
+from api.search import product_index
+from api.caching import product_feed_cache, feed_scope
+from api.images import schedule_variants
+from api.uploads import in_image_batch
+from api.authentication import forget_user
+from api.stats import LISTING_FIELDS, REQUEST_FIELDS, status_deltas, bump_seller_stats, recount_seller_stats
 from chats.utils import create_chat_room,deactivate_chat_room
 User = get_user_model()
 
@@ -11,6 +19,119 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance,name=instance.username)
           
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    # CachedJWTAuthentication and the socket handshake must not keep serving the old row
+    forget_user(instance.pk)
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """Keep the search indexes of this and the other workers in step with product edits."""
+    product_index.product_saved(instance)
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    product_index.product_deleted(instance.pk)
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    """A renamed category changes the indexed text of all its products."""
+    if not created:
+        product_index.category_changed(instance.pk)
+
+@receiver(post_delete, sender=Category)
+def reindex_uncategorized_products(sender, instance, **kwargs):
+    product_index.category_changed(instance.pk, deleted=True)
+
+def invalidate_product_feeds(*category_ids):
+    """Drop the cached home feed and the feeds of the given categories."""
+    slugs = Category.objects.filter(pk__in=[pk for pk in category_ids if pk]).values_list('slug', flat=True)
+    product_feed_cache.invalidate(feed_scope(), *(feed_scope(slug) for slug in slugs))
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_feeds_for_product(sender, instance, **kwargs):
+    # A move between categories changes both feeds
+    previous = getattr(instance, '_loaded_values', {}).get('category_id')
+    invalidate_product_feeds(instance.category_id, previous)
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_product_for_image(sender, instance, **kwargs):
+    # Covers the admin, the shell and the background variant saves; uploads
+    # refresh their product once per batch instead (api.uploads.add_product_images)
+    if in_image_batch():
+        return
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+    category_id = Product.objects.filter(pk=instance.product_id).values_list('category_id', flat=True).first()
+    invalidate_product_feeds(category_id)
+
+def image_changed(instance):
+    return instance.image.name != getattr(instance, '_loaded_values', {}).get('image')
+
+@receiver(pre_save, sender=ProductImage)
+@receiver(pre_save, sender=UserProfile)
+def reset_stale_variants(sender, instance, **kwargs):
+    if instance.variants and image_changed(instance):
+        instance.variants = {}
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=UserProfile)
+def render_image_variants(sender, instance, **kwargs):
+    # New or replaced uploads get their resized copies built after the commit
+    if instance.image and image_changed(instance):
+        schedule_variants(instance)
+
+@receiver(post_save, sender=Rating)
+def add_seller_rating(sender, instance, created, **kwargs):
+    """Fold a new rating into the seller's totals; an edited one triggers a recount."""
+    if created:
+        UserProfile.objects.filter(user_id=instance.seller_id).update(
+            rating_count=F('rating_count') + 1, rating_sum=F('rating_sum') + instance.rating
+        )
+    else:
+        recount_seller_ratings(instance.seller_id)
+
+@receiver(post_delete, sender=Rating)
+def remove_seller_rating(sender, instance, **kwargs):
+    UserProfile.objects.filter(user_id=instance.seller_id, rating_count__gt=0).update(
+        rating_count=F('rating_count') - 1, rating_sum=F('rating_sum') - instance.rating
+    )
+
+def recount_seller_ratings(seller_id):
+    totals = Rating.objects.filter(seller_id=seller_id).aggregate(count=Count('id'), total=Sum('rating'))
+    UserProfile.objects.filter(user_id=seller_id).update(
+        rating_count=totals['count'], rating_sum=totals['total'] or 0
+    )
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductRequest)
+def remember_previous_status(sender, instance, **kwargs):
+    # Instances loaded with status deferred (or built by hand) need the stored value read before it is overwritten
+    loaded = instance.__dict__.setdefault('_loaded_values', {})
+    if instance.pk and 'status' not in loaded:
+        loaded['status'] = sender.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+@receiver(post_save, sender=Product)
+def count_listing_status(sender, instance, created, **kwargs):
+    previous = None if created else instance._loaded_values.get('status')
+    bump_seller_stats(instance.seller_id, status_deltas(LISTING_FIELDS, previous, instance.status))
+
+@receiver(post_delete, sender=Product)
+def recount_after_product_delete(sender, instance, **kwargs):
+    # Cascaded request deletes may have saved this product mid-delete, so recount rather than trust instance.status
+    recount_seller_stats([instance.seller_id], create=False)
+
+@receiver(post_save, sender=ProductRequest)
+def count_request_status(sender, instance, created, **kwargs):
+    previous = None if created else instance._loaded_values.get('status')
+    bump_seller_stats(instance.seller_id, status_deltas(REQUEST_FIELDS, previous, instance.status))
+
+@receiver(post_delete, sender=ProductRequest)
+def uncount_request(sender, instance, **kwargs):
+    bump_seller_stats(instance.seller_id, status_deltas(REQUEST_FIELDS, instance.status, None))
+
 @receiver(post_save, sender=ProductRequest)
 def update_product_status(sender, instance, created, **kwargs):
     """
@@ -31,7 +152,7 @@ def update_product_status(sender, instance, created, **kwargs):
             if product.status == 'reserved':
                 product.status = 'unavailable'
 
-        # Save the product status change
+        # Save the product status change (this also invalidates the cached feeds holding it)
         product.save()
 
 # Signal to handle product status changes when a request is deleted
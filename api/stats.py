@@ -0,0 +1,65 @@
+from django.db.models import Count, F
+
+from .models import Product, ProductRequest, SellerStats
+
+# Which SellerStats column counts a product or request in a given status
+LISTING_FIELDS = {
+    'available': 'listings_available',
+    'reserved': 'listings_reserved',
+    'unavailable': 'listings_unavailable',
+    'sold': 'listings_sold',
+}
+REQUEST_FIELDS = {
+    'pending': 'requests_pending',
+    'accepted': 'requests_accepted',
+}
+
+
+def status_deltas(fields, previous, current):
+    """Counter changes for something moving from ``previous`` to ``current`` status (None = absent)."""
+    deltas = {}
+    if previous != current:
+        if previous in fields:
+            deltas[fields[previous]] = -1
+        if current in fields:
+            deltas[fields[current]] = deltas.get(fields[current], 0) + 1
+    return deltas
+
+
+def bump_seller_stats(seller_id, deltas):
+    """Apply counter deltas in one UPDATE; a seller without a row yet gets a full recount."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas or seller_id is None:
+        return
+    updated = SellerStats.objects.filter(seller_id=seller_id).update(
+        **{name: F(name) + delta for name, delta in deltas.items()}
+    )
+    if not updated:
+        # The change is already in the database, so counting from scratch includes it
+        recount_seller_stats([seller_id])
+
+
+def recount_seller_stats(seller_ids, create=True):
+    """
+    Recompute the counters of the given sellers from their products and received requests.
+
+    With ``create=False`` only existing rows are refreshed, which is what delete
+    paths need: the seller itself may be going away in the same transaction.
+    """
+    seller_ids = set(seller_ids)
+    counts = {seller_id: dict.fromkeys([*LISTING_FIELDS.values(), *REQUEST_FIELDS.values()], 0) for seller_id in seller_ids}
+    listings = Product.objects.filter(seller_id__in=seller_ids).values_list('seller_id', 'status').annotate(n=Count('id')).order_by()
+    for seller_id, status, n in listings:
+        if status in LISTING_FIELDS:
+            counts[seller_id][LISTING_FIELDS[status]] = n
+    requests = ProductRequest.objects.filter(
+        seller_id__in=seller_ids, status__in=list(REQUEST_FIELDS)
+    ).values_list('seller_id', 'status').annotate(n=Count('id')).order_by()
+    for seller_id, status, n in requests:
+        counts[seller_id][REQUEST_FIELDS[status]] = n
+
+    for seller_id, values in counts.items():
+        if create:
+            SellerStats.objects.update_or_create(seller_id=seller_id, defaults=values)
+        else:
+            SellerStats.objects.filter(seller_id=seller_id).update(**values)
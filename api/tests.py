@@ -1,3 +1,874 @@
-from django.test import TestCase
+import io
+import json
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import User, UserProfile, Category, Product, ProductImage, ProductRequest, Rating, SellerStats, Job
+from . import jobs
+from .otp import verification_otp, reset_otp
+from .search import ProductSearchIndex, product_index
+from .uploads import add_product_images
+from .caching import BoundedLRUCache, product_feed_cache
+from .authentication import CachedJWTAuthentication, user_cache_key
+from .renderers import UserRenderer, FastJSONRenderer
+from .fieldsets import ProductFieldset
+from .serializer import ProductSerializer, ProductImageSerializer
+
+
+def make_user(username):
+    return User.objects.create_user(
+        email=f"{username}@kiet.edu", username=username, password="pass1234", is_email_verified=True
+    )
+
+
+def make_product(seller, category, title="Book"):
+    product = Product.objects.create(
+        title=title, description="Second hand", price="100.00", seller=seller, category=category
+    )
+    ProductImage.objects.create(product=product, image=f"product_images/{title}.jpg")
+    return product
+
+
+class ProductListViewerStateTests(TestCase):
+    def setUp(self):
+        self.seller = make_user("seller")
+        self.buyer = make_user("buyer")
+        self.category = Category.objects.create(name="Books", slug="books")
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def add_products(self, count):
+        for i in range(count):
+            make_product(self.seller, self.category, title=f"Book {Product.objects.count()}")
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('all-products'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_list_query_count_is_constant(self):
+        self.add_products(3)
+        small_page = self.count_list_queries()
+        self.add_products(30)
+        large_page = self.count_list_queries()
+        self.assertEqual(small_page, large_page)
+
+    def test_request_state_matches_per_product_rules(self):
+        pending, rejected, untouched = [
+            make_product(self.seller, self.category, title=title) for title in ("a", "b", "c")
+        ]
+        active = ProductRequest.objects.create(buyer=self.buyer, seller=self.seller, product=pending)
+        ProductRequest.objects.create(buyer=self.buyer, seller=self.seller, product=rejected, status='rejected')
+
+        response = self.client.get(reverse('all-products'))
+        by_id = {item['id']: item for item in response.json()['results']}
+
+        self.assertEqual(
+            {k: by_id[pending.id][k] for k in ('has_requested', 'request_status', 'request_id', 'seller_id')},
+            {'has_requested': True, 'request_status': 'pending', 'request_id': active.id, 'seller_id': self.seller.id},
+        )
+        for product in (rejected, untouched):
+            self.assertIs(by_id[product.id]['has_requested'], False)
+            self.assertIsNone(by_id[product.id]['request_status'])
+            self.assertIsNone(by_id[product.id]['request_id'])
+
+    def test_seller_does_not_see_request_fields(self):
+        make_product(self.seller, self.category)
+        self.client.force_authenticate(self.seller)
+        response = self.client.get(reverse('my-products'))
+        self.assertNotIn('has_requested', response.json()['results'][0])
+
+
+class ProductCursorPaginationTests(TestCase):
+    def setUp(self):
+        self.seller = make_user("seller")
+        self.buyer = make_user("buyer")
+        self.category = Category.objects.create(name="Books", slug="books")
+        self.products = [make_product(self.seller, self.category, title=f"Book {i}") for i in range(7)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def walk(self, url):
+        seen = []
+        while url:
+            body = self.client.get(url).json()
+            self.assertLessEqual(len(body['results']), 3)
+            seen.extend(item['id'] for item in body['results'])
+            url = body['next']
+        return seen
+
+    def test_walks_every_product_newest_first(self):
+        # Same upload_date on every row forces the id tie-breaker
+        Product.objects.update(upload_date=self.products[0].upload_date)
+        seen = self.walk(reverse('all-products') + '?page_size=3')
+        self.assertEqual(seen, sorted((p.id for p in self.products), reverse=True))
+
+    def test_category_feed_is_paginated(self):
+        seen = self.walk(reverse('products-by-category') + '?category=books&page_size=3')
+        self.assertEqual(len(seen), 7)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('all-products') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.seller = make_user("seller")
+        self.buyer = make_user("buyer")
+        books = Category.objects.create(name="Books", slug="books")
+        electronics = Category.objects.create(name="Electronics", slug="electronics")
+        self.in_title = make_product(self.seller, electronics, title="Scientific calculator")
+        self.in_description = Product.objects.create(
+            title="Maths kit", description="Compass, scale and an old calculator",
+            price="50.00", seller=self.seller, category=books,
+        )
+        self.unrelated = make_product(self.seller, books, title="Hostel kettle")
+        self.books = books
+        cache.clear()
+        self.addCleanup(cache.clear)
+        product_index.rebuild()
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def search(self, query):
+        response = self.client.get(reverse('product-search'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_title_matches_rank_first(self):
+        ids = [item['id'] for item in self.search('calculator')['results']]
+        self.assertEqual(ids, [self.in_title.id, self.in_description.id])
+
+    def test_last_word_matches_as_prefix(self):
+        ids = [item['id'] for item in self.search('scientific calc')['results']]
+        self.assertEqual(ids[0], self.in_title.id)
+
+    def test_category_name_is_searchable(self):
+        ids = {item['id'] for item in self.search('electronics')['results']}
+        self.assertEqual(ids, {self.in_title.id})
+
+    def test_index_follows_saves_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.unrelated.title = "Graphing calculator"
+            self.unrelated.save()
+            self.in_title.delete()
+        ids = {item['id'] for item in self.search('calculator')['results']}
+        self.assertEqual(ids, {self.unrelated.id, self.in_description.id})
+
+    def test_sync_picks_up_writes_from_other_processes(self):
+        other = ProductSearchIndex()  # another worker's index
+        other.rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            # A delete and a create in one window leave the product count unchanged
+            self.in_title.delete()
+            added = make_product(self.seller, None, title="Calculator cover")
+            self.books.name = "Textbooks"
+            self.books.save()
+        other.sync(force=True)
+        self.assertEqual(set(other.search('calculator')[1]), {added.id, self.in_description.id})
+        self.assertEqual(set(other.search('textbooks')[1]), {self.in_description.id, self.unrelated.id})
+
+    def test_prefixes_expand_to_the_most_common_terms(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cords = {make_product(self.seller, None, title=f"Phone cord {i}").id for i in range(2)}
+        with mock.patch('api.search.MAX_PREFIX_EXPANSIONS', 1):
+            # "compass" sorts first, but "cord" is in more listings
+            ids = {item['id'] for item in self.search('co')['results']}
+        self.assertEqual(ids, cords)
+
+    def test_falls_back_to_the_database_until_built(self):
+        with mock.patch.object(ProductSearchIndex, 'built', False), \
+                mock.patch.object(ProductSearchIndex, 'warm') as warm:
+            ids = {item['id'] for item in self.search('calculator')['results']}
+        self.assertEqual(ids, {self.in_title.id, self.in_description.id})
+        warm.assert_called_once_with()  # the first search starts the build
+
+    def test_no_match(self):
+        self.assertEqual(self.search('bicycle'), {"message": "No products found matching your search."})
+
+    def test_ranked_results_are_paginated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(4):
+                make_product(self.seller, None, title=f"Calculator {i}")
+        first = self.client.get(reverse('product-search'), {'q': 'calculator', 'page_size': 4}).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(first['results']), 4)
+        self.assertEqual(len(second['results']), 2)
+        self.assertIsNone(second['next'])
+
+
+class ProductFieldsetTests(TestCase):
+    def setUp(self):
+        self.seller = make_user("seller")
+        self.buyer = make_user("buyer")
+        self.category = Category.objects.create(name="Books", slug="books")
+        self.product = make_product(self.seller, self.category)
+        ProductImage.objects.create(product=self.product, image="product_images/second.jpg")
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def test_card_preset(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('all-products'), {'fields': 'card'})
+        item = response.json()['results'][0]
+        self.assertEqual(set(item), {'id', 'title', 'price', 'status', 'cover_image'})
+        self.assertTrue(item['cover_image'].endswith('/media/product_images/Book.jpg'))
+        sql = " ".join(query['sql'] for query in ctx.captured_queries)
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('api_productrequest', sql)
+
+    def test_expand_adds_relations_to_selected_fields(self):
+        response = self.client.get(reverse('all-products'), {'fields': 'title', 'expand': 'category'})
+        item = response.json()['results'][0]
+        self.assertEqual(set(item), {'id', 'title', 'category'})
+        self.assertEqual(item['category']['slug'], 'books')
+
+    def test_default_representation_is_unchanged(self):
+        response = self.client.get(reverse('product-detail', args=[self.product.id]))
+        self.assertEqual(set(response.json()['product']), {
+            'id', 'title', 'description', 'price', 'seller_id', 'category', 'status', 'upload_date',
+            'images', 'has_requested', 'request_status', 'request_id',
+        })
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get(reverse('all-products'), {'fields': 'title,password'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductFeedCacheTests(TestCase):
+    def setUp(self):
+        product_feed_cache.clear()
+        self.seller = make_user("seller")
+        self.buyer = make_user("buyer")
+        self.category = Category.objects.create(name="Books", slug="books")
+        self.product = make_product(self.seller, self.category)
+        self.own = make_product(self.buyer, self.category, title="Own listing")
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def feed(self, url=None, **params):
+        response = self.client.get(url or reverse('all-products'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_second_read_is_served_from_cache(self):
+        self.feed()
+        with CaptureQueriesContext(connection) as ctx:
+            self.feed()
+        # Only the ETag aggregate touches the product table; rows come from the cache
+        self.assertFalse([q for q in ctx.captured_queries if '"api_product"."title"' in q['sql']])
+        self.assertEqual(product_feed_cache.stats()['hits'], 1)
+
+    def test_pages_are_cached_per_host_and_scheme(self):
+        covers = set()
+        for host, secure in (('localhost', False), ('127.0.0.1', False), ('localhost', True)):
+            response = self.client.get(reverse('all-products'), {'fields': 'card'}, HTTP_HOST=host, secure=secure)
+            cover = response.json()['results'][0]['cover_image']
+            self.assertTrue(cover.startswith(f"{'https' if secure else 'http'}://{host}/"))
+            covers.add(cover)
+        self.assertEqual(len(covers), 3)
+
+    def test_viewer_fields_are_merged_per_user(self):
+        self.feed()
+        request = ProductRequest.objects.create(buyer=self.buyer, seller=self.seller, product=self.product)
+        items = self.feed()
+        self.assertEqual([item['id'] for item in items], [self.product.id])
+        self.assertEqual((items[0]['has_requested'], items[0]['request_id']), (True, request.id))
+
+        self.client.force_authenticate(self.seller)
+        ids = [item['id'] for item in self.feed()]
+        self.assertEqual(ids, [self.own.id])
+
+    def test_product_and_image_changes_invalidate(self):
+        self.feed(reverse('products-by-category'), category='books')
+        self.product.title = "Renamed"
+        self.product.save()
+        self.assertEqual(self.feed(reverse('products-by-category'), category='books')[0]['title'], "Renamed")
+
+        add_product_images(self.product, ["product_images/extra.jpg"])
+        self.assertEqual(len(self.feed()[0]['images']), 2)
+
+        self.product.images.first().delete()
+        self.assertEqual(len(self.feed()[0]['images']), 1)
+
+    def test_replacing_images_refreshes_the_product_once(self):
+        with mock.patch('api.signals.invalidate_product_feeds') as invalidate:
+            add_product_images(self.product, ["product_images/new.jpg"], replace=True)
+        self.assertEqual(list(self.product.images.values_list('image', flat=True)), ["product_images/new.jpg"])
+        invalidate.assert_called_once()  # by the product's own save
+
+    def test_own_listings_are_topped_up_from_later_pages(self):
+        others = [make_product(self.seller, self.category, title=f"Other {i}") for i in range(3)]
+        for i in range(3):
+            make_product(self.buyer, self.category, title=f"Own {i}")
+        # Newest first: Own 2, Own 1, Own 0, Other 2, Other 1, Other 0, ...
+        first = self.client.get(reverse('all-products'), {'page_size': 2}).json()
+        self.assertEqual([item['id'] for item in first['results']], [others[2].id, others[1].id])
+        second = self.client.get(first['next']).json()
+        self.assertEqual([item['id'] for item in second['results']], [others[0].id, self.product.id])
+        self.assertIsNone(second['next'])
+
+    def test_cached_rows_keep_field_order(self):
+        uncached = self.client.get(reverse('product-detail', args=[self.product.id])).json()['product']
+        self.feed()
+        self.assertEqual(list(self.feed()[0]), list(uncached))
+
+    def test_lru_is_bounded(self):
+        lru = BoundedLRUCache(max_entries=2)
+        for key in "abc":
+            lru.set(key, key)
+        self.assertIsNone(lru.get("a"))
+        self.assertEqual(lru.stats()['evictions'], 1)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.seller = make_user("seller")
+        self.buyer = make_user("buyer")
+        self.category = Category.objects.create(name="Books", slug="books")
+        self.product = make_product(self.seller, self.category)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def revalidate(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        return first['ETag']
+
+    def assertNotModified(self, url, etag):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_product_detail(self):
+        url = reverse('product-detail', args=[self.product.id])
+        etag = self.revalidate(url)
+        self.assertNotModified(url, etag)
+
+        ProductRequest.objects.create(buyer=self.buyer, seller=self.seller, product=self.product)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['product']['has_requested'])
+
+    def test_etag_is_per_viewer(self):
+        url = reverse('product-detail', args=[self.product.id])
+        etag = self.revalidate(url)
+        self.client.force_authenticate(self.seller)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_feed_pages(self):
+        url = reverse('all-products')
+        etag = self.revalidate(url)
+        self.assertNotModified(url, etag)
+
+        add_product_images(self.product, ["product_images/extra.jpg"])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_image_saves_and_deletes_outside_uploads(self):
+        url = reverse('all-products')
+        etag = self.revalidate(url)
+        image = ProductImage.objects.create(product=self.product, image="product_images/admin.jpg")
+        etag = self.assertChanged(url, etag)
+        image.delete()
+        self.assertChanged(url, etag)
+
+    def assertChanged(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_profile(self):
+        url = reverse('user-profile-detail', args=[self.seller.id])
+        etag = self.revalidate(url)
+        self.assertNotModified(url, etag)
+
+        profile = self.seller.userprofile
+        profile.course = "B.Tech"
+        profile.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class HistoryBatchLoadingTests(TestCase):
+    def setUp(self):
+        self.seller = make_user("seller")
+        self.category = Category.objects.create(name="Books", slug="books")
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def sell(self, count):
+        for i in range(count):
+            buyer = make_user(f"buyer{Product.objects.count()}")
+            product = make_product(self.seller, self.category, f"Book {Product.objects.count()}")
+            ProductRequest.objects.create(buyer=buyer, seller=self.seller, product=product)
+            Product.objects.filter(pk=product.pk).update(status='sold')
+
+    def history_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('selling-history'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_query_count_is_fixed(self):
+        self.sell(1)
+        one, _ = self.history_queries()
+        self.sell(4)
+        five, rows = self.history_queries()
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(one, five)
+        self.assertEqual(rows[0]['seller']['profile']['username'], "seller")
+        self.assertEqual(rows[0]['product']['category']['slug'], "books")
+
+
+class SellerDashboardTests(TestCase):
+    def setUp(self):
+        self.seller = make_user("seller")
+        self.buyers = [make_user(f"buyer{i}") for i in range(2)]
+        self.category = Category.objects.create(name="Books", slug="books")
+        self.products = [make_product(self.seller, self.category, f"Book {i}") for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def dashboard(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('seller-dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if 'COUNT(' in q['sql']])
+        return response.json()
+
+    def test_counters_follow_request_lifecycle(self):
+        first = ProductRequest.objects.create(buyer=self.buyers[0], seller=self.seller, product=self.products[0])
+        ProductRequest.objects.create(buyer=self.buyers[1], seller=self.seller, product=self.products[0])
+        data = self.dashboard()
+        self.assertEqual(data['requests'], {"pending": 2, "accepted": 0})
+        self.assertEqual(data['listings']['available'], 3)
+
+        first.status = 'accepted'
+        first.save()
+        data = self.dashboard()
+        self.assertEqual(data['requests'], {"pending": 1, "accepted": 1})
+        self.assertEqual((data['listings']['available'], data['listings']['reserved']), (2, 1))
+
+        product = Product.objects.only('id', 'seller').get(pk=self.products[1].pk)
+        product.status = 'sold'
+        product.save()
+        self.products[2].delete()
+        data = self.dashboard()
+        self.assertEqual(data['total_sold'], 1)
+        self.assertEqual(data['listings'], {"available": 0, "reserved": 1, "unavailable": 0, "sold": 1})
+
+    def test_marking_sold_rejects_open_requests(self):
+        profile = self.seller.userprofile
+        profile.address, profile.course, profile.gender = "Hostel", "B.Tech", "Other"
+        profile.save()
+        ProductRequest.objects.create(buyer=self.buyers[0], seller=self.seller, product=self.products[0])
+        response = self.client.patch(
+            reverse('product-update'), {'product_id': self.products[0].pk, 'status': 'sold'}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        data = self.dashboard()
+        self.assertEqual((data['requests']['pending'], data['total_sold']), (0, 1))
+
+    def test_rebuild_command(self):
+        ProductRequest.objects.create(buyer=self.buyers[0], seller=self.seller, product=self.products[0])
+        SellerStats.objects.filter(seller=self.seller).update(requests_pending=7, listings_sold=3)
+        call_command('rebuild_seller_stats', stdout=io.StringIO())
+        stats = SellerStats.objects.get(seller=self.seller)
+        self.assertEqual((stats.requests_pending, stats.listings_sold, stats.listings_available), (1, 0, 3))
+
+
+class SellerRatingTests(TestCase):
+    def setUp(self):
+        self.seller = make_user("seller")
+        self.category = Category.objects.create(name="Books", slug="books")
+        self.products = [make_product(self.seller, self.category, f"Book {i}") for i in range(3)]
+        self.buyers = [make_user(f"buyer{i}") for i in range(3)]
+
+    def rate(self, buyer, product, value):
+        return Rating.objects.create(buyer=buyer, seller=self.seller, product=product, rating=Decimal(value))
+
+    def profile(self):
+        return UserProfile.objects.get(user=self.seller)
+
+    def test_totals_follow_ratings(self):
+        first = self.rate(self.buyers[0], self.products[0], "4.0")
+        self.rate(self.buyers[1], self.products[1], "5.0")
+        self.assertEqual((self.profile().rating_count, self.profile().average_rating), (2, Decimal("4.5")))
+
+        first.rating = Decimal("2.0")
+        first.save()
+        self.assertEqual(self.profile().rating_sum, Decimal("7.0"))
+
+        first.delete()
+        self.assertEqual((self.profile().rating_count, self.profile().average_rating), (1, Decimal("5.0")))
+
+    def test_profile_read_runs_no_aggregate(self):
+        self.rate(self.buyers[0], self.products[0], "3.0")
+        url = reverse('user-profile-detail', args=[self.seller.id])
+        with CaptureQueriesContext(connection) as ctx:
+            response = APIClient().get(url)
+        self.assertEqual(response.json()['average_rating'], 3.0)
+        self.assertFalse([q for q in ctx.captured_queries if 'api_rating' in q['sql']])
+
+    def test_profile_edit_keeps_rating_totals(self):
+        stale = self.profile()
+        self.rate(self.buyers[0], self.products[0], "4.0")
+        stale.course = "B.Tech"
+        stale.save()
+        self.assertEqual((self.profile().course, self.profile().rating_count), ("B.Tech", 1))
+
+    def test_rebuild_command(self):
+        self.rate(self.buyers[0], self.products[0], "4.0")
+        self.rate(self.buyers[1], self.products[1], "3.0")
+        UserProfile.objects.filter(user=self.seller).update(rating_count=9, rating_sum=1)
+        call_command('rebuild_rating_aggregates', stdout=io.StringIO())
+        self.assertEqual((self.profile().rating_count, self.profile().rating_sum), (2, Decimal("7.0")))
+        self.assertEqual(UserProfile.objects.get(user=self.buyers[0]).rating_count, 0)
+
+
+def image_upload(name, size, mode="RGB", fmt="JPEG"):
+    buffer = io.BytesIO()
+    Image.new(mode, size, "red").save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f"image/{fmt.lower()}")
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        overrides = self.settings(MEDIA_ROOT=self.media, IMAGE_VARIANTS_ASYNC=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.seller = make_user("seller")
+        self.product = Product.objects.create(
+            title="Lamp", description="Desk lamp", price="10.00", seller=self.seller, category=None
+        )
+
+    def upload(self, name, size, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=image_upload(name, size, **kwargs))
+        image.refresh_from_db()
+        return image
+
+    def test_variants_are_built_after_commit(self):
+        image = self.upload("lamp.jpg", (2000, 1500))
+        self.assertEqual([image.variants[name]['width'] for name in ('thumb', 'card', 'full')], [160, 480, 1280])
+        self.assertEqual(image.variants['card']['height'], 360)
+
+        data = ProductImageSerializer(image).data
+        self.assertIn("_thumb.webp 160w", data['srcset']['webp'])
+        self.assertTrue(data['srcset']['jpeg'].endswith("_full.jpeg 1280w"))
+        cover = ProductSerializer(context={'fieldset': ProductFieldset(['cover_image'])}).get_cover_image(self.product)
+        self.assertTrue(cover.endswith("_card.jpeg"))
+
+    def test_small_images_are_not_upscaled(self):
+        image = self.upload("icon.png", (100, 80), mode="RGBA", fmt="PNG")
+        self.assertEqual(image.variants['full']['width'], 100)
+        self.assertEqual(ProductImageSerializer(image).data['srcset']['webp'].count(","), 0)
+
+    def test_replacing_the_image_rebuilds_variants(self):
+        image = self.upload("lamp.jpg", (800, 600))
+        old = image.variants['thumb']['jpeg']
+        with self.captureOnCommitCallbacks(execute=True):
+            image.image = image_upload("other.jpg", (600, 800))
+            image.save()
+        image.refresh_from_db()
+        self.assertNotEqual(image.variants['thumb']['jpeg'], old)
+        self.assertEqual(image.variants['thumb']['height'], 160)
+
+
+class ProductImageUploadTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        overrides = self.settings(MEDIA_ROOT=self.media, IMAGE_VARIANTS_ASYNC=False, PRODUCT_IMAGE_MAX_COUNT=3)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.seller = make_user("seller")
+        profile = self.seller.userprofile
+        profile.address, profile.course, profile.gender = "Hostel", "B.Tech", "Other"
+        profile.save()
+        self.category = Category.objects.create(name="Books", slug="books")
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def create(self, images):
+        data = {'title': "Lamp", 'description': "Desk lamp", 'price': "10.00", 'category_id': self.category.pk, 'images': images}
+        return self.client.post(reverse('product-create'), data, format='multipart')
+
+    def test_images_are_inserted_in_one_query(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.create([image_upload("a.jpg", (640, 480)), image_upload("b.png", (300, 300), fmt="PNG")])
+        self.assertEqual(response.status_code, 201, response.content)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "api_productimage"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(len([cb for cb in callbacks if cb.__qualname__.startswith('schedule_variants')]), 2)
+        images = ProductImage.objects.filter(product_id=response.json()['id'])
+        self.assertEqual(sorted(image.variants['thumb']['width'] for image in images), [160, 160])
+
+    def test_rejects_files_that_are_not_images(self):
+        fake = SimpleUploadedFile("a.jpg", b"GIF89a not really a jpeg", content_type="image/jpeg")
+        response = self.create([fake])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('images', response.json())
+        self.assertFalse(Product.objects.exists())
+
+    def test_rejects_oversized_dimensions_from_the_header(self):
+        with self.settings(PRODUCT_IMAGE_MAX_PIXELS=1000):
+            response = self.create([image_upload("a.jpg", (100, 100))])
+        self.assertEqual(response.status_code, 400)
+
+    def test_enforces_count_and_byte_budgets(self):
+        response = self.create([image_upload(f"{i}.jpg", (10, 10)) for i in range(4)])
+        self.assertEqual(response.status_code, 413)
+        with self.settings(PRODUCT_IMAGE_MAX_BYTES=1500):
+            response = self.create([image_upload("small.png", (400, 400), mode="L", fmt="PNG"), image_upload("large.jpg", (600, 600))])
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Product.objects.exists())
+
+
+class JobQueueTests(TestCase):
+    def run_jobs(self):
+        call_command('run_jobs', '--once', stdout=io.StringIO())
+
+    def test_registration_only_enqueues_the_email(self):
+        data = {'email': "new@kiet.edu", 'username': "new", 'password': "pass1234", 'password2': "pass1234"}
+        response = APIClient().post(reverse('register'), data, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(len(mail.outbox), 0)
+        job = Job.objects.get(kind='send_otp', status='queued')
+        # Only a nonce is stored; the code is derived from it when the email goes out
+        self.assertTrue(job.payload.pop('nonce'))
+        self.assertEqual(job.payload, {'purpose': 'verify', 'email': "new@kiet.edu", 'from_email': 'your_email@gmail.com'})
+
+        self.run_jobs()
+        self.assertEqual([message.to for message in mail.outbox], [["new@kiet.edu"]])
+        self.assertIn("Your OTP is", mail.outbox[0].body)
+        self.assertFalse(Job.objects.exists())
+
+    def test_emails_are_sent_in_batches(self):
+        for i in range(3):
+            jobs.queue_email("Hello", "Body", [f"user{i}@kiet.edu"])
+        self.assertEqual(jobs.run_pending(limit=10), 3)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_failures_back_off_then_go_dead(self):
+        calls = []
+
+        def flaky(payload):
+            calls.append(payload)
+            raise RuntimeError("smtp down")
+
+        jobs.HANDLERS['flaky'] = (flaky, False)
+        self.addCleanup(jobs.HANDLERS.pop, 'flaky')
+        job = jobs.enqueue('flaky', {'n': 1}, max_attempts=2)
+
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn("smtp down", job.last_error)
+
+        jobs.run_pending()
+        self.assertEqual(len(calls), 1)  # not due yet
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, len(calls)), ('dead', 2, 2))
+
+    def test_abandoned_running_jobs_are_retried(self):
+        job = jobs.queue_email("Hello", "Body", ["user@kiet.edu"])
+        Job.objects.filter(pk=job.pk).update(status='running', locked_at=timezone.now() - timedelta(hours=1))
+        self.run_jobs()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_abandoned_jobs_use_up_attempts(self):
+        job = jobs.queue_email("Hello", "Body", ["user@kiet.edu"])
+        Job.objects.filter(pk=job.pk).update(status='running', attempts=5, locked_at=timezone.now() - timedelta(hours=1))
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'dead')
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class OTPTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+
+    def register(self, email="new@kiet.edu"):
+        data = {'email': email, 'username': email.split("@")[0], 'password': "pass1234", 'password2': "pass1234"}
+        return self.client.post(reverse('register'), data, format='json')
+
+    def sent_code(self):
+        call_command('run_jobs', '--once', stdout=io.StringIO())
+        return re.search(r"OTP is (\d{6})", mail.outbox[-1].body).group(1)
+
+    def test_verify_uses_the_cache_only(self):
+        self.assertEqual(self.register().status_code, 201)
+        code = self.sent_code()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('verify_otp'), {'email': "new@kiet.edu", 'otp': "000000" if code != "000000" else "111111"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('verify_otp'), {'email': "new@kiet.edu", 'otp': code})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if 'api_otp' in q['sql']])
+        self.assertTrue(User.objects.get(email="new@kiet.edu").is_email_verified)
+        # Codes are single use
+        self.assertEqual(self.client.post(reverse('verify_otp'), {'email': "new@kiet.edu", 'otp': code}).status_code, 400)
+
+    def test_wrong_guesses_burn_the_code(self):
+        self.register()
+        code = self.sent_code()
+        wrong = "000000" if code != "000000" else "111111"
+        with self.settings(OTP_MAX_ATTEMPTS=3):
+            for _ in range(3):
+                self.assertEqual(self.client.post(reverse('verify_otp'), {'email': "new@kiet.edu", 'otp': wrong}).status_code, 400)
+            response = self.client.post(reverse('verify_otp'), {'email': "new@kiet.edu", 'otp': code})
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(User.objects.get(email="new@kiet.edu").is_email_verified)
+
+    def test_retried_sends_keep_the_code(self):
+        self.register()
+        code_key = verification_otp._keys("new@kiet.edu")[0]
+        with mock.patch('api.jobs.EmailMessage.send', side_effect=OSError("smtp down")):
+            call_command('run_jobs', '--once', stdout=io.StringIO())
+        issued = cache.get(code_key)
+        Job.objects.update(run_at=timezone.now())
+        with self.settings(OTP_MAX_SENDS=1):
+            code = self.sent_code()  # the retry neither issues a new code nor counts as a send
+            self.assertEqual(cache.get(code_key), issued)
+            self.assertEqual(self.register().status_code, 429)
+        self.assertEqual(self.client.post(reverse('verify_otp'), {'email': "new@kiet.edu", 'otp': code}).status_code, 200)
+
+    def test_a_late_retry_does_not_replace_a_newer_code(self):
+        older, newer = verification_otp.nonce(), verification_otp.nonce()
+        code = verification_otp.issue("new@kiet.edu", newer)
+        self.assertIsNone(verification_otp.issue("new@kiet.edu", older))
+        self.assertEqual(verification_otp.issue("new@kiet.edu", newer), code)
+
+    def test_resends_are_limited(self):
+        self.register()
+        with self.settings(OTP_MAX_SENDS=2):
+            self.assertEqual(self.register().status_code, 200)
+            self.assertEqual(self.register().status_code, 429)
+
+    def test_limited_registration_leaves_no_user(self):
+        self.register()
+        User.objects.filter(email="new@kiet.edu").delete()
+        with self.settings(OTP_MAX_SENDS=1):
+            self.assertEqual(self.register().status_code, 429)
+        self.assertFalse(User.objects.filter(email="new@kiet.edu").exists())
+
+    def test_password_reset(self):
+        make_user("reader")
+        response = self.client.post(reverse('send-reset-password-email'), {'email': "reader@kiet.edu"})
+        self.assertEqual(response.status_code, 200)
+        code = self.sent_code()
+        data = {'email': "reader@kiet.edu", 'otp': code, 'password': "newpass99", 'password2': "newpass99"}
+        self.assertEqual(self.client.post(reverse('reset-password'), {**data, 'password2': "typo"}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('reset-password'), data).status_code, 200)
+        self.assertTrue(User.objects.get(email="reader@kiet.edu").check_password("newpass99"))
+        # A reset code cannot verify an email address and vice versa
+        self.assertNotEqual(verification_otp._keys("a@kiet.edu"), reset_otp._keys("a@kiet.edu"))
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = make_user("reader")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+
+    def user_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('my-products'))
+        self.assertEqual(response.status_code, 200)
+        return [q for q in ctx.captured_queries if 'FROM "api_user"' in q['sql']]
+
+    def test_user_row_is_cached_between_requests(self):
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(self.user_queries(), [])
+
+    def test_cache_holds_no_password_or_profile(self):
+        self.user_queries()
+        entry = cache.get(user_cache_key(self.user.pk))
+        self.assertNotIn(self.user.password, repr(entry))
+        self.assertNotIn('userprofile', repr(entry))
+
+        # Rating totals are written with update(); the profile is read fresh, not from the cache
+        UserProfile.objects.filter(user=self.user).update(rating_count=3)
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        user, _ = CachedJWTAuthentication().authenticate(request)
+        self.assertEqual(user.userprofile.rating_count, 3)
+
+    def test_cached_user_can_change_password(self):
+        self.user_queries()
+        data = {'current_pass': "pass1234", 'password': "newpass99", 'password2': "newpass99"}
+        self.assertEqual(self.client.post(reverse('changepass'), data).status_code, 200)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(user.check_password("newpass99"))
+        self.assertEqual(user.email, self.user.email)
+
+    def test_saving_the_user_drops_the_cache(self):
+        self.user_queries()
+        self.user.username = "renamed"
+        self.user.save()
+        self.assertEqual(len(self.user_queries()), 1)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('my-products')).status_code, 401)
+
+
+class UserRendererTests(SimpleTestCase):
+    def render(self, data, status_code):
+        return json.loads(UserRenderer().render(data, 'application/json', {'response': Response(status=status_code)}))
+
+    def test_errors_are_wrapped(self):
+        data = {'email': [ErrorDetail('This field is required.', code='required')]}
+        self.assertEqual(self.render(data, 400), {'errors': {'email': ['This field is required.']}})
+
+    def test_success_is_passed_through(self):
+        data = {'msg': 'Login success', 'token': {'access': 'a', 'refresh': 'r'}}
+        self.assertEqual(self.render(data, 200), data)
+
+    def test_matches_drf_json_output(self):
+        data = {'price': Decimal('10.50'), 'at': timezone.now(), 'text': 'line\u2028sep', 'nested': [1, None]}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_non_finite_floats_behave_as_in_drf(self):
+        data = {'score': float('nan'), 'nested': [{'ratio': float('inf')}]}
+        with self.assertRaises(ValueError):
+            FastJSONRenderer().render(data)
+        lenient = type('LenientRenderer', (FastJSONRenderer,), {'strict': False})()
+        self.assertEqual(lenient.render(data), b'{"score":NaN,"nested":[{"ratio":Infinity}]}')
@@ -0,0 +1,159 @@
+import contextlib
+import functools
+import threading
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from PIL import Image, UnidentifiedImageError
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+from .images import schedule_variants
+from .models import ProductImage
+
+IMAGE_FIELD = 'images'
+
+_batch = threading.local()
+
+# Leading bytes of the formats we accept, checked before Pillow sees the file
+IMAGE_SIGNATURES = {
+    'JPEG': (b'\xff\xd8\xff',),
+    'PNG': (b'\x89PNG\r\n\x1a\n',),
+    'WEBP': (b'RIFF',),  # plus 'WEBP' at offset 8
+}
+
+
+def upload_limits():
+    return {
+        'max_files': getattr(settings, 'PRODUCT_IMAGE_MAX_COUNT', 8),
+        'max_file_bytes': getattr(settings, 'PRODUCT_IMAGE_MAX_BYTES', 10 * 1024 * 1024),
+        'max_request_bytes': getattr(settings, 'PRODUCT_UPLOAD_MAX_BYTES', 40 * 1024 * 1024),
+        'max_pixels': getattr(settings, 'PRODUCT_IMAGE_MAX_PIXELS', 40_000_000),
+    }
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Upload too large.'
+    default_code = 'upload_too_large'
+
+
+class ImageUploadBudgetHandler(FileUploadHandler):
+    """
+    First upload handler for product image requests: counts bytes as they
+    stream in and stops the request once a file or the whole body goes over
+    budget. The chunks themselves go on to Django's own handlers, which spool
+    anything past FILE_UPLOAD_MAX_MEMORY_SIZE to a temporary file.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.limits = upload_limits()
+        self.total_bytes = 0
+        self.file_bytes = 0
+        self.files = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Refuse oversized bodies from the header alone, before reading any of it
+        if content_length and content_length > self.limits['max_request_bytes']:
+            raise UploadTooLarge(f"Uploads are limited to {self.limits['max_request_bytes']} bytes per request.")
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.file_bytes = 0
+        self.files += 1
+        if self.files > self.limits['max_files']:
+            raise UploadTooLarge(f"At most {self.limits['max_files']} images can be uploaded at once.")
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file_bytes += len(raw_data)
+        self.total_bytes += len(raw_data)
+        if self.file_bytes > self.limits['max_file_bytes']:
+            raise UploadTooLarge(f"Each image is limited to {self.limits['max_file_bytes']} bytes.")
+        if self.total_bytes > self.limits['max_request_bytes']:
+            raise UploadTooLarge(f"Uploads are limited to {self.limits['max_request_bytes']} bytes per request.")
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None  # the next handler builds the file object
+
+
+def bounded_image_uploads(view):
+    """Put ImageUploadBudgetHandler in front of the default upload handlers for this view."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers.insert(0, ImageUploadBudgetHandler(request))
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def inspect_image(upload):
+    """Check an uploaded file's type and dimensions from its header without decoding the pixels."""
+    limits = upload_limits()
+    upload.seek(0)
+    head = upload.read(16)
+    upload.seek(0)
+    kind = next((name for name, signatures in IMAGE_SIGNATURES.items() if head.startswith(signatures)), None)
+    if kind is None or (kind == 'WEBP' and head[8:12] != b'WEBP'):
+        raise serializers.ValidationError({IMAGE_FIELD: f"{upload.name}: only JPEG, PNG and WebP images are accepted."})
+
+    try:
+        # Image.open only parses the header; nothing is decoded until load()
+        with Image.open(upload) as image:
+            detected, (width, height) = image.format, image.size
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise serializers.ValidationError({IMAGE_FIELD: f"{upload.name}: not a readable image."})
+    finally:
+        upload.seek(0)
+
+    if detected != kind:
+        raise serializers.ValidationError({IMAGE_FIELD: f"{upload.name}: file contents do not match an accepted image type."})
+    if width * height > limits['max_pixels']:
+        raise serializers.ValidationError({IMAGE_FIELD: f"{upload.name}: image dimensions are too large."})
+    return upload
+
+
+def clean_product_images(request):
+    return [inspect_image(upload) for upload in request.FILES.getlist(IMAGE_FIELD)]
+
+
+@contextlib.contextmanager
+def image_batch():
+    """
+    ProductImage saves and deletes inside this block do not refresh their
+    product one by one (see api.signals.refresh_product_for_image); the caller
+    saves the product once at the end.
+    """
+    outer = getattr(_batch, 'active', False)
+    _batch.active = True
+    try:
+        yield
+    finally:
+        _batch.active = outer
+
+
+def in_image_batch():
+    return getattr(_batch, 'active', False)
+
+
+def add_product_images(product, uploads, replace=False):
+    """
+    Store validated uploads and insert their rows in one bulk INSERT; with
+    ``replace``, the product's current images are deleted first.
+
+    bulk_create skips the ProductImage signals, so the variant jobs are queued
+    here and the product is saved once to refresh its feeds and ETags.
+    """
+    if not uploads:
+        return []
+    if replace:
+        with image_batch():
+            product.images.all().delete()
+    images = ProductImage.objects.bulk_create([ProductImage(product=product, image=upload) for upload in uploads])
+    if any(image.pk is None for image in images):
+        # Backends without RETURNING (MySQL) leave pks unset; read them back by file name
+        images = list(ProductImage.objects.filter(product=product, image__in=[image.image.name for image in images]))
+    for image in images:
+        schedule_variants(image)
+    product.save(update_fields=['updated_at'])
+    return images
@@ -24,6 +24,7 @@ from api.views import (
     CategoryViewSet,
     FilteredProductListView,BuyingHistoryView, 
     SellingHistoryView,
+    SellerDashboardView,
     RequestsMadeView,
     RequestsReceivedView,
     ProductListExcludeUserAPIView,UserProductList,AddCategory
@@ -63,6 +64,7 @@ urlpatterns = [
     
     path('history/buying/', BuyingHistoryView.as_view(), name='buying-history'), 
     path('history/selling/', SellingHistoryView.as_view(), name='selling-history'),
+    path('dashboard/', SellerDashboardView.as_view(), name='seller-dashboard'),
     
     #------------temporary(This will be done by admin)----------
 
@@ -1,13 +1,13 @@
-from django.core.mail import EmailMessage
+from api.jobs import queue_email
 import os
 
 class Util:
   @staticmethod
   def send_email(data):
-    email = EmailMessage(
+    # Queued for the run_jobs worker rather than sent inside the request
+    queue_email(
       subject=data['subject'],
       body=data['body'],
+      to=[data['to_email']],
       from_email=os.environ.get('EMAIL_FROM'),
-      to=[data['to_email']]
-    )
-    email.send()
\ No newline at end of file
+    )
\ No newline at end of file
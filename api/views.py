@@ -1,7 +1,4 @@
-import random
 import json
-from django.utils import timezone
-from datetime import timedelta
 from django.http import JsonResponse
 #from django.shortcuts import render
 from rest_framework.response import Response
@@ -11,12 +8,20 @@ from api.serializer import (
     ProductRequestUpdateSerializer,RatingSerializer,
     UserChangePasswordSerializer,
     #UserPasswordResetSerializer,SendPasswordResetEmailSerializer,
-    CategorySerializer,ProductRequestHistorySerializer
+    CategorySerializer,ProductRequestHistorySerializer,SellerDashboardSerializer
 )
-from .models import User,UserProfile, Product,ProductImage,ProductRequest,OTP,Rating,Category
+from .models import User,UserProfile, Product,ProductImage,ProductRequest,Rating,Category,SellerStats
 from rest_framework import status,generics,permissions
 from django.contrib.auth import authenticate
 from api.renderers import UserRenderer
+from api.pagination import ProductCursorPagination, SearchCursorPagination
+from api.search import product_index
+from api.fieldsets import ProductFieldset
+from api.caching import product_feed_cache, feed_scope
+from api.conditional import conditional_get
+from api.stats import recount_seller_stats
+from api.uploads import bounded_image_uploads, clean_product_images, add_product_images
+from django.utils.decorators import method_decorator
 from rest_framework_simplejwt.tokens import RefreshToken
 #from rest_framework_simplejwt.authentication import JWTAuthentication
 
@@ -27,13 +32,97 @@ from django.shortcuts import get_object_or_404
 #from django.views.decorators.csrf import csrf_exempt
 #from django.conf import settings
 from rest_framework.exceptions import PermissionDenied
-from django.db.models import Q
-from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Q, Max, Count, Sum
+from api.jobs import queue_otp
+from api.otp import OTPError, verification_otp, reset_otp
 from rest_framework.decorators import api_view, permission_classes
 from django.apps import apps
+from chats.utils import rooms_changed
 from rest_framework import viewsets
 
 
+class ProductFieldsetMixin:
+    """Applies the request's ?fields= / ?expand= projection to a generic product list view."""
+
+    def get_fieldset(self):
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = ProductFieldset.from_request(self.request)
+        return self._fieldset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fieldset'] = self.get_fieldset()
+        return context
+
+
+def cached_feed_response(request, scope, queryset, fieldset):
+    """
+    Serve one cursor page of a shared product feed.
+
+    Pages are rendered without viewer-specific fields and cached under the
+    feed's scope; the viewer's own listings are dropped and their request
+    state merged in per request. When that leaves a page short, it is topped
+    up from the shared pages after it, and the next cursor points past the
+    last row sent, so sellers get full pages too. ``queryset`` must not
+    depend on the viewer.
+    """
+    paginator = ProductCursorPagination()
+    paginator.request = request
+    page_size = paginator.get_page_size(request)
+    generation = product_feed_cache.generations([scope])
+
+    def shared_page(position):
+        # Rows hold absolute image URLs, so clients reaching the site by another host or scheme get their own
+        key = (scope, generation, request.scheme, request.get_host(), fieldset.cache_key(), position, page_size)
+        entry = product_feed_cache.get(key)
+        if entry is None:
+            page = paginator.paginate_queryset(queryset, request, position=position)
+            context = {'request': request, 'fieldset': fieldset, 'viewer_independent': True}
+            rows = [dict(row) for row in ProductSerializer(page, many=True, context=context).data]
+            entry = (rows, [(product.upload_date, product.pk) for product in page], paginator.next_position)
+            product_feed_cache.set(key, entry)
+        return entry
+
+    rows, position = [], paginator.decode_cursor(request)
+    while True:
+        page_rows, positions, next_position = shared_page(position)
+        kept = [(row, row_position) for row, row_position in zip(page_rows, positions) if row['seller_id'] != request.user.id]
+        if len(rows) + len(kept) > page_size:
+            # Full partway through this shared page: continue after the last row sent
+            kept = kept[:page_size - len(rows)]
+            rows.extend(row for row, _ in kept)
+            paginator.next_position = kept[-1][1]
+            break
+        rows.extend(row for row, _ in kept)
+        if len(rows) == page_size or next_position is None:
+            paginator.next_position = next_position
+            break
+        position = next_position
+
+    serializer = ProductSerializer(many=True, context={'request': request, 'fieldset': fieldset})
+    return paginator.get_paginated_response(serializer.merge_viewer_state(rows))
+
+
+def product_page_validator(request, queryset, fieldset, scope=None):
+    """
+    ETag inputs for one cursor page of products, from a single aggregate over
+    the page window. Request and image changes touch Product.updated_at (see
+    api.signals), so this also covers the viewer's request fields. Pages of a
+    cached feed can be topped up from past the window (cached_feed_response),
+    so they also carry the feed's generation.
+    """
+    paginator = ProductCursorPagination()
+    window = paginator.get_window(queryset.order_by(), request)
+    state = window.aggregate(latest=Max('updated_at'), count=Count('id'), ids=Sum('id'))
+    return (
+        'products', request.user.id, fieldset.cache_key(),
+        request.query_params.get(paginator.cursor_query_param), paginator.page_size,
+        state['latest'], state['count'], state['ids'],
+        product_feed_cache.generations([scope]) if scope else None,
+    )
+
+
 def get_tokens_for_user(user):
     refresh = RefreshToken.for_user(user)
 
@@ -49,36 +138,27 @@ class UserRegistrationView(APIView):
         try:
             user = User.objects.get(email=email)
             if not user.is_email_verified:
-                OTP.objects.filter(user=user).delete()
-                otp_code = str(random.randint(100000, 999999))
-                OTP.objects.create(user=user, otp_code=otp_code, created_at=timezone.now())
-                send_mail(
-                    'Email Verification OTP',
-                    f'Your OTP is {otp_code}. It is valid for 5 minutes.',
-                    'your_email@gmail.com',
-                    [email],
-                    fail_silently=False,
-                )
+                try:
+                    queue_otp(verification_otp, user.email, 'your_email@gmail.com')
+                except OTPError as e:
+                    return Response({"detail": e.message}, status=e.status_code)
                 return Response({"detail": "Email already registered but not verified. A new OTP has been sent."}, status=status.HTTP_200_OK)
             return Response({"detail": "Email already registered and verified."}, status=status.HTTP_400_BAD_REQUEST)
         except User.DoesNotExist:
             serializer = UserSerializer(data=request.data)
             if serializer.is_valid(raise_exception=True):
-                user = serializer.save(is_email_verified=False)
-
-                user.username = request.data.get('username') # Get username here
-                user.set_password(request.data.get('password')) # Set password here
-                user.save() 
-
-                otp_code = str(random.randint(100000, 999999))
-                OTP.objects.create(user=user, otp_code=otp_code, created_at=timezone.now())
-                send_mail(
-                    'Email Verification OTP',
-                    f'Your OTP is {otp_code}. It is valid for 5 minutes.',
-                    'your_email@gmail.com',
-                    [user.email],
-                    fail_silently=False,
-                )
+                # No user row is left behind when the resend limit turns the OTP down
+                try:
+                    with transaction.atomic():
+                        user = serializer.save(is_email_verified=False)
+
+                        user.username = request.data.get('username') # Get username here
+                        user.set_password(request.data.get('password')) # Set password here
+                        user.save() 
+
+                        queue_otp(verification_otp, user.email, 'your_email@gmail.com')
+                except OTPError as e:
+                    return Response({"detail": e.message}, status=e.status_code)
                 return Response({'msg': 'OTP sent to your email. Verify to complete registration.'}, status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -90,25 +170,23 @@ class VerifyOTPView(APIView):
         if not email or not otp_code:
             return Response({'error': 'Email and OTP are required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        user = get_object_or_404(User, email=email)
-
+        # The code is checked in the cache first, so wrong guesses never reach the database
         try:
-            otp_obj = OTP.objects.get(user=user, otp_code=otp_code)
-            if (timezone.now() - otp_obj.created_at) < timedelta(minutes=5):
-                user.is_email_verified = True
-                user.save()
-                otp_obj.delete()
-                token = get_tokens_for_user(user)
-                return Response({
-                    'user_id': user.id,
-                    'token': token,
-                    'user': UserSerializer(user).data,
-                    'msg': 'Email verification successful. You can now log in.'
-                }, status=status.HTTP_200_OK)
-            else:
-                return Response({'error': 'Invalid or expired OTP'}, status=status.HTTP_400_BAD_REQUEST)
-        except OTP.DoesNotExist:
-            return Response({'error': 'Invalid OTP'}, status=status.HTTP_400_BAD_REQUEST)
+            verification_otp.verify(email, otp_code)
+        except OTPError as e:
+            return Response({'error': e.message}, status=e.status_code)
+
+        user = get_object_or_404(User, email=email)
+        if not user.is_email_verified:
+            user.is_email_verified = True
+            user.save(update_fields=['is_email_verified'])
+        token = get_tokens_for_user(user)
+        return Response({
+            'user_id': user.id,
+            'token': token,
+            'user': UserSerializer(user).data,
+            'msg': 'Email verification successful. You can now log in.'
+        }, status=status.HTTP_200_OK)
 
 
 class UserLoginView(APIView):
@@ -137,9 +215,18 @@ class UserProfileDetailAPIView(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     
     def get(self, request,pk):
-        user_profile = get_object_or_404(UserProfile, user__id=pk)
-        serializer = UserProfileSerializer(user_profile)
-        return Response(serializer.data)
+        state = UserProfile.objects.filter(user__id=pk).values_list(
+            'id', 'updated_at', 'user__username', 'rating_count', 'rating_sum'
+        ).first()
+        if state is None:
+            return Response({"detail": "No UserProfile matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+
+        def respond():
+            user_profile = get_object_or_404(UserProfile.objects.select_related('user'), user__id=pk)
+            serializer = UserProfileSerializer(user_profile)
+            return Response(serializer.data)
+
+        return conditional_get(request, ('profile',) + state, respond)
 
     def patch(self, request,pk):
         user_profile = get_object_or_404(UserProfile, user__id=pk)
@@ -152,37 +239,49 @@ class UserProfileDetailAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
        
+@method_decorator(bounded_image_uploads, name='dispatch')
 class ProductCreateView(generics.CreateAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def perform_create(self, serializer):
+        # Check every image before anything is saved
+        images = clean_product_images(self.request)
         product = serializer.save(seller=self.request.user)
-        images = self.request.FILES.getlist('images')
-        if images:
-            for image in images:
-                ProductImage.objects.create(product=product, image=image)
+        add_product_images(product, images)
 
 
 class ProductDetailView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, pk, format=None):
-        try:
-            product = Product.objects.get(pk=pk)
-        except Product.DoesNotExist:
+        fieldset = ProductFieldset.from_request(request)
+        # Request and image changes touch updated_at, so this row is the whole validator
+        state = Product.objects.filter(pk=pk).values_list(
+            'updated_at', 'category__name', 'category__slug', 'category__image'
+        ).first()
+        if state is None:
             return Response({"detail": "Product not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Pass context so the serializer can access request (for has_requested logic)
-        serializer = ProductSerializer(product, context={"request": request})
+        def respond():
+            try:
+                product = fieldset.apply(Product.objects).get(pk=pk)
+            except Product.DoesNotExist:
+                return Response({"detail": "Product not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        return Response({
-            "product": serializer.data,
-        })
+            # Pass context so the serializer can access request (for has_requested logic)
+            serializer = ProductSerializer(product, context={"request": request, "fieldset": fieldset})
+
+            return Response({
+                "product": serializer.data,
+            })
+
+        return conditional_get(request, ('product', pk, request.user.id, fieldset.cache_key()) + state, respond)
 
     
     
+@bounded_image_uploads
 @api_view(['PATCH'])
 @permission_classes([permissions.IsAuthenticated])
 def update_product(request):
@@ -197,11 +296,14 @@ def update_product(request):
     serializer = ProductSerializer(product, data=request.data, partial=True, context={'request': request})
     
     if serializer.is_valid():
+        images = clean_product_images(request)
         new_status = serializer.validated_data.get('status', product.status)
         
         if old_status != 'sold' and new_status == 'sold':
         
             ProductRequest.objects.filter(product=product, status__in=['pending','accepted']).update(status='rejected')
+            # The bulk update skips signals, so bring the dashboard counters back in line
+            recount_seller_stats([product.seller_id])
             
 
             product_requests = ProductRequest.objects.filter(
@@ -217,17 +319,17 @@ def update_product(request):
                     is_active=True
                 )
 
-                if active_chats.exists():
-                    active_chats.update(is_active=False)
+                # The bulk update skips signals, so drop the rooms' cached access and tell their sockets by hand
+                closing = list(active_chats.values_list('id', 'buyer_id', 'seller_id'))
+                if closing:
+                    ChatRoom.objects.filter(id__in=[room_id for room_id, _, _ in closing]).update(is_active=False)
+                    rooms_changed(closing)
                     
         product = serializer.save()
         
-        # Handle product images
-        images = request.FILES.getlist('images')
+        # Uploaded images replace the current ones
         if images:
-            product.images.all().delete()
-            for image in images:
-                ProductImage.objects.create(product=product, image=image)
+            add_product_images(product, images, replace=True)
         
         return Response(serializer.data, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -366,32 +468,44 @@ class CancelProductRequestView(generics.UpdateAPIView):
 class ProductSearchAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     """
-    Search products by title, description.
+    Search products by title, description and category, ranked by relevance.
     """
     def get(self, request):
         query = request.query_params.get('q', None)  # Get the search query from URL parameters
-        if query:
-            # Search for products where name, description, or category contains the query
-            products = Product.objects.filter(
+        fieldset = ProductFieldset.from_request(request)
+        if query and product_index.built:
+            # Ranked ids come from the in-process index; the page itself is one id__in query
+            product_index.sync()
+            paginator = SearchCursorPagination()
+            ids = paginator.paginate_ranked(product_index.search, query, request)
+            by_id = fieldset.apply(Product.objects).in_bulk(ids)
+            page = [by_id[pk] for pk in ids if pk in by_id]
+            empty_message = "No products found matching your search."
+        elif query:
+            # The index is built in the background from the first search on (see ProductSearchIndex.warm);
+            # until then, a plain substring match, newest first
+            product_index.warm()
+            products = fieldset.apply(Product.objects.filter(
                 Q(title__icontains=query) |
                 Q(description__icontains=query) |
                 Q(category__name__icontains=query)
-            )
-            #print("This is done------")
-             
-            if not products.exists():  # Check if the queryset is empty
-                return Response({"message": "No products found matching your search."}, status=status.HTTP_200_OK)
-            
-            serializer = ProductSerializer(products,many=True,context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            ))
+            paginator = ProductCursorPagination()
+            page = paginator.paginate_queryset(products, request, view=self)
+            empty_message = "No products found matching your search."
         else:
             # If no query is provided, return all products
-            products = Product.objects.all()
+            products = fieldset.apply(Product.objects.all())
             #print("else was running")
-            if not products.exists():  # Check if the queryset is empty
-                return Response({"message": "No products available."}, status=status.HTTP_200_OK)
-            serializer = ProductSerializer(products, many=True,context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            paginator = ProductCursorPagination()
+            page = paginator.paginate_queryset(products, request, view=self)
+            empty_message = "No products available."
+
+        if not page and not request.query_params.get(paginator.cursor_query_param):  # Nothing matched at all
+            return Response({"message": empty_message}, status=status.HTTP_200_OK)
+
+        serializer = ProductSerializer(page, many=True, context={'request': request, 'fieldset': fieldset})
+        return paginator.get_paginated_response(serializer.data)
         
 class CreateRatingView(generics.CreateAPIView):
     serializer_class = RatingSerializer
@@ -459,13 +573,13 @@ class FilteredProductListView(APIView):
         if not category_slug:
             return Response({"detail": "Category slug is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        products = Product.objects.filter(category__slug=category_slug)
-
-        if request.user.is_authenticated:
-            products = products.exclude(seller=request.user).exclude(status='sold')   
-
-        serializer = ProductSerializer(products,many=True,context={'request':request})
-        return Response(serializer.data)
+        fieldset = ProductFieldset.from_request(request)
+        # The viewer's own listings are dropped by cached_feed_response so the page can be shared
+        products = fieldset.apply(Product.objects.filter(category__slug=category_slug).exclude(status='sold'))
+        return conditional_get(
+            request, product_page_validator(request, products, fieldset, feed_scope(category_slug)),
+            lambda: cached_feed_response(request, feed_scope(category_slug), products, fieldset),
+        )
 
 #------------------------------------------
 class BuyingHistoryView(generics.ListAPIView):
@@ -476,7 +590,7 @@ class BuyingHistoryView(generics.ListAPIView):
         return ProductRequest.objects.filter(
             buyer=self.request.user,
             status='approved'
-        ).select_related('product','buyer','seller').prefetch_related('product__images')
+        ).select_related('product__category','buyer','seller').prefetch_related('product__images')
 
 class SellingHistoryView(generics.ListAPIView):
     serializer_class=ProductRequestHistorySerializer
@@ -486,7 +600,19 @@ class SellingHistoryView(generics.ListAPIView):
         return ProductRequest.objects.filter(
             seller=self.request.user,
             product__status='sold'
-        ).select_related('product','buyer','seller').prefetch_related('product__images')
+        ).select_related('product__category','buyer','seller').prefetch_related('product__images')
+
+class SellerDashboardView(APIView):
+    """Listing, request, sales and rating totals for the current seller, read from SellerStats."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        stats = SellerStats.objects.select_related('seller__userprofile').filter(seller=request.user).first()
+        if stats is None:
+            # First visit before any counted change: build the row once
+            recount_seller_stats([request.user.id])
+            stats = SellerStats.objects.select_related('seller__userprofile').get(seller=request.user)
+        return Response(SellerDashboardSerializer(stats).data)
 #-------------------------------------
 
 class RequestsMadeView(generics.ListAPIView):
@@ -505,24 +631,39 @@ class RequestsReceivedView(generics.ListAPIView):
 
 #------------------------------------------
 
-class ProductListExcludeUserAPIView(generics.ListAPIView):
+class ProductListExcludeUserAPIView(ProductFieldsetMixin, generics.ListAPIView):
     serializer_class=ProductSerializer
     permission_classes=[permissions.IsAuthenticated]
+    pagination_class=ProductCursorPagination
 
     def get_queryset(self):
-        return Product.objects.exclude(seller=self.request.user).exclude(status="sold")
+        return self.get_fieldset().apply(Product.objects.exclude(seller=self.request.user).exclude(status="sold"))
+
+    def list(self, request, *args, **kwargs):
+        shared = self.get_fieldset().apply(Product.objects.exclude(status="sold"))
+        return conditional_get(
+            request, product_page_validator(request, shared, self.get_fieldset(), feed_scope()),
+            lambda: cached_feed_response(request, feed_scope(), shared, self.get_fieldset()),
+        )
         
     def get_serializer_context(self):
         context=super().get_serializer_context()
         context.update({"request":self.request})
         return context
 
-class UserProductList(generics.ListAPIView):
+class UserProductList(ProductFieldsetMixin, generics.ListAPIView):
     serializer_class=ProductSerializer
     permission_classes=[permissions.IsAuthenticated]
+    pagination_class=ProductCursorPagination
 
     def get_queryset(self):
-        return Product.objects.filter(seller=self.request.user)
+        return self.get_fieldset().apply(Product.objects.filter(seller=self.request.user))
+
+    def list(self, request, *args, **kwargs):
+        return conditional_get(
+            request, product_page_validator(request, self.get_queryset(), self.get_fieldset()),
+            lambda: super(UserProductList, self).list(request, *args, **kwargs),
+        )
 
 #-------------change password (validation still leeft)---------------------
 class UserChangePasswordView(APIView):
@@ -543,16 +684,10 @@ class SendPasswordResetEmailView(APIView):
         try:
             user=User.objects.get(email=email)
             if user.is_email_verified:
-                OTP.objects.filter(user=user).delete()
-                otp_code=str(random.randint(100000,999999))
-                OTP.objects.create(user=user,otp_code=otp_code,created_at=timezone.now())
-                send_mail(
-                    'Reset Password OTP',
-                    f'Your OTP is {otp_code}.It is valid for 5 minutes.',
-                    'your_email@gmail.com',
-                    [email],
-                    fail_silently=False,
-                )
+                try:
+                    queue_otp(reset_otp, user.email, 'your_email@gmail.com')
+                except OTPError as e:
+                    return Response({"detail": e.message}, status=e.status_code)
                 return Response({"detail":"OTP has been sent."},status=status.HTTP_200_OK)
             return Response({"detail":"Email is not registered or verified."},status=status.HTTP_400_BAD_REQUEST)
         except User.DoesNotExist:
@@ -569,31 +704,24 @@ class VerifyCreatePasswordView(APIView):
         if not all([email, otp_code, password, password1]):
             return Response({'error': 'All fields are required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        user = get_object_or_404(User, email=email)
+        # Checked before the OTP so a typo in the password does not use the code up
+        if password != password1:
+            return JsonResponse({'error': "Passwords does not match"}, status=400)
 
         try:
-            otp_obj = OTP.objects.get(user=user, otp_code=otp_code)
-            if (timezone.now() - otp_obj.created_at) < timedelta(minutes=5):
-                user.is_email_verified = True
-
-                # 1. Check if passwords match
-                if password != password1:
-                    return JsonResponse({'error': "Passwords does not match"}, status=400)
-                
+            reset_otp.verify(email, otp_code)
+        except OTPError as e:
+            return Response({'error': e.message}, status=e.status_code)
 
-                user.set_password(password)
-                user.save()
-
-                otp_obj.delete()
+        user = get_object_or_404(User, email=email)
+        user.is_email_verified = True
+        user.set_password(password)
+        user.save()
 
-                token = get_tokens_for_user(user)
-                return Response({
-                    'user_id': user.id,
-                    'token': token,
-                    'user': UserSerializer(user).data,
-                    'msg': 'Email verification successful. You can now log in.'
-                }, status=status.HTTP_200_OK)
-            else:
-                return Response({'error': 'Invalid or expired OTP'}, status=status.HTTP_400_BAD_REQUEST)
-        except OTP.DoesNotExist:
-            return Response({'error': 'Invalid OTP'}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        token = get_tokens_for_user(user)
+        return Response({
+            'user_id': user.id,
+            'token': token,
+            'user': UserSerializer(user).data,
+            'msg': 'Email verification successful. You can now log in.'
+        }, status=status.HTTP_200_OK)
\ No newline at end of file
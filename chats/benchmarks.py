@@ -0,0 +1,588 @@
+"""
+Benchmarks for the chats app.
+
+Not collected by the normal test run; invoke explicitly:
+
+    python manage.py test chats.benchmarks
+
+Set BENCH_OUTPUT=<path> to also write the results as JSON (each benchmark
+adds its own key, holding its "results" and a "meta" block with the commit
+it ran on, so files from different commits can be compared), and BENCH_CONNECTIONS to change how many
+sockets connect at once. FanoutBenchmark takes BENCH_ROOMS, BENCH_CLIENTS,
+BENCH_FANOUT_MESSAGES and BENCH_INTERVAL, and BENCH_REDIS_URL to run over a real
+Redis channel layer instead of the in-memory one. MultiplexBenchmark takes
+BENCH_SELLERS and BENCH_USER_ROOMS.
+"""
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from channels.auth import AuthMiddlewareStack
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.contrib.auth.models import AnonymousUser
+from django.db import close_old_connections
+from django.db.backends.utils import CursorWrapper
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from jwt import InvalidSignatureError, ExpiredSignatureError, DecodeError
+from jwt import decode as jwt_decode
+from rest_framework_simplejwt.tokens import AccessToken
+from django.urls import path
+from urllib.parse import parse_qs
+
+from api.models import User, Category, Product
+from .consumers import ChatConsumer
+from .middleware import JWTAuthMiddlewareStack, socket_token_cache
+from .models import ChatRoom, Message
+from .protocols import JSONCodec, CODECS, Stamp
+from .routing import websocket_urlpatterns
+from .writer import message_writer
+
+
+class LegacyJWTAuthMiddleware:
+    """The handshake as it was: close_old_connections on the loop, decode and a DB lookup every time, then session auth."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        close_old_connections()
+        try:
+            token = parse_qs(scope["query_string"].decode("utf8")).get('token', None)[0]
+            data = jwt_decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+            scope['user'] = await self.get_user(data['user_id'])
+        except (TypeError, KeyError, InvalidSignatureError, ExpiredSignatureError, DecodeError):
+            scope['user'] = AnonymousUser()
+        return await self.app(scope, receive, send)
+
+    @database_sync_to_async
+    def get_user(self, user_id):
+        try:
+            return User.objects.get(id=user_id)
+        except User.DoesNotExist:
+            return AnonymousUser()
+
+
+class HandshakeConsumer(AsyncWebsocketConsumer):
+    """Accepts authenticated sockets straight away, so the timing is the middleware's."""
+
+    async def connect(self):
+        if self.scope['user'].is_authenticated:
+            await self.accept()
+        else:
+            await self.close()
+
+
+@contextmanager
+def count_queries():
+    """
+    Count SQL statements run on any thread. CaptureQueriesContext only sees the
+    calling thread's connection, and consumers query from worker threads.
+    """
+    counter = SimpleNamespace(count=0)
+    lock = threading.Lock()
+    originals = {name: getattr(CursorWrapper, name) for name in ('execute', 'executemany')}
+
+    def counted(method):
+        def wrapper(self, *args, **kwargs):
+            with lock:
+                counter.count += 1
+            return method(self, *args, **kwargs)
+        return wrapper
+
+    for name, method in originals.items():
+        setattr(CursorWrapper, name, counted(method))
+    try:
+        yield counter
+    finally:
+        for name, method in originals.items():
+            setattr(CursorWrapper, name, method)
+
+
+async def drain(socket, quiet=0.05):
+    """Read frames until the socket has been quiet for ``quiet`` seconds; returns how many there were."""
+    frames = 0
+    while not await socket.receive_nothing(timeout=quiet):
+        await socket.receive_output()
+        frames += 1
+    return frames
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def write_results(key, results):
+    """Merge one benchmark's results into BENCH_OUTPUT, when set."""
+    path = os.environ.get('BENCH_OUTPUT')
+    if not path:
+        return
+    try:
+        with open(path) as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        data = {}
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=settings.BASE_DIR, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    # Meta per key: a file may gather benchmarks run on different commits
+    data[key] = {
+        'meta': {
+            'commit': commit,
+            'run_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'channel_layer': type(get_channel_layer()).__name__,
+        },
+        'results': results,
+    }
+    with open(path, 'w') as fh:
+        json.dump(data, fh, indent=2)
+
+
+class HandshakeBenchmark(TransactionTestCase):
+    connections = int(os.environ.get('BENCH_CONNECTIONS', 2000))
+    users = 200
+
+    def setUp(self):
+        users = User.objects.bulk_create([
+            User(email=f"bench{i}@kiet.edu", username=f"bench{i}", is_email_verified=True) for i in range(self.users)
+        ])
+        users = User.objects.filter(email__startswith="bench")
+        self.tokens = [str(AccessToken.for_user(user)) for user in users]
+
+    async def storm(self, application):
+        """Open every connection at once and return each one's connect latency in ms."""
+        async def connect(i):
+            socket = WebsocketCommunicator(application, f"/ws/?token={self.tokens[i % len(self.tokens)]}")
+            started = time.perf_counter()
+            connected, _ = await socket.connect(timeout=60)
+            elapsed = (time.perf_counter() - started) * 1000
+            assert connected
+            return socket, elapsed
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(connect(i) for i in range(self.connections)))
+        wall = time.perf_counter() - started
+        await asyncio.gather(*(socket.disconnect() for socket, _ in results))
+        return [elapsed for _, elapsed in results], wall
+
+    def summarize(self, name, latencies, wall):
+        return {
+            'middleware': name,
+            'connections': len(latencies),
+            'p50_ms': round(statistics.median(latencies), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'handshakes_per_s': round(len(latencies) / wall, 1),
+        }
+
+    async def test_handshake_storm(self):
+        consumer = HandshakeConsumer.as_asgi()
+        results = []
+
+        legacy = LegacyJWTAuthMiddleware(AuthMiddlewareStack(consumer))
+        results.append(self.summarize('legacy', *await self.storm(legacy)))
+
+        socket_token_cache().clear()
+        await sync_to_async(default_cache.clear)()
+        current = JWTAuthMiddlewareStack(consumer)
+        results.append(self.summarize('current_cold', *await self.storm(current)))
+        # A reconnect storm after a deploy: the same tokens again, now cached
+        results.append(self.summarize('current_warm', *await self.storm(current)))
+
+        print()
+        for row in results:
+            print(f"{row['middleware']:<13} n={row['connections']}  p50 {row['p50_ms']:>8.2f} ms  "
+                  f"p95 {row['p95_ms']:>8.2f} ms  p99 {row['p99_ms']:>8.2f} ms  {row['handshakes_per_s']:>8.1f}/s")
+        write_results('handshake', results)
+
+
+class LegacyChatConsumer(ChatConsumer):
+    """receive() as it was: one INSERT through the thread pool before every broadcast."""
+
+    async def receive(self, text_data):
+        message = json.loads(text_data)['message']
+        saved_message = await self.save_message(message)
+        await self.channel_layer.group_send(self.group_name, {
+            'type': 'chat_message', 'message': message,
+            'sender': self.user.username, 'timestamp': str(saved_message.timestamp),
+        })
+
+    @database_sync_to_async
+    def save_message(self, message):
+        return Message.objects.create(chat_room_id=self.chat_room.id, sender=self.user, content=message)
+
+
+class MessageThroughputBenchmark(TransactionTestCase):
+    messages = int(os.environ.get('BENCH_MESSAGES', 2000))
+
+    def setUp(self):
+        seller = User.objects.create_user(email="seller@kiet.edu", username="seller", password="x")
+        buyer = User.objects.create_user(email="buyer@kiet.edu", username="buyer", password="x")
+        category = Category.objects.create(name="Books", slug="books")
+        product = Product.objects.create(title="Book", description="Used", price="10.00", seller=seller, category=category)
+        self.room = ChatRoom.objects.create(product=product, buyer=buyer, seller=seller)
+        self.tokens = [str(AccessToken.for_user(user)) for user in (buyer, seller)]
+
+    async def run_chat(self, application):
+        """One side sends every message; time until the other side has them all and they are stored."""
+        sockets = [WebsocketCommunicator(application, f"/ws/chat/chat_{self.room.id}/?token={token}") for token in self.tokens]
+        for socket in sockets:
+            await socket.connect()
+        for socket in sockets:
+            await drain(socket)  # status and presence frames
+        sender, receiver = sockets
+
+        started = time.perf_counter()
+        for i in range(self.messages):
+            await sender.send_json_to({'message': f"message {i}"})
+        for _ in range(self.messages):
+            await receiver.receive_json_from(timeout=30)
+        delivered = time.perf_counter() - started
+        await database_sync_to_async(message_writer.flush)(30)
+        stored = time.perf_counter() - started
+        for socket in sockets:
+            await socket.disconnect()
+        return delivered, stored
+
+    async def test_message_throughput(self):
+        results = []
+        cases = (
+            ('legacy', URLRouter([path('ws/chat/<str:group_name>/', LegacyChatConsumer.as_asgi())])),
+            ('write_behind', URLRouter(websocket_urlpatterns)),
+        )
+        for name, router in cases:
+            await database_sync_to_async(Message.objects.all().delete)()
+            delivered, stored = await self.run_chat(JWTAuthMiddlewareStack(router))
+            count = await database_sync_to_async(Message.objects.count)()
+            self.assertEqual(count, self.messages)
+            results.append({
+                'path': name,
+                'messages': self.messages,
+                'delivered_per_s': round(self.messages / delivered, 1),
+                'stored_per_s': round(self.messages / stored, 1),
+            })
+
+        print()
+        for row in results:
+            print(f"{row['path']:<13} n={row['messages']}  delivered {row['delivered_per_s']:>9.1f} msg/s  "
+                  f"stored {row['stored_per_s']:>9.1f} msg/s")
+        write_results('message_throughput', results)
+
+
+class PresenceLoadBenchmark(TransactionTestCase):
+    """Typing and keep-alive traffic across many rooms; it must not reach the database at all."""
+    rooms = int(os.environ.get('BENCH_ROOMS', 50))
+    events = int(os.environ.get('BENCH_EVENTS', 100))
+
+    def setUp(self):
+        users = User.objects.bulk_create([
+            User(email=f"member{i}@kiet.edu", username=f"member{i}", is_email_verified=True) for i in range(self.rooms * 2)
+        ])
+        users = list(User.objects.filter(email__startswith="member").order_by('id'))
+        category = Category.objects.create(name="Books", slug="books")
+        product = Product.objects.create(title="Book", description="Used", price="10.00", seller=users[0], category=category)
+        ChatRoom.objects.bulk_create([
+            ChatRoom(product=product, buyer=users[2 * i], seller=users[2 * i + 1]) for i in range(self.rooms)
+        ])
+        self.pairs = [
+            (room.id, [str(AccessToken.for_user(user)) for user in (room.buyer, room.seller)])
+            for room in ChatRoom.objects.select_related('buyer', 'seller')
+        ]
+
+    async def test_typing_storm(self):
+        application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        sockets = []
+        for room_id, tokens in self.pairs:
+            pair = [WebsocketCommunicator(application, f"/ws/chat/chat_{room_id}/?token={token}") for token in tokens]
+            for socket in pair:
+                await socket.connect()
+            sockets.append(pair)
+        await asyncio.gather(*(drain(socket) for pair in sockets for socket in pair))
+
+        async def until_stopped(socket):
+            # The peer's last frame is its typing stop; everything before it was relayed too
+            frames = 1
+            while (await socket.receive_json_from(timeout=30)).get('typing') is not False:
+                frames += 1
+            return frames + await drain(socket)
+
+        async def chatter(socket):
+            for _ in range(self.events):
+                await socket.send_json_to({'type': 'typing'})
+                await socket.send_json_to({'type': 'ping'})
+            await socket.send_json_to({'type': 'typing', 'typing': False})
+
+        with count_queries() as queries:
+            started = time.perf_counter()
+            await asyncio.gather(*(chatter(socket) for pair in sockets for socket in pair))
+            relayed = sum(await asyncio.gather(*(until_stopped(socket) for pair in sockets for socket in pair)))
+            elapsed = time.perf_counter() - started
+        for pair in sockets:
+            for socket in pair:
+                await socket.disconnect()
+
+        sent = len(sockets) * 2 * (self.events * 2 + 1)
+        result = {
+            'rooms': len(sockets),
+            'frames_sent': sent,
+            'frames_relayed': relayed,
+            'frames_per_s': round(sent / elapsed, 1),
+            'db_queries': queries.count,
+        }
+        print()
+        print(f"rooms={result['rooms']}  sent {result['frames_sent']}  relayed {result['frames_relayed']}  "
+              f"{result['frames_per_s']:.1f} frames/s  db queries {result['db_queries']}")
+        write_results('presence', result)
+        self.assertEqual(queries.count, 0)
+
+
+class FrameSizeBenchmark(SimpleTestCase):
+    """Bytes on the wire and encode time per frame for each subprotocol, over a typical conversation."""
+    frames = int(os.environ.get('BENCH_FRAMES', 5000))
+    words = (
+        "is the calculator still available can I pick it up near block library tomorrow evening "
+        "price negotiable cash or upi how old does it work fine thanks okay deal see you at gate"
+    ).split()
+
+    def conversation(self):
+        for i in range(self.frames):
+            if i % 5 == 4:
+                yield {'type': 'typing', 'user': 1042, 'typing': bool(i % 2)}
+            elif i % 5 == 3:
+                yield {'type': 'read', 'reader': 1042, 'message_id': 880000 + i}
+            else:
+                yield {
+                    'message': ' '.join(self.words[(i * 7 + k * 13) % len(self.words)] for k in range(4 + i % 9)),
+                    'sender': ('aarav.sharma', 'priya_k')[i % 2],
+                    'timestamp': Stamp(f"2026-10-18 10:{i % 60:02d}:12.345678+00:00", 1792300000000 + i),
+                }
+
+    def test_frame_sizes(self):
+        results = []
+        for name, codec_class in [('json', JSONCodec)] + [item for item in sorted(CODECS.items()) if 'json' not in item[0]]:
+            codec = codec_class()
+            frames = list(self.conversation())
+            started = time.perf_counter()
+            encoded = [codec.encode(frame) for frame in frames]
+            elapsed = time.perf_counter() - started
+            sizes = [len(next(iter(frame.values()))) for frame in encoded]
+            results.append({
+                'subprotocol': name,
+                'frames': len(frames),
+                'mean_bytes': round(statistics.mean(sizes), 1),
+                'encode_us': round(elapsed / len(frames) * 1e6, 2),
+            })
+
+        print()
+        for row in results:
+            print(f"{row['subprotocol']:<29} n={row['frames']}  {row['mean_bytes']:>7.1f} B/frame  {row['encode_us']:>6.2f} us/frame")
+        write_results('frame_sizes', results)
+
+
+async def run_fanout(application, rooms, clients, messages, interval=0.0):
+    """
+    Drive ``clients`` sockets in each of ``rooms`` (a list of (room id, [tokens])
+    pairs; sockets take the room's tokens in turn) through the full socket stack,
+    have every socket send ``messages`` chat messages ``interval`` seconds apart,
+    and wait until every socket has received every message of its room.
+
+    Each message carries its send time, so latency is measured from the sending
+    socket to each receiving one. Queries are counted from the first send until
+    the writer has stored the last message.
+    """
+    connect_ms = []
+
+    async def open_socket(room_id, token):
+        socket = WebsocketCommunicator(application, f"/ws/chat/chat_{room_id}/?token={token}")
+        started = time.perf_counter()
+        connected, _ = await socket.connect(timeout=60)
+        connect_ms.append((time.perf_counter() - started) * 1000)
+        assert connected, f"socket for room {room_id} was refused"
+        return socket
+
+    started = time.perf_counter()
+    sockets = await asyncio.gather(*(
+        open_socket(room_id, tokens[i % len(tokens)]) for room_id, tokens in rooms for i in range(clients)
+    ))
+    connect_wall = time.perf_counter() - started
+    await asyncio.gather(*(drain(socket) for socket in sockets))  # status and presence frames
+
+    latencies = []
+    expected = clients * messages  # every socket gets each message of its room, its own included
+
+    async def listen(socket):
+        received = 0
+        while received < expected:
+            frame = json.loads((await socket.receive_output(timeout=60))['text'])
+            if 'type' in frame:
+                continue  # presence, typing, receipts
+            latencies.append((time.perf_counter_ns() - int(frame['message'].rsplit(':', 1)[1])) / 1e6)
+            received += 1
+
+    async def talk(socket):
+        for seq in range(messages):
+            await socket.send_to(text_data=json.dumps({'message': f"bench:{seq}:{time.perf_counter_ns()}"}))
+            await asyncio.sleep(interval)
+
+    with count_queries() as queries:
+        started = time.perf_counter()
+        listeners = [asyncio.ensure_future(listen(socket)) for socket in sockets]
+        await asyncio.gather(*(talk(socket) for socket in sockets))
+        await asyncio.gather(*listeners)
+        delivered = time.perf_counter() - started
+        await sync_to_async(message_writer.flush, thread_sensitive=False)(60)
+        stored = time.perf_counter() - started
+    await asyncio.gather(*(socket.disconnect() for socket in sockets))
+
+    sent = len(sockets) * messages
+    return {
+        'rooms': len(rooms),
+        'clients_per_room': clients,
+        'messages_per_client': messages,
+        'interval_s': interval,
+        'messages_sent': sent,
+        'deliveries': len(latencies),
+        'connect_p50_ms': round(statistics.median(connect_ms), 2),
+        'connect_p95_ms': round(percentile(connect_ms, 0.95), 2),
+        'connect_p99_ms': round(percentile(connect_ms, 0.99), 2),
+        'connects_per_s': round(len(sockets) / connect_wall, 1),
+        'latency_p50_ms': round(statistics.median(latencies), 2),
+        'latency_p95_ms': round(percentile(latencies, 0.95), 2),
+        'latency_p99_ms': round(percentile(latencies, 0.99), 2),
+        'latency_max_ms': round(max(latencies), 2),
+        'messages_per_s': round(sent / delivered, 1),
+        'deliveries_per_s': round(len(latencies) / delivered, 1),
+        'stored_per_s': round(sent / stored, 1),
+        'db_queries': queries.count,
+        'queries_per_message': round(queries.count / sent, 4),
+    }
+
+
+class FanoutBenchmark(TransactionTestCase):
+    """N rooms × M sockets chatting at once, through the auth middleware, consumer, channel layer and writer."""
+    # The defaults offer ~320 msg/s, under what one process sustains, so latency is not just queueing
+    rooms = int(os.environ.get('BENCH_ROOMS', 20))
+    clients = int(os.environ.get('BENCH_CLIENTS', 4))
+    messages = int(os.environ.get('BENCH_FANOUT_MESSAGES', 20))
+    interval = float(os.environ.get('BENCH_INTERVAL', 0.25))
+
+    def setUp(self):
+        User.objects.bulk_create([
+            User(email=f"fan{i}@kiet.edu", username=f"fan{i}", is_email_verified=True) for i in range(self.rooms * 2)
+        ])
+        users = list(User.objects.filter(email__startswith="fan").order_by('id'))
+        category = Category.objects.create(name="Books", slug="books")
+        product = Product.objects.create(title="Book", description="Used", price="10.00", seller=users[0], category=category)
+        ChatRoom.objects.bulk_create([
+            ChatRoom(product=product, buyer=users[2 * i], seller=users[2 * i + 1]) for i in range(self.rooms)
+        ])
+        self.room_tokens = [
+            (room.id, [str(AccessToken.for_user(user)) for user in (room.buyer, room.seller)])
+            for room in ChatRoom.objects.select_related('buyer', 'seller')
+        ]
+
+    def channel_layers(self):
+        if os.environ.get('BENCH_REDIS_URL'):
+            return {'default': {
+                'BACKEND': 'channels_redis.core.RedisChannelLayer',
+                'CONFIG': {'hosts': [os.environ['BENCH_REDIS_URL']]},
+            }}
+        return {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 10000}}}
+
+    async def test_fanout(self):
+        with override_settings(CHANNEL_LAYERS=self.channel_layers()):
+            application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+            result = await run_fanout(application, self.room_tokens, self.clients, self.messages, self.interval)
+            result['channel_layer'] = type(get_channel_layer()).__name__
+            write_results('fanout', result)
+
+        print()
+        print(f"{result['rooms']} rooms x {result['clients_per_room']} sockets x {result['messages_per_client']} msgs "
+              f"over {result['channel_layer']}")
+        print(f"connect   p50 {result['connect_p50_ms']:>8.2f} ms  p95 {result['connect_p95_ms']:>8.2f} ms  "
+              f"p99 {result['connect_p99_ms']:>8.2f} ms  {result['connects_per_s']:>8.1f}/s")
+        print(f"latency   p50 {result['latency_p50_ms']:>8.2f} ms  p95 {result['latency_p95_ms']:>8.2f} ms  "
+              f"p99 {result['latency_p99_ms']:>8.2f} ms  max {result['latency_max_ms']:.2f} ms")
+        print(f"throughput {result['messages_per_s']:.1f} msg/s sent, {result['deliveries_per_s']:.1f} deliveries/s, "
+              f"{result['stored_per_s']:.1f} msg/s stored, {result['queries_per_message']} queries/msg")
+        self.assertEqual(result['deliveries'], result['messages_sent'] * self.clients)
+
+
+class MultiplexBenchmark(TransactionTestCase):
+    """Sellers with many negotiations joining every room: one socket per room against one socket per user."""
+    sellers = int(os.environ.get('BENCH_SELLERS', 25))
+    rooms_per_seller = int(os.environ.get('BENCH_USER_ROOMS', 20))
+
+    def setUp(self):
+        User.objects.bulk_create(
+            [User(email=f"s{i}@kiet.edu", username=f"s{i}", is_email_verified=True) for i in range(self.sellers)]
+            + [User(email=f"b{i}@kiet.edu", username=f"b{i}", is_email_verified=True) for i in range(self.rooms_per_seller)]
+        )
+        sellers = list(User.objects.filter(email__startswith="s").order_by('id'))
+        buyers = list(User.objects.filter(email__startswith="b").order_by('id'))
+        category = Category.objects.create(name="Books", slug="books")
+        product = Product.objects.create(title="Book", description="Used", price="10.00", seller=sellers[0], category=category)
+        ChatRoom.objects.bulk_create([
+            ChatRoom(product=product, buyer=buyer, seller=seller) for seller in sellers for buyer in buyers
+        ])
+        self.seller_rooms = [
+            (str(AccessToken.for_user(seller)), list(ChatRoom.objects.filter(seller=seller).values_list('id', flat=True)))
+            for seller in sellers
+        ]
+
+    async def connect_all(self, paths):
+        application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        sockets = [WebsocketCommunicator(application, path) for path in paths]
+        with count_queries() as queries:
+            started = time.perf_counter()
+            for connected, _ in await asyncio.gather(*(socket.connect(timeout=60) for socket in sockets)):
+                assert connected
+            await asyncio.gather(*(drain(socket) for socket in sockets))
+            elapsed = time.perf_counter() - started
+        await asyncio.gather(*(socket.disconnect() for socket in sockets))
+        return len(sockets), elapsed, queries.count
+
+    async def test_join_all_rooms(self):
+        results = []
+        cases = (
+            ('per_room', [f"/ws/chat/chat_{room_id}/?token={token}" for token, rooms in self.seller_rooms for room_id in rooms]),
+            ('per_user', [f"/ws/chats/?token={token}" for token, _ in self.seller_rooms]),
+        )
+        for name, paths in cases:
+            socket_token_cache().clear()
+            await sync_to_async(default_cache.clear)()
+            sockets, elapsed, queries = await self.connect_all(paths)
+            results.append({
+                'socket': name,
+                'users': len(self.seller_rooms),
+                'rooms_per_user': self.rooms_per_seller,
+                'sockets': sockets,
+                'handshakes': sockets,
+                'connect_all_s': round(elapsed, 3),
+                'db_queries': queries,
+            })
+
+        print()
+        for row in results:
+            print(f"{row['socket']:<9} {row['users']} users x {row['rooms_per_user']} rooms  {row['sockets']:>5} sockets  "
+                  f"{row['connect_all_s']:>7.3f} s to join  {row['db_queries']:>5} queries")
+        write_results('multiplex', results)
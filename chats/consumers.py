@@ -1,14 +1,41 @@
+import asyncio
+import time
+import uuid
+
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
 from channels.db import database_sync_to_async
-import json
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import AnonymousUser
+from . import presence
+from .inbox import advance_read_cursor
+from .protocols import Stamp, epoch_ms, negotiate
+from .utils import active_rooms_for, aget_room_access, user_group_name
+from .writer import message_writer
+
+
+class RoomSession:
+    """What a socket keeps about one room it is in: read cursor, typing and presence state."""
+
+    def __init__(self, room):
+        self.room = room  # a chats.utils.RoomAccess
+        self.group_name = f'chat_{room.id}'
+        self.read_only = not room.is_active
+        self.read_message_id = self.read_at = self.read_task = None
+        self.present = self.is_typing = False
+        self.typing_sent = self.presence_refreshed = 0.0
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    """One socket per room, at ws/chat/chat_<room id>/."""
+
     async def connect(self):
         self.group_name = self.scope['url_route']['kwargs']['group_name']
         self.user = self.scope['user']
+        self.sent_messages = False
+        self.codec = negotiate(self.scope.get('subprotocols'))
+        self.session = None
 
         # Reject if user is not authenticated
         if isinstance(self.user, AnonymousUser):
@@ -17,7 +44,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         try:
             self.chat_room_id = int(self.group_name.split('_')[1])
-            self.chat_room = await self.get_chat_room(self.chat_room_id)
+            # Membership and active state come from the cache; the room row is only read on a miss
+            self.chat_room = await aget_room_access(self.chat_room_id)
+            if self.chat_room is None:
+                await self.close()
+                return
 
             # Check is_active flag
             self.read_only = not self.chat_room.is_active
@@ -27,37 +58,52 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 #print(f"[BLOCKED] ChatRoom inactive, closing socket.")
                 await self.close()
                 return
-            
-        except (ValueError, IndexError, apps.get_model('chats', 'ChatRoom').DoesNotExist) as e:
+
+        except (ValueError, IndexError) as e:
             #print(f"Invalid group_name or chat room does not exist. Error: {e}. Closing connection.")
             await self.close()
             return
-        
 
-        if self.user.id not in [self.chat_room.buyer.id, self.chat_room.seller.id]:
+
+        if self.user.id not in [self.chat_room.buyer_id, self.chat_room.seller_id]:
             print("[REJECTED] Unauthorized user.")
             await self.close()
             return
-        
+
         # Join the chat room group
         await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
 
-        await self.accept()
+        await self.accept(subprotocol=self.codec.subprotocol)
 
         # Inform frontend of chat status
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'info',
             'read_only': self.read_only,
             'message': 'Chat is inactive. You can read messages but cannot send new ones.' if self.read_only else 'Chat is active.'
-        }))
+        })
+
+        self.session = RoomSession(self.chat_room)
+        await self.enter_room(self.session)
+        members = [self.chat_room.buyer_id, self.chat_room.seller_id]
+        await self.send_frame({
+            'type': 'presence_state',
+            'online': await presence.online(self.chat_room.id, members),
+        })
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if self.session is not None:
+            await self.leave_room(self.session)
+        await self.finish()
+
+    async def finish(self):
+        if self.sent_messages:
+            # Have this socket's messages stored before the client can reload the history
+            await sync_to_async(message_writer.flush, thread_sensitive=False)(5)
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """
         Handles incoming WebSocket messages.
         Prevents sending if chat is inactive.
@@ -67,50 +113,274 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
-        if self.read_only:
+        try:
+            event = self.codec.decode(text_data, bytes_data)
+        except ValueError:
+            await self.close()
+            return
+        await self.handle_event(self.session, event)
+
+    async def handle_event(self, session, event):
+        if isinstance(event, dict) and event.get('type') == 'read':
+            # Allowed in read-only rooms too
+            self.queue_read(session, event.get('message_id'))
+            return
+        if isinstance(event, dict) and event.get('type') in ('typing', 'ping'):
+            await self.receive_ephemeral(session, event)
+            return
+
+        if session.read_only:
             #print(f"User {self.user.username} tried to send message to inactive chat {self.group_name}.")
-            await self.send(text_data=json.dumps({
+            await self.send_room_frame(session, {
                 'type': 'error',
                 'message': 'Chat is inactive. You cannot send new messages.'
-            }))
+            })
             return
 
         try:
-            text_data_json = json.loads(text_data)
-            message = text_data_json['message']
+            message = event['message']
+            # The live frame goes out before the message has an id, so it carries this one instead
+            client_id = event.get('client_id') or uuid.uuid4().hex
+            if not isinstance(client_id, str) or len(client_id) > 64:
+                await self.send_room_frame(session, {'type': 'error', 'message': 'client_id must be a string of at most 64 characters.'})
+                return
 
-            saved_message = await self.save_message(message)
+            # Persisted in the background by the writer; the broadcast does not wait for the INSERT
+            saved_message = message_writer.submit(session.room.id, self.user.id, message, client_id)
+            if saved_message is None:
+                # The server is shutting down; the client resends once it has reconnected
+                await self.send_room_frame(session, {'type': 'error', 'client_id': client_id, 'message': 'Message not sent. Please try again.'})
+                return
+            self.sent_messages = True
+            session.is_typing = False  # clients clear the indicator when the message lands
 
             await self.channel_layer.group_send(
-                self.group_name,
+                session.group_name,
                 {
                     'type': 'chat_message',
+                    'room': session.room.id,
                     'message': message,
+                    'client_id': client_id,
                     'sender': self.user.username,
-                    'timestamp': str(saved_message.timestamp)
+                    'timestamp': str(saved_message.timestamp),
+                    'epoch_ms': epoch_ms(saved_message.timestamp),
                 }
             )
         except Exception as e:
             #print(f"Error handling received message: {e}")
             await self.close()
-            
+
+    def session_for(self, event):
+        """The session a room group event is for; None if the socket has since left the room."""
+        return self.session
+
+    async def enter_room(self, session):
+        came_online = await presence.join(session.room.id, self.user.id)
+        session.present, session.presence_refreshed = True, time.monotonic()
+        if came_online:
+            await self.send_ephemeral(session, 'presence', online=True)
+
+    async def leave_room(self, session):
+        if session.read_task is not None:
+            session.read_task.cancel()
+            await self.flush_reads(session)
+        if session.is_typing:
+            await self.send_ephemeral(session, 'typing', typing=False)
+        if session.present and await presence.leave(session.room.id, self.user.id):
+            await self.send_ephemeral(session, 'presence', online=False)
+        await self.channel_layer.group_discard(session.group_name, self.channel_name)
+
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
+        session = self.session_for(event)
+        if session is None:
+            return
+        timestamp = event['timestamp']
+        if 'epoch_ms' in event:
+            timestamp = Stamp(timestamp, event['epoch_ms'])
+        frame = {
             'message': event['message'],
             'sender': event['sender'],
-            'timestamp': event['timestamp']
-        }))
-
-    @database_sync_to_async
-    def get_chat_room(self, chat_room_id):
-        ChatRoom = apps.get_model('chats', 'ChatRoom')
-        return ChatRoom.objects.select_related('buyer', 'seller').get(id=chat_room_id)
-
-    @database_sync_to_async
-    def save_message(self, message):
-        Message = apps.get_model('chats', 'Message')
-        return Message.objects.create(
-            chat_room=self.chat_room,
-            sender=self.user,
-            content=message
+            'timestamp': timestamp
+        }
+        if 'client_id' in event:
+            frame['client_id'] = event['client_id']
+        await self.send_room_frame(session, frame)
+
+    async def send_frame(self, frame):
+        """Send one event in whatever encoding the socket negotiated (see chats.protocols)."""
+        await self.send(**self.codec.encode(frame))
+
+    async def send_room_frame(self, session, frame):
+        await self.send_frame(frame)
+
+    async def receive_ephemeral(self, session, event):
+        """
+        Typing and keep-alive frames. They are coalesced per connection: a
+        typing burst is relayed at most once per CHAT_TYPING_INTERVAL, a stop
+        only after a start, and presence is refreshed at most every third of
+        its TTL. Nothing here reaches the database.
+        """
+        now = time.monotonic()
+        await self.refresh_presence(session, now)
+
+        if event['type'] != 'typing' or session.read_only:
+            return
+        if event.get('typing', True):
+            if session.is_typing and now - session.typing_sent < getattr(settings, 'CHAT_TYPING_INTERVAL', 2):
+                return
+            session.is_typing, session.typing_sent = True, now
+            await self.send_ephemeral(session, 'typing', typing=True)
+        elif session.is_typing:
+            session.is_typing = False
+            await self.send_ephemeral(session, 'typing', typing=False)
+
+    async def refresh_presence(self, session, now):
+        if now - session.presence_refreshed >= presence.presence_ttl() / 3:
+            session.presence_refreshed = now
+            if await presence.refresh(session.room.id, self.user.id):
+                await self.send_ephemeral(session, 'presence', online=True)
+
+    async def send_ephemeral(self, session, kind, **fields):
+        await self.channel_layer.group_send(session.group_name, {
+            'type': kind, 'room': session.room.id, 'user': self.user.id, 'origin': self.channel_name, **fields,
+        })
+
+    async def presence(self, event):
+        session = self.session_for(event)
+        if session is not None and event['origin'] != self.channel_name:
+            await self.send_room_frame(session, {'type': 'presence', 'user': event['user'], 'online': event['online']})
+
+    async def typing(self, event):
+        session = self.session_for(event)
+        if session is not None and event['origin'] != self.channel_name:
+            await self.send_room_frame(session, {'type': 'typing', 'user': event['user'], 'typing': event['typing']})
+
+    async def read_receipt(self, event):
+        session = self.session_for(event)
+        if session is None:
+            return
+        await self.send_room_frame(session, {
+            'type': 'read',
+            'reader': event['reader'],
+            'message_id': event['message_id'],
+        })
+
+    def queue_read(self, session, message_id=None):
+        """
+        Note how far the user has read. A scroll burst sends many of these, so
+        they are merged and written at most once per CHAT_READ_COALESCE seconds.
+        Without a message_id it means "everything received so far"; the merged
+        read is written CHAT_READ_COALESCE later, by when the writers of every
+        worker have normally stored what it covers (see chats.views.MessageReadView).
+        """
+        if message_id is None:
+            session.read_at = timezone.now()
+        elif isinstance(message_id, int) and not isinstance(message_id, bool):
+            session.read_message_id = max(session.read_message_id or 0, message_id)
+        else:
+            return
+        if session.read_task is None:
+            delay = getattr(settings, 'CHAT_READ_COALESCE', 0.5)
+            session.read_task = asyncio.ensure_future(self.flush_reads(session, delay))
+
+    async def flush_reads(self, session, delay=0):
+        if delay:
+            await asyncio.sleep(delay)
+        message_id, read_at = session.read_message_id, session.read_at
+        session.read_message_id = session.read_at = session.read_task = None
+        if message_id is None and read_at is None:
+            return
+        room = session.room
+        cursor = await database_sync_to_async(advance_read_cursor)(
+            room.id, self.user.id, room.buyer_id, message_id, read_at
         )
+        if cursor:
+            await self.channel_layer.group_send(
+                session.group_name, {'type': 'read_receipt', 'room': room.id, 'reader': self.user.id, 'message_id': cursor}
+            )
+
+
+class UserChatConsumer(ChatConsumer):
+    """
+    One socket per user, at ws/chats/, carrying every active room they are in.
+
+    Frames in both directions name their room: {"room": <id>, ...}, otherwise
+    as on the per-room socket. On connect the client gets {"type": "rooms"}
+    listing the rooms with who is online in each; afterwards "room_opened" and
+    "room_closed" follow requests being accepted and rejected, through the
+    user_<id> group that chats.utils.rooms_changed notifies. A {"type": "ping"}
+    needs no room: it keeps the user online in every room of the socket.
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        self.sent_messages = False
+        self.codec = negotiate(self.scope.get('subprotocols'))
+        self.sessions = {}
+
+        if isinstance(self.user, AnonymousUser):
+            await self.close()
+            return
+
+        self.user_group = user_group_name(self.user.id)
+        await self.channel_layer.group_add(self.user_group, self.channel_name)
+        await self.accept(subprotocol=self.codec.subprotocol)
+
+        rooms = await database_sync_to_async(active_rooms_for)(self.user.id)
+        await asyncio.gather(*(self.open_session(room) for room in rooms))
+        online = await presence.online_in([(room.id, [room.buyer_id, room.seller_id]) for room in rooms])
+        await self.send_frame({
+            'type': 'rooms',
+            'rooms': [{'room': room.id, 'online': online[room.id]} for room in rooms],
+        })
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'user_group'):
+            return
+        await asyncio.gather(*(self.leave_room(session) for session in self.sessions.values()))
+        self.sessions = {}
+        await self.channel_layer.group_discard(self.user_group, self.channel_name)
+        await self.finish()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            event = self.codec.decode(text_data, bytes_data)
+        except ValueError:
+            await self.close()
+            return
+        if isinstance(event, dict) and event.get('type') == 'ping':
+            # One socket is alive for all its rooms; each session keeps its own refresh throttle
+            now = time.monotonic()
+            await asyncio.gather(*(self.refresh_presence(session, now) for session in self.sessions.values()))
+            return
+        room_id = event.get('room') if isinstance(event, dict) else None
+        session = self.sessions.get(room_id)
+        if session is None:
+            await self.send_frame({'type': 'error', 'room': room_id, 'message': 'Not a chat you are in.'})
+            return
+        await self.handle_event(session, event)
+
+    def session_for(self, event):
+        return self.sessions.get(event.get('room'))
+
+    async def send_room_frame(self, session, frame):
+        await self.send_frame({'room': session.room.id, **frame})
+
+    async def open_session(self, room):
+        session = self.sessions[room.id] = RoomSession(room)
+        await self.channel_layer.group_add(session.group_name, self.channel_name)
+        await self.enter_room(session)
+        return session
+
+    async def room_changed(self, event):
+        """A room of this user was opened, reopened or closed; (un)subscribe to match."""
+        room_id = event['room']
+        room = await aget_room_access(room_id)
+        active = room is not None and room.is_active and self.user.id in (room.buyer_id, room.seller_id)
+        if active and room_id not in self.sessions:
+            await self.open_session(room)
+            online = await presence.online(room.id, [room.buyer_id, room.seller_id])
+            await self.send_frame({'type': 'room_opened', 'room': room_id, 'online': online})
+        elif not active and room_id in self.sessions:
+            await self.leave_room(self.sessions.pop(room_id))
+            await self.send_frame({'type': 'room_closed', 'room': room_id})
@@ -0,0 +1,103 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from api.models import ProductRequest
+from .models import ChatRoom, Message
+
+PREVIEW_LENGTH = 255
+
+
+def record_messages(messages):
+    """
+    Point each room's inbox preview at the last of its freshly written
+    messages; one UPDATE per room. The UPDATE only applies if nothing newer
+    is there yet, because another worker's writer may have just recorded a
+    message received after this one.
+    """
+    last_by_room = {}
+    for message in messages:
+        last_by_room[message.chat_room_id] = message  # messages arrive in submit order
+
+    for room_id, last in last_by_room.items():
+        newer = Q(last_message_at__gt=last.timestamp)
+        ChatRoom.objects.filter(pk=room_id).exclude(newer).update(
+            last_message_preview=last.content[:PREVIEW_LENGTH],
+            last_message_sender_id=last.sender_id,
+            last_message_at=last.timestamp,
+        )
+
+
+def cursor_field(user_id, buyer_id):
+    return 'buyer_last_read_id' if user_id == buyer_id else 'seller_last_read_id'
+
+
+def advance_read_cursor(room_id, user_id, buyer_id, message_id=None, read_at=None):
+    """
+    Move a member's read cursor forward to ``message_id``, or to the last
+    message received by ``read_at`` (live messages reach clients before they
+    have an id), whichever is further. Ids follow receive order only within
+    one writer process, so reading a message also covers every message
+    received before it, whatever its id. The target is snapped to a message of
+    this room with one seek down its ids, so a bogus id cannot run the cursor
+    past the history. Returns the new cursor, or None when it did not move.
+    """
+    bound = Q()
+    if message_id is not None:
+        received = Message.objects.filter(pk=message_id, chat_room_id=room_id).values('timestamp')[:1]
+        bound |= Q(id__lte=message_id) | Q(timestamp__lte=Subquery(received))
+    if read_at is not None:
+        bound |= Q(timestamp__lte=read_at)
+    if not bound:
+        return None
+    target = (
+        Message.objects.filter(bound, chat_room_id=room_id)
+        .order_by('-id').values_list('id', flat=True).first()
+    )
+    if target is None:
+        return None
+    field = cursor_field(user_id, buyer_id)
+    # Cursors only move forward; the filter makes a stale or repeated read a no-op
+    moved = ChatRoom.objects.filter(pk=room_id, **{f'{field}__lt': target}).update(**{field: target})
+    return target if moved else None
+
+
+def broadcast_read(room_id, user_id, message_id):
+    """Tell the room's open sockets that ``user_id`` has read up to ``message_id``."""
+    async_to_sync(get_channel_layer().group_send)(
+        f'chat_{room_id}', {'type': 'read_receipt', 'room': room_id, 'reader': user_id, 'message_id': message_id}
+    )
+
+
+def unread_count(room_ref, cursor_ref, user_id):
+    """Messages past the cursor from the other member: a range count on the (chat_room, id) index."""
+    count = (
+        Message.objects.filter(chat_room=room_ref, id__gt=cursor_ref).exclude(sender_id=user_id)
+        .order_by().values('chat_room').annotate(count=Count('id')).values('count')
+    )
+    return Coalesce(Subquery(count), Value(0))
+
+
+def inbox_for(user):
+    """The user's rooms with everything the inbox shows annotated on, most recent conversation first."""
+    is_buyer = Q(buyer_id=user.id)
+    request_id = (
+        ProductRequest.objects.filter(product=OuterRef('product'), buyer=OuterRef('buyer'))
+        .order_by('pk').values('pk')[:1]
+    )
+    return (
+        ChatRoom.objects.filter(is_buyer | Q(seller_id=user.id))
+        .annotate(
+            buyer_uname=F('buyer__username'),
+            seller_uname=F('seller__username'),
+            product_name=F('product__title'),
+            request_id=Subquery(request_id),
+            last_read_id=Case(When(is_buyer, then=F('buyer_last_read_id')), default=F('seller_last_read_id')),
+            counterparty_id=Case(When(is_buyer, then=F('seller_id')), default=F('buyer_id')),
+            counterparty_name=Case(When(is_buyer, then=F('seller__username')), default=F('buyer__username')),
+            counterparty_last_read_id=Case(When(is_buyer, then=F('seller_last_read_id')), default=F('buyer_last_read_id')),
+        )
+        .annotate(unread_count=unread_count(OuterRef('pk'), OuterRef('last_read_id'), user.id))
+        .order_by(F('last_message_at').desc(nulls_last=True), '-created_at')
+    )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Substr
+
+from chats.inbox import PREVIEW_LENGTH
+from chats.models import ChatRoom, Message
+
+
+class Command(BaseCommand):
+    help = "Refill every chat room's last-message preview from its messages."
+
+    def handle(self, *args, **options):
+        latest = Message.objects.filter(chat_room=OuterRef('pk')).order_by('-id')
+        updated = ChatRoom.objects.update(
+            last_message_preview=Subquery(latest.annotate(preview=Substr('content', 1, PREVIEW_LENGTH)).values('preview')[:1]),
+            last_message_sender=Subquery(latest.values('sender_id')[:1]),
+            last_message_at=Subquery(latest.values('timestamp')[:1]),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt inbox previews for {updated} chat rooms."))
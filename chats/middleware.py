@@ -1,15 +1,32 @@
+import asyncio
+import time
 from urllib.parse import parse_qs
 
-from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
 from django.conf import settings
-from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
-from django.db import close_old_connections
 from jwt import InvalidSignatureError, ExpiredSignatureError, DecodeError
 from jwt import decode as jwt_decode
 
-User = get_user_model()
+from api.authentication import get_cached_user
+from api.caching import BoundedLRUCache
+
+# Bounded TTL cache of decoded tokens shared by every handshake in this process: token -> user id.
+# Users themselves come from the shared cache (api.authentication), which every worker sees cleared.
+_token_cache = None
+# (event loop, user id) -> lookup already under way, so a reconnect storm reads each user once.
+# Keyed by loop because futures belong to the loop that made them, and test runners start new ones.
+_pending_users = {}
+
+
+def socket_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = BoundedLRUCache(
+            max_entries=getattr(settings, 'SOCKET_AUTH_CACHE_ENTRIES', 10000),
+            ttl=getattr(settings, 'SOCKET_AUTH_CACHE_TTL', 60),
+        )
+    return _token_cache
 
 
 class JWTAuthMiddleware:
@@ -21,30 +38,60 @@ class JWTAuthMiddleware:
 
     async def __call__(self, scope, receive, send):
         """Authenticate the user based on jwt."""
-        close_old_connections()
+        # Nothing here blocks the event loop: decoding is cached CPU work and the
+        # only database access goes through database_sync_to_async, which also
+        # takes care of closing stale connections in its worker thread.
+        scope = dict(scope)
         try:
             # Decode the query string and get token parameter from it.
             token = parse_qs(scope["query_string"].decode("utf8")).get('token', None)[0]
-            
-            # Decode the token to get the user id from it.
-            data = jwt_decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-            
-            # Get the user from database based on user id and add it to the scope.
-            scope['user'] = await self.get_user(data['user_id'])
+            user_id = self.get_user_id(token)
+
+            # Get the user (cached, or from the database) and add it to the scope.
+            scope['user'] = await self.get_cached_user(user_id)
         except (TypeError, KeyError, InvalidSignatureError, ExpiredSignatureError, DecodeError):
             # Set the user to Anonymous if token is not valid or expired.
             scope['user'] = AnonymousUser()
         return await self.app(scope, receive, send)
 
+    def get_user_id(self, token):
+        tokens = socket_token_cache()
+        user_id = tokens.get(token)
+        if user_id is None:
+            data = jwt_decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+            user_id = data['user_id']
+            # Never keep a token around past its own expiry
+            remaining = data['exp'] - time.time() if 'exp' in data else None
+            if remaining is None or remaining > 0:
+                tokens.set(token, user_id, ttl=min(remaining, tokens.ttl) if remaining else None)
+        return user_id
+
+    async def get_cached_user(self, user_id):
+        key = (asyncio.get_running_loop(), user_id)
+        shared = _pending_users.get(key)
+        if shared is not None:
+            try:
+                return await asyncio.shield(shared)
+            except Exception:
+                pass  # that lookup failed; this handshake makes its own rather than share the error
+        lookup = asyncio.ensure_future(self.get_user(user_id))
+        _pending_users[key] = lookup
+        try:
+            # Shielded, so a handshake that is cancelled does not cancel the lookup others wait on
+            return await asyncio.shield(lookup)
+        finally:
+            if _pending_users.get(key) is lookup:
+                del _pending_users[key]
+
     @database_sync_to_async
     def get_user(self, user_id):
-        """Return the user based on user id."""
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
+        """Return the active user based on user id, through the cache REST authentication uses."""
+        found = get_cached_user(user_id)
+        if found is None or not found[0].is_active:
             return AnonymousUser()
+        return found[0]
 
 
 def JWTAuthMiddlewareStack(app):
-    """This function wrap channels authentication stack with JWTAuthMiddleware."""
-    return JWTAuthMiddleware(AuthMiddlewareStack(app))
\ No newline at end of file
+    """Wrap the app with JWTAuthMiddleware; sockets authenticate by token only, so no session lookups."""
+    return JWTAuthMiddleware(app)
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_chatroom_last_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='buyer_last_read_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='seller_last_read_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
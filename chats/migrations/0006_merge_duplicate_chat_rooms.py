@@ -0,0 +1,43 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_rooms(apps, schema_editor):
+    """Fold every extra room of a (product, buyer, seller) into its oldest one so unique_chat_room can be added."""
+    ChatRoom = apps.get_model('chats', 'ChatRoom')
+    Message = apps.get_model('chats', 'Message')
+    duplicated = (
+        ChatRoom.objects.values('product', 'buyer', 'seller')
+        .annotate(rooms=Count('id')).filter(rooms__gt=1)
+    )
+    for key in duplicated:
+        rooms = list(ChatRoom.objects.filter(
+            product=key['product'], buyer=key['buyer'], seller=key['seller'],
+        ).order_by('id'))
+        keeper, extras = rooms[0], rooms[1:]
+        Message.objects.filter(chat_room__in=extras).update(chat_room=keeper)
+
+        keeper.is_active = any(room.is_active for room in rooms)
+        keeper.buyer_last_read_id = max(room.buyer_last_read_id for room in rooms)
+        keeper.seller_last_read_id = max(room.seller_last_read_id for room in rooms)
+        latest = max(
+            (room for room in rooms if room.last_message_at is not None),
+            key=lambda room: room.last_message_at, default=None,
+        )
+        if latest is not None:
+            keeper.last_message_preview = latest.last_message_preview
+            keeper.last_message_sender_id = latest.last_message_sender_id
+            keeper.last_message_at = latest.last_message_at
+        keeper.save()
+        ChatRoom.objects.filter(pk__in=[room.pk for room in extras]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_chatroom_read_cursors'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rooms, migrations.RunPython.noop),
+    ]
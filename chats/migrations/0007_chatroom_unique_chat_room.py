@@ -0,0 +1,20 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_job'),
+        ('chats', '0006_merge_duplicate_chat_rooms'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(fields=('product', 'buyer', 'seller'), name='unique_chat_room'),
+        ),
+    ]
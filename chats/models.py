@@ -1,17 +1,31 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
-from api.models import Product
+from api.models import LoadedValuesMixin, Product
 
 User = get_user_model()
 
-class ChatRoom(models.Model):
+class ChatRoom(LoadedValuesMixin, models.Model):
     buyer = models.ForeignKey(User, related_name='buyer_chatrooms', on_delete=models.CASCADE)
     seller = models.ForeignKey(User, related_name='seller_chatrooms', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)  # Assuming you have a Product model
     is_active = models.BooleanField(default=True) 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Inbox summary, kept up to date by chats.inbox.record_messages as the writer stores messages
+    last_message_preview = models.CharField(max_length=255, blank=True, default='')
+    last_message_sender = models.ForeignKey(User, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # Id of the last message each member has read; see chats.inbox.advance_read_cursor
+    buyer_last_read_id = models.PositiveBigIntegerField(default=0)
+    seller_last_read_id = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'buyer', 'seller'], name='unique_chat_room'),
+        ]
+
     def __str__(self):
         return f"ChatRoom: {self.buyer.username} and {self.seller.username}"
 
@@ -19,7 +33,14 @@ class Message(models.Model):
     chat_room = models.ForeignKey(ChatRoom, related_name='messages', on_delete=models.CASCADE)
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)  # set on receipt; chats.writer inserts later
+    # Chosen by the sending client (or its consumer) and carried on the live frame, which has no id yet
+    client_id = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        # History pages seek backwards by (timestamp, id) within a room: ids only follow receive
+        # order within one writer process, timestamps follow it across all of them (see chats.writer)
+        indexes = [models.Index(fields=['chat_room', '-timestamp', '-id'], name='message_history_idx')]
 
     def __str__(self):
         return f"Message by {self.sender.username} in {self.chat_room}"
\ No newline at end of file
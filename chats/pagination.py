@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.db.models import Q, Subquery
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class MessageKeysetPagination(BasePagination):
+    """
+    Newest-first keyset pagination for a room's history.
+
+    The first page holds the latest messages; ``next`` links to the page of
+    older ones via ``?before=<oldest id on this page>``. Pages are ordered by
+    (timestamp, id), since ids alone follow receive order only within one
+    writer process (see chats.writer), so the cursor's timestamp is looked up
+    in the same query and the page is one seek on the (chat_room, timestamp,
+    id) index. Rows within a page stay in chronological order so clients can
+    prepend a page as it is.
+    """
+    before_query_param = 'before'
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def get_page_size(self, request):
+        page_size = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return min(requested, self.max_page_size) if requested > 0 else page_size
+
+    def get_before(self, request):
+        before = request.query_params.get(self.before_query_param)
+        if before is None:
+            return None
+        try:
+            before = int(before)
+        except ValueError:
+            raise NotFound('Invalid cursor')
+        if before < 1:
+            raise NotFound('Invalid cursor')
+        return before
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """``queryset`` must yield rows with 'id' and 'timestamp' keys; returns the page's rows, oldest first."""
+        self.request = request
+        page_size = self.get_page_size(request)
+        before = self.get_before(request)
+        if before is not None:
+            stamp = Subquery(queryset.filter(id=before).values('timestamp')[:1])
+            queryset = queryset.filter(Q(timestamp__lt=stamp) | Q(timestamp=stamp, id__lt=before))
+        rows = list(queryset.order_by('-timestamp', '-id')[:page_size + 1])
+        page = rows[:page_size]
+        self.next_before = page[-1]['id'] if len(rows) > page_size else None
+        page.reverse()
+        return page
+
+    def get_next_link(self):
+        if self.next_before is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.before_query_param, self.next_before)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
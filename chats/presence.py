@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.cache import cache
+
+# Who is online in a room lives in the cache with a TTL; typing state is only
+# ever relayed over the channel layer. Neither touches the database.
+
+
+def presence_ttl():
+    return getattr(settings, 'CHAT_PRESENCE_TTL', 60)
+
+
+def presence_key(room_id, user_id):
+    return f'chat:presence:{room_id}:{user_id}'
+
+
+async def join(room_id, user_id):
+    """Count one more open socket for the user in the room. True when they have just come online."""
+    key, ttl = presence_key(room_id, user_id), presence_ttl()
+    if await cache.aadd(key, 1, timeout=ttl):
+        return True
+    try:
+        await cache.aincr(key)
+    except ValueError:  # expired between add and incr
+        await cache.aset(key, 1, timeout=ttl)
+        return True
+    await cache.atouch(key, ttl)
+    return False
+
+
+async def leave(room_id, user_id):
+    """One socket fewer. True when it was the user's last one in the room."""
+    key = presence_key(room_id, user_id)
+    try:
+        remaining = await cache.adecr(key)
+    except ValueError:
+        return True
+    if remaining <= 0:
+        await cache.adelete(key)
+        return True
+    return False
+
+
+async def refresh(room_id, user_id):
+    """Keep the user's entry alive. True when it had already expired, i.e. they are back online."""
+    key, ttl = presence_key(room_id, user_id), presence_ttl()
+    if await cache.atouch(key, ttl):
+        return False
+    return await cache.aadd(key, 1, timeout=ttl)
+
+
+async def online(room_id, user_ids):
+    found = await cache.aget_many([presence_key(room_id, user_id) for user_id in user_ids])
+    return [user_id for user_id in user_ids if found.get(presence_key(room_id, user_id))]
+
+
+async def online_in(rooms):
+    """online() for many (room id, member ids) pairs in one cache round trip: {room id: [online ids]}."""
+    found = await cache.aget_many([presence_key(room_id, user_id) for room_id, user_ids in rooms for user_id in user_ids])
+    return {
+        room_id: [user_id for user_id in user_ids if found.get(presence_key(room_id, user_id))]
+        for room_id, user_ids in rooms
+    }
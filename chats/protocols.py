@@ -0,0 +1,130 @@
+import json
+import zlib
+
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:  # only clients that ask for a binary subprotocol need it
+    msgpack = None
+
+# Frame keys as sent in the binary protocols; anything missing here goes out as is
+SHORT_KEYS = {
+    'type': 't',
+    'room': 'rm',
+    'message': 'm',
+    'client_id': 'c',
+    'sender': 's',
+    'timestamp': 'ts',
+    'user': 'u',
+    'online': 'o',
+    'typing': 'y',
+    'reader': 'r',
+    'message_id': 'i',
+    'read_only': 'ro',
+}
+LONG_KEYS = {short: key for key, short in SHORT_KEYS.items()}
+
+DEFLATE_TAIL = b'\x00\x00\xff\xff'
+
+
+class Stamp(str):
+    """A timestamp as JSON clients have always received it, carrying its epoch milliseconds for the binary protocols."""
+
+    def __new__(cls, text, epoch_ms):
+        stamp = super().__new__(cls, text)
+        stamp.epoch_ms = epoch_ms
+        return stamp
+
+
+def epoch_ms(value):
+    return int(value.timestamp() * 1000)
+
+
+class JSONCodec:
+    """Text frames of JSON: the default, and what clients that ask for no subprotocol get."""
+    subprotocol = None
+
+    def encode(self, frame):
+        return {'text_data': json.dumps(frame)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class NamedJSONCodec(JSONCodec):
+    subprotocol = 'collegefied.json'
+
+
+class MsgpackCodec:
+    """
+    Binary frames of msgpack with short keys (SHORT_KEYS) and timestamps as
+    integer epoch milliseconds. Text frames from the client are still read as
+    JSON.
+    """
+    subprotocol = 'collegefied.msgpack'
+
+    def encode(self, frame):
+        packed = msgpack.packb({
+            SHORT_KEYS.get(key, key): value.epoch_ms if isinstance(value, Stamp) else value
+            for key, value in frame.items()
+        })
+        return {'bytes_data': self.compress(packed)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return json.loads(text_data)
+        try:
+            event = msgpack.unpackb(self.decompress(bytes_data))
+        except (msgpack.UnpackException, zlib.error) as exc:
+            raise ValueError(str(exc))
+        if isinstance(event, dict):
+            return {LONG_KEYS.get(key, key): value for key, value in event.items()}
+        return event
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+
+class DeflateMsgpackCodec(MsgpackCodec):
+    """
+    msgpack frames, each deflated the way permessage-deflate does it: one
+    compression context per direction for the life of the connection, flushed
+    with Z_SYNC_FLUSH and the trailing 00 00 ff ff left off. Keeping the
+    context means the repeated keys and names in small frames compress too.
+    Done in the app since the ASGI servers we run on do not negotiate the
+    permessage-deflate extension themselves.
+    """
+    subprotocol = 'collegefied.msgpack+deflate'
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        self.decompressor = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+
+    def compress(self, data):
+        deflated = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return deflated[:-len(DEFLATE_TAIL)]
+
+    def decompress(self, data):
+        limit = getattr(settings, 'CHAT_MAX_FRAME_BYTES', 64 * 1024)
+        inflated = self.decompressor.decompress(data + DEFLATE_TAIL, limit)
+        if self.decompressor.unconsumed_tail:
+            raise ValueError("Frame inflates past CHAT_MAX_FRAME_BYTES.")
+        return inflated
+
+
+CODECS = {NamedJSONCodec.subprotocol: NamedJSONCodec}
+if msgpack is not None:
+    CODECS[MsgpackCodec.subprotocol] = MsgpackCodec
+    CODECS[DeflateMsgpackCodec.subprotocol] = DeflateMsgpackCodec
+
+
+def negotiate(requested):
+    """A codec for the first subprotocol the client asked for that we speak; JSON when there is none."""
+    for name in requested or ():
+        if name in CODECS:
+            return CODECS[name]()
+    return JSONCodec()
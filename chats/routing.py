@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
   path('ws/chat/<str:group_name>/', consumers.ChatConsumer.as_asgi()),
+  path('ws/chats/', consumers.UserChatConsumer.as_asgi()),
 ]
\ No newline at end of file
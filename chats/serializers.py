@@ -1,39 +1,54 @@
 from rest_framework import serializers
 from .models import ChatRoom, Message
-from api.models import ProductRequest
 
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
-        fields = ['id', 'sender', 'content', 'timestamp']
+        fields = ['id', 'client_id', 'sender', 'content', 'timestamp']
+
+    @staticmethod
+    def rows(values):
+        """Represent .values() rows exactly as the serializer would, without a field pass per message."""
+        timestamp = serializers.DateTimeField()
+        return [
+            {
+                'id': row['id'],
+                'client_id': row['client_id'],
+                'sender': row['sender_id'],
+                'content': row['content'],
+                'timestamp': timestamp.to_representation(row['timestamp']),
+            }
+            for row in values
+        ]
     
 class ChatRoomSerializer(serializers.ModelSerializer):
-    messages = MessageSerializer(many=True, read_only=True)
-    buyer_uname = serializers.SerializerMethodField()
-    seller_uname = serializers.SerializerMethodField()
-    product_name = serializers.SerializerMethodField()
+    """An inbox entry. Reads the annotations from chats.inbox.inbox_for, so it costs no queries per room."""
+    buyer_uname = serializers.ReadOnlyField()
+    seller_uname = serializers.ReadOnlyField()
+    product_name = serializers.ReadOnlyField()
     group_name = serializers.SerializerMethodField()
-    request_id = serializers.SerializerMethodField()
+    request_id = serializers.ReadOnlyField()
+    last_message = serializers.SerializerMethodField()
+    unread_count = serializers.ReadOnlyField()
+    last_read_id = serializers.ReadOnlyField()
+    counterparty_last_read_id = serializers.ReadOnlyField()
+    counterparty = serializers.ReadOnlyField(source='counterparty_id')
+    counterparty_name = serializers.ReadOnlyField()
 
 
     class Meta:
         model = ChatRoom
-        fields = ['id', 'buyer','buyer_uname', 'seller','seller_uname','product','request_id','product_name','group_name','created_at', 'is_active','messages']
-
-    def get_buyer_uname(self,obj):
-        return obj.buyer.username if obj.buyer else None
-
-    def get_seller_uname(self,obj):
-        return obj.seller.username if obj.seller else None
-    
-    def get_product_name(self,obj):
-        return obj.product.title if obj.product else None
-
-    def get_request_id(self, obj):
-        request = ProductRequest.objects.filter(product=obj.product).first()
-        if request:
-            return request.id
-        return None
+        fields = ['id', 'buyer','buyer_uname', 'seller','seller_uname','product','request_id','product_name','group_name','created_at', 'is_active',
+                  'last_message', 'unread_count', 'last_read_id', 'counterparty', 'counterparty_name', 'counterparty_last_read_id']
+
+    def get_last_message(self, obj):
+        if obj.last_message_at is None:
+            return None
+        return {
+            'content': obj.last_message_preview,
+            'sender': obj.last_message_sender_id,
+            'timestamp': serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
 
     def get_group_name(self, obj):
         if obj.id:  # ChatRoom khud ka id hai
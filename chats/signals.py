@@ -0,0 +1,31 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ChatRoom
+from .utils import rooms_changed
+
+
+# What chats.utils.RoomAccess holds besides the id; saves that change none of it are not announced
+ACCESS_FIELDS = ('buyer_id', 'seller_id', 'is_active')
+
+
+@receiver(post_save, sender=ChatRoom)
+def announce_room_change(sender, instance, created, **kwargs):
+    # Covers create_chat_room (new or reactivated rooms) and deactivate_chat_room:
+    # the cached access goes, and the members' user sockets (un)subscribe
+    loaded = getattr(instance, '_loaded_values', None)
+    if created or loaded is None:
+        rooms_changed([(instance.pk, instance.buyer_id, instance.seller_id)])
+        return
+    # A field that was not loaded counts as changed
+    if all(field in loaded and loaded[field] == getattr(instance, field) for field in ACCESS_FIELDS):
+        return
+    rooms = {(instance.pk, instance.buyer_id, instance.seller_id)}
+    # Members that were moved out of the room have to drop it too
+    rooms.add((instance.pk, loaded.get('buyer_id', instance.buyer_id), loaded.get('seller_id', instance.seller_id)))
+    rooms_changed(rooms)
+
+
+@receiver(post_delete, sender=ChatRoom)
+def announce_room_delete(sender, instance, **kwargs):
+    rooms_changed([(instance.pk, instance.buyer_id, instance.seller_id)])
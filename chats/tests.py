@@ -1,3 +1,574 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import IntegrityError, transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from django.core.cache import cache as default_cache
+from django.core.management import call_command
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import User, Category, Product
+from .benchmarks import count_queries
+from .protocols import DeflateMsgpackCodec, JSONCodec, MsgpackCodec, Stamp, epoch_ms
+from .middleware import JWTAuthMiddleware, JWTAuthMiddlewareStack, socket_token_cache
+from .models import ChatRoom, Message
+from .routing import websocket_urlpatterns
+from .utils import create_chat_room, deactivate_chat_room
+from .writer import MessageWriter
+
+
+def make_user(username):
+    return User.objects.create_user(
+        email=f"{username}@kiet.edu", username=username, password="pass1234", is_email_verified=True
+    )
+
+
+def make_room():
+    seller, buyer = make_user("seller"), make_user("buyer")
+    category = Category.objects.create(name="Books", slug="books")
+    product = Product.objects.create(title="Book", description="Used", price="10.00", seller=seller, category=category)
+    return ChatRoom.objects.create(product=product, buyer=buyer, seller=seller)
+
+
+class ChatSocketTestCase(TransactionTestCase):
+    """Sockets resolve users and rooms in worker threads, so the data has to be committed."""
+
+    def setUp(self):
+        socket_token_cache().clear()
+        default_cache.clear()
+        self.application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        self.room = make_room()
+
+    def communicator(self, user, room=None, token=None, subprotocols=None):
+        token = token or str(AccessToken.for_user(user))
+        room = room or self.room
+        return WebsocketCommunicator(self.application, f"/ws/chat/chat_{room.id}/?token={token}", subprotocols=subprotocols)
+
+    async def join(self, *users):
+        """Connect one socket per user and read past the frames sent on joining (status, presence)."""
+        sockets = [self.communicator(user) for user in users]
+        for socket in sockets:
+            await socket.connect()
+        for socket in sockets:
+            while not await socket.receive_nothing(timeout=0.05):
+                await socket.receive_json_from()
+        return sockets
+
+
+class JWTHandshakeTests(ChatSocketTestCase):
+    async def test_valid_token_connects_and_is_cached(self):
+        tokens = socket_token_cache()
+        token = str(AccessToken.for_user(self.room.buyer))
+        for expected_hits in (0, 1):
+            socket = self.communicator(self.room.buyer, token=token)
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            self.assertEqual((await socket.receive_json_from())['type'], 'info')
+            self.assertEqual(tokens.hits, expected_hits)
+            await socket.disconnect()
+
+    async def test_bad_token_is_rejected(self):
+        socket = self.communicator(self.room.buyer, token="not-a-token")
+        connected, _ = await socket.connect()
+        self.assertFalse(connected)
+
+    async def test_a_failed_user_lookup_is_not_shared(self):
+        from . import middleware
+
+        calls = []
+
+        async def get_user(user_id):
+            calls.append(user_id)
+            await asyncio.sleep(0.01)
+            if len(calls) == 1:
+                raise RuntimeError("database went away")
+            return self.room.buyer
+
+        auth = JWTAuthMiddleware(None)
+        with mock.patch.object(auth, 'get_user', get_user):
+            first, second = await asyncio.gather(
+                auth.get_cached_user(self.room.buyer_id), auth.get_cached_user(self.room.buyer_id),
+                return_exceptions=True,
+            )
+        self.assertIsInstance(first, RuntimeError)
+        self.assertEqual(second, self.room.buyer)  # retried on its own
+        self.assertEqual(middleware._pending_users, {})
+
+    async def test_deactivated_user_is_rejected_by_every_worker(self):
+        socket = self.communicator(self.room.buyer)
+        self.assertTrue((await socket.connect())[0])
+        await socket.disconnect()
+        # Another worker deactivates the user; this worker's token cache still knows the token
+        buyer = self.room.buyer
+        buyer.is_active = False
+        await sync_to_async(buyer.save)()
+        socket = self.communicator(buyer)
+        self.assertFalse((await socket.connect())[0])
+
+
+class MessageWriterTests(ChatSocketTestCase):
+    async def test_messages_are_broadcast_then_stored_in_order(self):
+        buyer, seller = await self.join(self.room.buyer, self.room.seller)
+
+        for i in range(5):
+            await buyer.send_json_to({'message': f"offer {i}"})
+        received = [(await seller.receive_json_from())['message'] for _ in range(5)]
+        self.assertEqual(received, [f"offer {i}" for i in range(5)])
+
+        # Disconnecting flushes whatever the writer still holds
+        await buyer.disconnect()
+        await seller.disconnect()
+        stored = await sync_to_async(list)(Message.objects.filter(chat_room=self.room).order_by('id'))
+        self.assertEqual([message.content for message in stored], received)
+        self.assertEqual(sorted(stored, key=lambda message: message.timestamp), stored)
+
+    async def test_live_frames_carry_the_client_id(self):
+        buyer, seller = await self.join(self.room.buyer, self.room.seller)
+
+        await buyer.send_json_to({'message': "still available?", 'client_id': "tab-1:7"})
+        await buyer.send_json_to({'message': "hello?"})
+        first, second = [await seller.receive_json_from() for _ in range(2)]
+        self.assertEqual(first['client_id'], "tab-1:7")
+        self.assertTrue(second['client_id'])  # one is made up when the client sends none
+        self.assertEqual([(await buyer.receive_json_from())['client_id'] for _ in range(2)], ["tab-1:7", second['client_id']])
+
+        await buyer.send_json_to({'message': "x", 'client_id': "x" * 65})
+        self.assertEqual((await buyer.receive_json_from())['type'], 'error')
+
+        await buyer.disconnect()
+        await seller.disconnect()
+        stored = await sync_to_async(list)(Message.objects.order_by('id').values_list('client_id', flat=True))
+        self.assertEqual(stored, ["tab-1:7", second['client_id']])
+
+    def test_batches_are_bounded(self):
+        writer = MessageWriter(batch_size=100, interval=5)
+        self.addCleanup(writer.close)
+        for i in range(250):
+            writer.submit(self.room.id, self.room.buyer_id, f"message {i}")
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(writer.written, 250)
+        self.assertEqual(writer.batches, 3)
+        contents = list(Message.objects.order_by('id').values_list('content', flat=True))
+        self.assertEqual(contents, [f"message {i}" for i in range(250)])
+
+    def test_rooms_get_their_last_message(self):
+        writer = MessageWriter(interval=5)
+        self.addCleanup(writer.close)
+        room = self.room
+        for sender, content in [(room.buyer_id, "hi"), (room.buyer_id, "still there?"), (room.seller_id, "yes")]:
+            writer.submit(room.id, sender, content)
+        writer.flush(timeout=10)
+        room.refresh_from_db()
+        self.assertEqual((room.last_message_preview, room.last_message_sender_id), ("yes", room.seller_id))
+
+    def test_a_newer_summary_from_another_writer_is_kept(self):
+        writer = MessageWriter(interval=5)
+        self.addCleanup(writer.close)
+        message = writer.submit(self.room.id, self.room.buyer_id, "sent first")
+        ChatRoom.objects.filter(pk=self.room.pk).update(
+            last_message_preview="sent second", last_message_at=message.timestamp + timedelta(milliseconds=10)
+        )
+        writer.flush(timeout=10)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_message_preview, "sent second")
+
+    def test_close_drains_the_queue(self):
+        writer = MessageWriter(interval=5)
+        writer.submit(self.room.id, self.room.buyer_id, "last words")
+        writer.close()
+        self.assertTrue(Message.objects.filter(content="last words").exists())
+        # Nothing is written on the caller's thread afterwards
+        with self.assertLogs('chats.writer', 'WARNING'):
+            self.assertIsNone(writer.submit(self.room.id, self.room.buyer_id, "too late"))
+        self.assertFalse(Message.objects.filter(content="too late").exists())
+
+
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.room = make_room()
+        self.client = APIClient()
+        self.client.force_authenticate(self.room.buyer)
+        Message.objects.bulk_create([
+            Message(chat_room=self.room, sender=self.room.buyer, content=f"message {i}") for i in range(7)
+        ])
+        self.url = reverse('get-message', args=[self.room.id])
+
+    def test_pages_walk_back_from_the_newest(self):
+        seen = []
+        url = self.url + '?page_size=3'
+        while url:
+            with self.assertNumQueries(2):  # the membership check and one page
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            contents = [row['content'] for row in response.data['results']]
+            self.assertEqual(contents, sorted(contents))  # chronological within a page
+            seen = contents + seen
+            url = response.data['next']
+        self.assertEqual(seen, [f"message {i}" for i in range(7)])
+
+    def test_pages_follow_receive_order_across_writers(self):
+        # Another worker's writer stored an earlier message after these ones
+        now = timezone.now()
+        Message.objects.filter(chat_room=self.room).update(timestamp=now)
+        late = Message.objects.create(
+            chat_room=self.room, sender=self.room.seller, content="received first", timestamp=now - timedelta(seconds=1)
+        )
+        seen = []
+        url = self.url + '?page_size=3'
+        while url:
+            response = self.client.get(url)
+            seen = [row['id'] for row in response.data['results']] + seen
+            url = response.data['next']
+        self.assertEqual(seen[0], late.id)
+        self.assertEqual(sorted(seen[1:]), seen[1:])
+        self.assertEqual(len(seen), 8)
+
+    def test_rows_match_the_serializer(self):
+        from .serializers import MessageSerializer
+
+        response = self.client.get(self.url)
+        newest = Message.objects.order_by('-id').first()
+        self.assertEqual(response.data['results'][-1], MessageSerializer(newest).data)
+        self.assertIsNone(response.data['next'])
+
+    def test_access(self):
+        self.assertEqual(self.client.get(self.url + '?before=abc').status_code, 404)
+        self.client.force_authenticate(make_user("stranger"))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.get(reverse('get-message', args=[self.room.id + 1])).status_code, 404)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        self.room = make_room()
+        self.client = APIClient()
+        self.client.force_authenticate(self.room.seller)
+        self.url = reverse('get-active-chats')
+
+    def add_room(self, name):
+        buyer = make_user(name)
+        return ChatRoom.objects.create(product=self.room.product, buyer=buyer, seller=self.room.seller)
+
+    def test_only_the_callers_rooms_most_recent_first(self):
+        from django.utils import timezone
+
+        other = self.add_room("other_buyer")
+        ChatRoom.objects.create(product=self.room.product, buyer=make_user("outsider"), seller=make_user("seller2"))
+        Message.objects.bulk_create([Message(chat_room=other, sender=other.buyer, content="deal?") for _ in range(3)])
+        Message.objects.create(chat_room=other, sender=self.room.seller, content="mine, not unread")
+        ChatRoom.objects.filter(pk=other.pk).update(
+            last_message_preview="deal?", last_message_sender=other.buyer, last_message_at=timezone.now()
+        )
+        for i in range(5):
+            self.add_room(f"buyer{i}")
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 7)
+        first = response.data[0]
+        self.assertEqual(first['id'], other.id)
+        self.assertEqual(first['unread_count'], 3)
+        self.assertEqual(first['last_message']['content'], "deal?")
+        self.assertEqual((first['counterparty'], first['counterparty_name']), (other.buyer_id, "other_buyer"))
+
+    def test_opening_a_room_marks_it_read(self):
+        message = Message.objects.create(chat_room=self.room, sender=self.room.buyer, content="hello")
+        self.assertEqual(self.client.get(self.url).data[0]['unread_count'], 1)
+        self.client.get(reverse('get-message', args=[self.room.id]))
+        entry = self.client.get(self.url).data[0]
+        self.assertEqual((entry['unread_count'], entry['last_read_id']), (0, message.id))
+
+        # The buyer sees how far the seller has read
+        self.client.force_authenticate(self.room.buyer)
+        response = self.client.get(reverse('get-message', args=[self.room.id]))
+        self.assertEqual(response.data['counterparty_last_read_id'], message.id)
+
+    def test_read_endpoint_only_moves_forward(self):
+        first, second = [
+            Message.objects.create(chat_room=self.room, sender=self.room.buyer, content=text) for text in ("a", "b")
+        ]
+        url = reverse('read-messages', args=[self.room.id])
+        self.assertEqual(self.client.post(url, {'message_id': second.id}).data['last_read_id'], second.id)
+        self.assertEqual(self.client.post(url, {'message_id': first.id}).data['last_read_id'], second.id)
+        # Ids past the end of the room snap back to its last message
+        self.assertEqual(self.client.post(url, {'message_id': second.id + 100}).data['last_read_id'], second.id)
+        self.assertEqual(self.client.post(url, {'message_id': 'x'}).status_code, 400)
+
+    def test_reading_a_message_covers_those_received_before_it(self):
+        now = timezone.now()
+        seen = Message.objects.create(chat_room=self.room, sender=self.room.buyer, content="b", timestamp=now)
+        # Received earlier, but stored after it by another worker's writer
+        earlier = Message.objects.create(
+            chat_room=self.room, sender=self.room.buyer, content="a", timestamp=now - timedelta(seconds=1)
+        )
+        url = reverse('read-messages', args=[self.room.id])
+        self.assertEqual(self.client.post(url, {'message_id': seen.id}).data['last_read_id'], earlier.id)
+
+    def test_rebuild_command_fills_previews(self):
+        Message.objects.create(chat_room=self.room, sender=self.room.buyer, content="x" * 300)
+        call_command('rebuild_chat_inbox', stdout=open(os.devnull, 'w'))
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_message_preview, "x" * 255)
+        self.assertEqual(self.room.last_message_sender_id, self.room.buyer_id)
+
+
+class ReadReceiptTests(ChatSocketTestCase):
+    async def test_a_scroll_burst_is_one_write_and_one_receipt(self):
+        messages = await sync_to_async(lambda: [
+            Message.objects.create(chat_room=self.room, sender=self.room.buyer, content=f"m{i}") for i in range(20)
+        ])()
+        buyer, seller = await self.join(self.room.buyer, self.room.seller)
+
+        for message in messages:
+            await seller.send_json_to({'type': 'read', 'message_id': message.id})
+        receipt = await buyer.receive_json_from(timeout=3)
+        self.assertEqual(receipt, {'type': 'read', 'reader': self.room.seller_id, 'message_id': messages[-1].id})
+        self.assertTrue(await buyer.receive_nothing(timeout=0.7))
+
+        # A read without an id covers the messages delivered live, before they had one
+        await buyer.send_json_to({'message': "one more"})
+        for socket in (buyer, seller):
+            await socket.receive_json_from()
+        await seller.send_json_to({'type': 'read'})
+        receipt = await buyer.receive_json_from(timeout=3)
+        newest = await sync_to_async(lambda: Message.objects.latest('id').id)()
+        self.assertEqual(receipt['message_id'], newest)
+
+        await buyer.disconnect()
+        await seller.disconnect()
+        room = await sync_to_async(ChatRoom.objects.get)(pk=self.room.pk)
+        self.assertEqual(room.seller_last_read_id, newest)
+
+
+class PresenceTests(ChatSocketTestCase):
+    async def test_joining_and_leaving(self):
+        buyer = self.communicator(self.room.buyer)
+        await buyer.connect()
+        self.assertEqual((await buyer.receive_json_from())['type'], 'info')
+        self.assertEqual(await buyer.receive_json_from(), {'type': 'presence_state', 'online': [self.room.buyer_id]})
+
+        seller = self.communicator(self.room.seller)
+        await seller.connect()
+        await seller.receive_json_from()
+        state = await seller.receive_json_from()
+        self.assertEqual(sorted(state['online']), sorted([self.room.buyer_id, self.room.seller_id]))
+        self.assertEqual(await buyer.receive_json_from(), {'type': 'presence', 'user': self.room.seller_id, 'online': True})
+
+        # A second tab keeps the seller online until the last one closes
+        (second_tab,) = await self.join(self.room.seller)
+        self.assertTrue(await buyer.receive_nothing(timeout=0.1))
+        await seller.disconnect()
+        self.assertTrue(await buyer.receive_nothing(timeout=0.1))
+        await second_tab.disconnect()
+        self.assertEqual(await buyer.receive_json_from(), {'type': 'presence', 'user': self.room.seller_id, 'online': False})
+        await buyer.disconnect()
+
+    async def test_typing_is_coalesced_and_never_queries(self):
+        buyer, seller = await self.join(self.room.buyer, self.room.seller)
+        with count_queries() as queries:
+            for _ in range(20):
+                await seller.send_json_to({'type': 'typing'})
+                await seller.send_json_to({'type': 'ping'})
+            await seller.send_json_to({'type': 'typing', 'typing': False})
+            await seller.send_json_to({'type': 'typing', 'typing': False})
+            frames = []
+            while not await buyer.receive_nothing(timeout=0.1):
+                frames.append(await buyer.receive_json_from())
+        self.assertEqual(queries.count, 0)
+        self.assertEqual([frame['typing'] for frame in frames], [True, False])
+        self.assertTrue(await seller.receive_nothing(timeout=0.05))  # nothing echoed back
+        await buyer.disconnect()
+        await seller.disconnect()
+
+
+class BinaryProtocolTests(ChatSocketTestCase):
+    async def test_msgpack_deflate_frames(self):
+        (buyer,) = await self.join(self.room.buyer)
+        mobile = self.communicator(self.room.seller, subprotocols=['unknown', 'collegefied.msgpack+deflate'])
+        connected, subprotocol = await mobile.connect()
+        self.assertEqual(subprotocol, 'collegefied.msgpack+deflate')
+        deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        inflate = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+
+        async def receive():
+            output = await mobile.receive_output()
+            return msgpack.unpackb(inflate.decompress(output['bytes'] + b'\x00\x00\xff\xff'))
+
+        self.assertEqual((await receive())['t'], 'info')
+        self.assertEqual((await receive())['t'], 'presence_state')
+        await buyer.receive_json_from()  # the seller came online
+
+        packed = msgpack.packb({'m': "is it still available?"})
+        await mobile.send_to(bytes_data=(deflate.compress(packed) + deflate.flush(zlib.Z_SYNC_FLUSH))[:-4])
+        frame = await receive()
+        text = await buyer.receive_json_from()
+        self.assertEqual(frame['m'], text['message'])
+        self.assertEqual(frame['s'], text['sender'])
+        # Same instant: epoch milliseconds for msgpack, the usual string for JSON
+        self.assertEqual(frame['ts'], epoch_ms(datetime.fromisoformat(text['timestamp'])))
+
+        await mobile.disconnect()
+        await buyer.disconnect()
+
+    async def test_json_stays_the_default(self):
+        socket = self.communicator(self.room.buyer, subprotocols=['v2.unknown'])
+        connected, subprotocol = await socket.connect()
+        self.assertTrue(connected)
+        self.assertIsNone(subprotocol)
+        self.assertEqual(json.loads(await socket.receive_from())['type'], 'info')
+        await socket.disconnect()
+
+    def test_stamps_encode_as_before_in_json(self):
+        stamp = Stamp("2026-01-02 03:04:05.678000+00:00", 1767323045678)
+        self.assertEqual(JSONCodec().encode({'timestamp': stamp}), {'text_data': '{"timestamp": "2026-01-02 03:04:05.678000+00:00"}'})
+        self.assertEqual(msgpack.unpackb(MsgpackCodec().encode({'timestamp': stamp})['bytes_data']), {'ts': 1767323045678})
+
+    def test_oversized_deflate_frames_are_refused(self):
+        deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        bomb = (deflate.compress(b'\x00' * (1024 * 1024)) + deflate.flush(zlib.Z_SYNC_FLUSH))[:-4]
+        with self.assertRaises(ValueError):
+            DeflateMsgpackCodec().decode(bytes_data=bomb)
+
+
+class RoomAccessTests(ChatSocketTestCase):
+    async def test_reconnects_do_not_query(self):
+        (socket,) = await self.join(self.room.buyer)
+        await socket.disconnect()
+        with count_queries() as queries:
+            (socket,) = await self.join(self.room.buyer)
+        self.assertEqual(queries.count, 0)
+        await socket.disconnect()
+
+    async def test_deactivating_and_reopening_take_effect_at_once(self):
+        (socket,) = await self.join(self.room.buyer)
+        await socket.disconnect()
+        room = self.room
+        await sync_to_async(deactivate_chat_room)(room.product, room.buyer, room.seller)
+        connected, _ = await self.communicator(room.buyer).connect()
+        self.assertFalse(connected)
+
+        await sync_to_async(create_chat_room)(room.product, room.buyer, room.seller)
+        (socket,) = await self.join(room.buyer)
+        await socket.disconnect()
+
+    async def test_rooms_created_after_a_miss_can_be_joined(self):
+        room = self.room
+        connected, _ = await self.communicator(room.buyer, room=ChatRoom(id=room.id + 1)).connect()
+        self.assertFalse(connected)
+        buyer = await sync_to_async(make_user)("second_buyer")
+        other = await sync_to_async(create_chat_room)(room.product, buyer, room.seller)
+        self.assertEqual(other.id, room.id + 1)
+        connected, _ = await self.communicator(room.seller, room=other).connect()
+        self.assertTrue(connected)
+
+    def test_only_access_changes_are_announced(self):
+        room = ChatRoom.objects.get(pk=self.room.pk)
+        with mock.patch('chats.utils.get_channel_layer') as layer:
+            layer.return_value.group_send = mock.AsyncMock()
+            room.last_message_preview = "hello"
+            room.save()
+            layer.assert_not_called()
+            deactivate_chat_room(room.product, room.buyer, room.seller)
+            layer.assert_called()
+
+    def test_a_failing_channel_layer_is_logged(self):
+        room = self.room
+        with mock.patch('chats.utils.get_channel_layer', side_effect=RuntimeError), self.assertLogs('chats.utils', 'ERROR'):
+            deactivate_chat_room(room.product, room.buyer, room.seller)
+        room.refresh_from_db()
+        self.assertFalse(room.is_active)
+
+    def test_one_room_per_product_buyer_and_seller(self):
+        room = self.room
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ChatRoom.objects.create(product=room.product, buyer=room.buyer, seller=room.seller)
+        self.assertEqual(create_chat_room(room.product, room.buyer, room.seller), room)
+
+
+class UserSocketTests(ChatSocketTestCase):
+    def user_socket(self, user):
+        return WebsocketCommunicator(self.application, f"/ws/chats/?token={AccessToken.for_user(user)}")
+
+    def add_room(self, buyer_name, is_active=True):
+        room = self.room
+        buyer = make_user(buyer_name)
+        return ChatRoom.objects.create(product=room.product, buyer=buyer, seller=room.seller, is_active=is_active)
+
+    async def test_one_socket_carries_every_active_room(self):
+        other = await sync_to_async(self.add_room)("buyer_two")
+        await sync_to_async(self.add_room)("buyer_closed", is_active=False)
+        seller = self.user_socket(self.room.seller)
+        connected, _ = await seller.connect()
+        self.assertTrue(connected)
+        rooms = await seller.receive_json_from()
+        self.assertEqual(rooms['type'], 'rooms')
+        self.assertEqual([entry['room'] for entry in rooms['rooms']], [self.room.id, other.id])
+        self.assertEqual(rooms['rooms'][0]['online'], [self.room.seller_id])
+
+        (buyer,) = await self.join(self.room.buyer)
+        self.assertEqual(await seller.receive_json_from(), {'room': self.room.id, 'type': 'presence', 'user': self.room.buyer_id, 'online': True})
+        await buyer.send_json_to({'message': "hello"})
+        frame = await seller.receive_json_from()
+        self.assertEqual((frame['room'], frame['message']), (self.room.id, "hello"))
+
+        await seller.send_json_to({'room': self.room.id, 'message': "hi back"})
+        self.assertEqual((await buyer.receive_json_from())['message'], "hello")
+        self.assertEqual((await buyer.receive_json_from())['message'], "hi back")
+        self.assertEqual((await seller.receive_json_from())['message'], "hi back")
+
+        await seller.send_json_to({'room': 999, 'message': "nope"})
+        self.assertEqual((await seller.receive_json_from())['type'], 'error')
+
+        await buyer.disconnect()
+        await seller.disconnect()
+        stored = await sync_to_async(list)(Message.objects.filter(chat_room=self.room).values_list('content', flat=True))
+        self.assertEqual(sorted(stored), ["hello", "hi back"])
+
+    async def test_rooms_follow_accepts_and_rejections(self):
+        seller = self.user_socket(self.room.seller)
+        await seller.connect()
+        await seller.receive_json_from()
+
+        buyer = await sync_to_async(make_user)("late_buyer")
+        room = await sync_to_async(create_chat_room)(self.room.product, buyer, self.room.seller)
+        opened = await seller.receive_json_from()
+        self.assertEqual((opened['type'], opened['room']), ('room_opened', room.id))
+
+        await sync_to_async(deactivate_chat_room)(self.room.product, buyer, self.room.seller)
+        self.assertEqual(await seller.receive_json_from(), {'type': 'room_closed', 'room': room.id})
+        await seller.send_json_to({'room': room.id, 'message': "too late"})
+        self.assertEqual((await seller.receive_json_from())['type'], 'error')
+        await seller.disconnect()
+
+    async def test_a_ping_keeps_every_room_online(self):
+        from . import presence
+
+        other = await sync_to_async(self.add_room)("buyer_two")
+        with self.settings(CHAT_PRESENCE_TTL=0.3):
+            seller = self.user_socket(self.room.seller)
+            await seller.connect()
+            await seller.receive_json_from()
+            await asyncio.sleep(0.35)  # every entry has expired
+            await seller.send_json_to({'type': 'ping'})
+            self.assertTrue(await seller.receive_nothing(timeout=0.05))
+            for room in (self.room, other):
+                self.assertEqual(await presence.online(room.id, [room.seller_id]), [room.seller_id])
+            await seller.disconnect()
+
+    async def test_anonymous_sockets_are_refused(self):
+        connected, _ = await WebsocketCommunicator(self.application, "/ws/chats/?token=bad").connect()
+        self.assertFalse(connected)
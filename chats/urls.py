@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import ChatRoomListView,MessageListView
+from .views import ChatRoomListView,MessageListView,MessageReadView
 
 
 urlpatterns = [
     path('message/<int:pk>/',MessageListView.as_view(),name='get-message'),
+    path('message/<int:pk>/read/',MessageReadView.as_view(),name='read-messages'),
     path('chats/',ChatRoomListView.as_view(),name='get-active-chats')
 ]
\ No newline at end of file
@@ -1,8 +1,102 @@
+import logging
+from collections import namedtuple
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
 from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+# What a socket needs to know to join a room
+RoomAccess = namedtuple('RoomAccess', ['id', 'buyer_id', 'seller_id', 'is_active'])
+NO_ROOM = 'missing'
+
+
+def room_access_key(room_id):
+    return f'chat:room:{room_id}'
+
+
+def get_room_access(room_id):
+    """
+    The room's members and active flag, or None when there is no such room.
+    Cached for CHAT_ROOM_ACCESS_TTL seconds, rooms that do not exist included;
+    chats.signals drops the entry whenever a room is saved or deleted.
+    """
+    key = room_access_key(room_id)
+    access = cache.get(key)
+    if access is None:
+        ChatRoom = apps.get_model('chats', 'ChatRoom')
+        row = ChatRoom.objects.filter(pk=room_id).values_list('id', 'buyer_id', 'seller_id', 'is_active').first()
+        access = RoomAccess(*row) if row else NO_ROOM
+        cache.set(key, access, timeout=getattr(settings, 'CHAT_ROOM_ACCESS_TTL', 300))
+    return None if access == NO_ROOM else access
+
+
+async def aget_room_access(room_id):
+    access = await cache.aget(room_access_key(room_id))
+    if access is None:
+        return await database_sync_to_async(get_room_access)(room_id)
+    return None if access == NO_ROOM else access
+
+
+def forget_room_access(*room_ids):
+    cache.delete_many([room_access_key(room_id) for room_id in room_ids])
+
+
+def active_rooms_for(user_id):
+    """Every active room the user is in, in one query; their access entries are cached on the way."""
+    ChatRoom = apps.get_model('chats', 'ChatRoom')
+    rooms = [
+        RoomAccess(*row) for row in
+        ChatRoom.objects.filter(Q(buyer_id=user_id) | Q(seller_id=user_id), is_active=True)
+        .order_by('id').values_list('id', 'buyer_id', 'seller_id', 'is_active')
+    ]
+    cache.set_many(
+        {room_access_key(room.id): room for room in rooms}, timeout=getattr(settings, 'CHAT_ROOM_ACCESS_TTL', 300)
+    )
+    return rooms
+
+
+def user_group_name(user_id):
+    return f'user_{user_id}'
+
+
+def rooms_changed(rooms):
+    """
+    Drop the cached access of the given (room id, buyer id, seller id) rooms and,
+    once the change is committed, tell both members' user sockets to
+    subscribe or unsubscribe (see consumers.UserChatConsumer.room_changed).
+    The change is already committed by then, so a channel layer that fails is
+    logged rather than raised at the caller; those sockets catch up when
+    they reconnect.
+    """
+    rooms = list(rooms)
+    forget_room_access(*[room_id for room_id, _, _ in rooms])
+
+    def notify():
+        # Forget again: a socket may have re-read the old row before the commit
+        forget_room_access(*[room_id for room_id, _, _ in rooms])
+        try:
+            group_send = async_to_sync(get_channel_layer().group_send)
+            for room_id, buyer_id, seller_id in rooms:
+                for user_id in (buyer_id, seller_id):
+                    group_send(user_group_name(user_id), {'type': 'room_changed', 'room': room_id})
+        except Exception:
+            logger.exception("Could not notify the members of chat rooms %s", [room_id for room_id, _, _ in rooms])
+
+    transaction.on_commit(notify)
+
 
 def create_chat_room(product, buyer, seller):
     """
     Creates a chat room for the given product, buyer, and seller.
+    The unique (product, buyer, seller) constraint makes this safe against
+    concurrent accepts: get_or_create falls back to fetching the winner's row.
     """
     ChatRoom = apps.get_model('chats', 'ChatRoom')
     chat_room, created = ChatRoom.objects.get_or_create(
@@ -4,34 +4,91 @@ from .serializers import ChatRoomSerializer, MessageSerializer
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.core.exceptions import PermissionDenied
-from api.models import ProductRequest
+from rest_framework.exceptions import NotFound, PermissionDenied
 from django.shortcuts import render
+from django.utils import timezone
+from .inbox import advance_read_cursor, broadcast_read, cursor_field, inbox_for
+from .pagination import MessageKeysetPagination
 
 
 class ChatRoomListView(generics.ListAPIView):
-    queryset = ChatRoom.objects.all()
+    """The caller's inbox: their rooms with the last message, unread count and who they are talking to."""
     serializer_class = ChatRoomSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return inbox_for(self.request.user)
 
 class MessageListView(generics.ListAPIView):
+    """A room's history, newest page first; see MessageKeysetPagination."""
     serializer_class = MessageSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageKeysetPagination
 
     def get_queryset(self):
         pk = self.kwargs.get('pk')
         user=self.request.user
 
-        try:
-            chat_room=ChatRoom.objects.select_related('buyer','seller').get(id=pk)
-        except:
-            raise PermissionDenied("chat room does not exits")
-        
-        if user!=chat_room.buyer and user!=chat_room.seller:
-            raise PermissionError("You do not have permission to view these messages.")
-        
+        self.room = get_member_room(pk, user)
+
+        # Plain rows: the page is read straight off the (chat_room, timestamp, id) index and needs no model instances
+        return Message.objects.filter(chat_room_id=pk).values('id', 'client_id', 'sender_id', 'content', 'timestamp')
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        user_id, room = request.user.id, self.room
+        last_read = room[cursor_field(user_id, room['buyer_id'])]
+        if 'before' not in request.query_params and any(row['id'] > last_read and row['sender_id'] != user_id for row in page):
+            # Opening the room shows the newest messages, which is as good as reading them
+            cursor = advance_read_cursor(room['id'], user_id, room['buyer_id'], message_id=page[-1]['id'])
+            if cursor:
+                broadcast_read(room['id'], user_id, cursor)
+        response = self.get_paginated_response(MessageSerializer.rows(page))
+        other = room['seller_id'] if user_id == room['buyer_id'] else room['buyer_id']
+        response.data['counterparty_last_read_id'] = room[cursor_field(other, room['buyer_id'])]
+        return response
+
+
+class MessageReadView(APIView):
+    """
+    POST {"message_id": <id>} to mark a room read up to that message, or an
+    empty body to mark everything received so far as read.
+
+    The writers store messages up to CHAT_WRITE_INTERVAL after they are
+    received, in whichever worker received them, so a read that comes in
+    right behind a live message may not cover it yet. The cursor then stops
+    at the last stored message and catches up with the next read.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, pk):
+        room = get_member_room(pk, request.user)
+        message_id = request.data.get('message_id')
+        read_at = None
+        if message_id is None:
+            read_at = timezone.now()
+        else:
+            try:
+                message_id = int(message_id)
+            except (TypeError, ValueError):
+                return Response({'message_id': 'A valid integer is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # print(f"Fetching messages for chat_room_id={pk}")
+        cursor = advance_read_cursor(room['id'], request.user.id, room['buyer_id'], message_id, read_at)
+        if cursor:
+            broadcast_read(room['id'], request.user.id, cursor)
+        return Response({'last_read_id': cursor or room[cursor_field(request.user.id, room['buyer_id'])]})
 
 
-        return Message.objects.filter(chat_room=chat_room).order_by('timestamp')
+def get_member_room(pk, user):
+    """The room's members and read cursors, or NotFound / PermissionDenied for anyone outside it."""
+    room = (
+        ChatRoom.objects.filter(id=pk)
+        .values('id', 'buyer_id', 'seller_id', 'buyer_last_read_id', 'seller_last_read_id').first()
+    )
+    if room is None:
+        raise NotFound("Chat room does not exist.")
+    if user.id not in (room['buyer_id'], room['seller_id']):
+        raise PermissionDenied("You do not have permission to view these messages.")
+    return room
 
 
@@ -0,0 +1,141 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .inbox import record_messages
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MessageWriter:
+    """
+    Write-behind persistence for chat messages.
+
+    Consumers submit() a message and broadcast it straight away; one writer
+    thread per process drains the queue and inserts messages with bulk_create
+    in batches of up to CHAT_WRITE_BATCH_SIZE, waiting at most
+    CHAT_WRITE_INTERVAL seconds to fill one. A single thread reading a FIFO
+    queue keeps insert order (and so message ids) in submit order, but only
+    within this process: with several workers, ids follow the order batches
+    reach the database. Each message's timestamp is taken when it is
+    submitted, not when it is written, so (timestamp, id) is what orders a
+    room's history across workers.
+    flush() blocks until everything submitted before it is in the database;
+    close() is registered with atexit so a clean shutdown loses nothing, and
+    submit() refuses messages from then on rather than write them on the
+    caller's thread, which is usually the event loop.
+    """
+
+    def __init__(self, batch_size=None, interval=None):
+        self.batch_size = batch_size or getattr(settings, 'CHAT_WRITE_BATCH_SIZE', 200)
+        self.interval = interval if interval is not None else getattr(settings, 'CHAT_WRITE_INTERVAL', 0.05)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.written = self.batches = self.failed = 0
+
+    def submit(self, chat_room_id, sender_id, content, client_id=''):
+        """Queue a message and return it, unsaved; None once the writer is closed."""
+        if self._closed:
+            logger.warning("Refusing a chat message for room %s: the writer is shut down", chat_room_id)
+            return None
+        message = Message(
+            chat_room_id=chat_room_id, sender_id=sender_id, content=content,
+            client_id=client_id, timestamp=timezone.now(),
+        )
+        self._start()
+        self._queue.put(message)
+        return message
+
+    def flush(self, timeout=None):
+        """Wait until every message submitted so far has been written. Returns False on timeout."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        with self._lock:
+            if self._closed or self._thread is None:
+                self._closed = True
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-message-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, waiters = [], []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break  # a flush is waiting: write now rather than at the deadline
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, batch):
+        # The thread keeps its connection between batches instead of reconnecting per request
+        try:
+            Message.objects.bulk_create(batch)
+            self.written += len(batch)
+            stored = batch
+        except Exception:
+            # One bad row (say, its room was deleted) must not take the rest of the batch with it,
+            # and a connection the server has dropped is reopened for the retries
+            logger.exception("Bulk insert of %s chat messages failed; retrying one by one", len(batch))
+            connection.close()
+            stored = []
+            for message in batch:
+                try:
+                    message.save(force_insert=True)
+                    self.written += 1
+                    stored.append(message)
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Dropping chat message for room %s", message.chat_room_id)
+        self.batches += 1
+        try:
+            record_messages(stored)
+        except Exception:
+            logger.exception("Could not update inbox summaries for %s chat messages", len(stored))
+
+
+message_writer = MessageWriter()
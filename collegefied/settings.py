@@ -77,6 +77,15 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Shared cache: feed invalidation generations and other cross-worker state live here,
+# so it must be shared by all workers (Redis, same server as the channel layer)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/1",
+    }
+}
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
@@ -112,12 +121,83 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
     # 'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     # 'PAGE_SIZE': 10 # You can change this to any number
 }
 
+# Default page size for the cursor-paginated product feeds (clients may pass ?page_size= up to 100)
+PRODUCT_FEED_PAGE_SIZE = 20
+
+# Seconds between checks for products changed by other workers (see api.search)
+SEARCH_INDEX_SYNC_INTERVAL = 5
+# Shared change log for those checks: entry lifetime, and how far behind a worker may replay before rebuilding
+SEARCH_INDEX_LOG_TTL = 3600
+SEARCH_INDEX_LOG_MAX = 1000
+
+# Product image uploads: files over 512 KB spool to a temp file instead of memory, and
+# api.uploads caps how many images and bytes a single request may send
+FILE_UPLOAD_MAX_MEMORY_SIZE = 512 * 1024
+PRODUCT_IMAGE_MAX_COUNT = 8
+PRODUCT_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+PRODUCT_UPLOAD_MAX_BYTES = 40 * 1024 * 1024
+PRODUCT_IMAGE_MAX_PIXELS = 40_000_000
+
+# Seconds an authenticated user's columns stay cached by api.authentication.CachedJWTAuthentication
+AUTH_USER_CACHE_TTL = 60
+
+# Per-process cache of decoded socket tokens (see chats.middleware); users come from the shared cache
+SOCKET_AUTH_CACHE_ENTRIES = 10000
+SOCKET_AUTH_CACHE_TTL = 60
+
+# Chat messages are stored by a write-behind thread (see chats.writer) in batches of up to
+# CHAT_WRITE_BATCH_SIZE, each collected for at most CHAT_WRITE_INTERVAL seconds
+CHAT_WRITE_BATCH_SIZE = 200
+CHAT_WRITE_INTERVAL = 0.05
+
+# Presence entries expire this long (seconds) after a socket's last frame; typing
+# indicators are relayed at most once per CHAT_TYPING_INTERVAL per socket
+CHAT_PRESENCE_TTL = 60
+CHAT_TYPING_INTERVAL = 2
+
+# Largest frame a client may send once inflated (msgpack+deflate subprotocol)
+CHAT_MAX_FRAME_BYTES = 64 * 1024
+
+# How long a room's members and active flag stay cached for socket connects (seconds)
+CHAT_ROOM_ACCESS_TTL = 300
+
+# Read receipts from a socket are merged and written at most this often (seconds)
+CHAT_READ_COALESCE = 0.5
+
+# Messages per page of chat history (clients may pass ?page_size= up to 200)
+CHAT_HISTORY_PAGE_SIZE = 50
+
+# One-time codes (see api.otp): lifetime, wrong guesses allowed per code, and codes sent per window
+OTP_TTL = 300
+OTP_MAX_ATTEMPTS = 5
+OTP_MAX_SENDS = 5
+OTP_RESEND_WINDOW = 3600
+
+# Background jobs (see api.jobs, run with `manage.py run_jobs`): retries back off exponentially
+# from JOB_RETRY_BASE up to JOB_RETRY_MAX seconds, and a job left running past JOB_LOCK_TIMEOUT is retried
+JOB_POLL_INTERVAL = 1.0
+JOB_RETRY_BASE = 30
+JOB_RETRY_MAX = 3600
+JOB_LOCK_TIMEOUT = 600
+
+# Resized image variants (see api.images) are rendered in this many background threads per worker
+IMAGE_VARIANT_WORKERS = 2
+IMAGE_VARIANTS_ASYNC = True
+
+# Per-worker LRU of rendered feed pages (see api.caching); entries also expire after the TTL
+PRODUCT_FEED_CACHE_ENTRIES = 512
+PRODUCT_FEED_CACHE_TTL = 300
+
 AUTHENTICATION_BACKENDS = [
     "django.contrib.auth.backends.ModelBackend",
 ]